@@ -0,0 +1,266 @@
+# Lichess.org Testing with Selenium
+# Signed-in sessions captured once and injected into new browser sessions, shared by parallel workers
+
+from urllib.parse import urlsplit
+import threading
+import json
+import time
+import os
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+    import msvcrt
+
+
+SESSIONS_PATH = "auth_sessions.json"    # holds live sign-in cookies: keep it out of version control
+LOCK_TIMEOUT_SECONDS = 120              # a worker waits this long for another one's fresh sign-in
+LOCK_POLL_SECONDS = 0.05
+
+# One round-trip each: everything in the page's local storage, and putting it back
+READ_STORAGE_SCRIPT = """
+var items = {};
+for (var i = 0; i < window.localStorage.length; i++) {
+    var key = window.localStorage.key(i);
+    items[key] = window.localStorage.getItem(key);
+}
+return items;
+"""
+
+RESTORE_STORAGE_SCRIPT = """
+var items = arguments[0];
+for (var key in items) window.localStorage.setItem(key, items[key]);
+"""
+
+
+def origin_of(url):
+    parts = urlsplit(url)
+    return "{}://{}".format(parts.scheme, parts.netloc)
+
+
+class FileLock:
+    """ An exclusive lock on a file, held across processes, and across threads as long as each uses a
+    FileLock of its own (it locks its own descriptor). Blocks until it is free or timeout seconds went by """
+    path = None
+    lock_file = None
+
+    def __init__(self, path, timeout=LOCK_TIMEOUT_SECONDS):
+        self.path = path
+        self.timeout = timeout
+
+    def try_lock(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self.lock_file.seek(0)
+                msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self):
+        self.lock_file = open(self.path, "a+")
+        deadline = time.perf_counter() + self.timeout
+        while not self.try_lock():
+            if time.perf_counter() > deadline:
+                self.lock_file.close()
+                self.lock_file = None
+                raise TimeoutError("Could not lock {} within {}s".format(self.path, self.timeout))
+            time.sleep(LOCK_POLL_SECONDS)
+        return self
+
+    def release(self):
+        if self.lock_file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.lock_file.seek(0)
+            msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.lock_file.close()
+        self.lock_file = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class AuthSession:
+    """ What a browser needs to be signed in on an origin: its cookies, as WebDriver returns them, and the
+    page's local storage """
+    username = None
+    origin = None
+    cookies = None
+    local_storage = None
+    saved_at = None
+
+    def __init__(self, username, origin, cookies, local_storage=None, saved_at=None):
+        self.username = username
+        self.origin = origin
+        self.cookies = cookies
+        self.local_storage = local_storage if local_storage is not None else dict()
+        self.saved_at = saved_at if saved_at is not None else time.time()
+
+    def live_cookies(self, now=None):
+        """ The cookies that have not expired yet, session cookies included """
+        now = now if now is not None else time.time()
+        return [cookie for cookie in self.cookies if cookie.get("expiry") is None or cookie["expiry"] > now]
+
+    def is_expired(self, now=None):
+        """ A cheap check before touching the browser: True once no cookie is left """
+        return not self.live_cookies(now)
+
+    def cookie_params(self):
+        """ The live cookies as DevTools Network.setCookies parameters. Host-only cookies (no leading dot)
+        are bound to the origin's url, which keeps them host-only """
+        params = []
+        for cookie in self.live_cookies():
+            param = {"name": cookie["name"], "value": cookie["value"], "path": cookie.get("path", "/"),
+                     "secure": cookie.get("secure", False), "httpOnly": cookie.get("httpOnly", False)}
+            domain = cookie.get("domain")
+            if domain and domain.startswith("."):
+                param["domain"] = domain
+            else:
+                param["url"] = self.origin + param["path"]
+            if cookie.get("sameSite"):
+                param["sameSite"] = cookie["sameSite"]
+            if cookie.get("expiry") is not None:
+                param["expires"] = cookie["expiry"]
+            params.append(param)
+        return params
+
+    def as_dict(self):
+        return {"username": self.username, "origin": self.origin, "cookies": self.cookies,
+                "local_storage": self.local_storage, "saved_at": self.saved_at}
+
+    @classmethod
+    def from_dict(cls, entry):
+        return cls(entry["username"], entry["origin"], entry["cookies"], entry.get("local_storage"),
+                   entry.get("saved_at"))
+
+
+def capture_session(driver, username, origin=None):
+    """ Copy the signed-in state of the page the driver shows, on origin (by default the page's own) """
+    cookies = driver.get_cookies()
+    local_storage = driver.execute_script(READ_STORAGE_SCRIPT) or dict()
+    return AuthSession(username, origin if origin is not None else origin_of(driver.current_url), cookies,
+                       local_storage)
+
+
+class SessionStore:
+    """ Signed-in sessions by origin and username in one JSON file, so a sign-in through the form happens
+    once and every later browser, in any worker process, starts signed in:
+
+    store = SessionStore()
+    store.sign_in(lichess_website_tester, "Throwawayy123", "123456")   # "restored" or "signed_in"
+
+    Writes replace the file atomically, so reads never see half of one. A fresh sign-in holds the store's
+    lock: workers that find the session expired at the same time sign in once, the others reuse it """
+    path = None
+
+    def __init__(self, path=SESSIONS_PATH, lock_timeout=LOCK_TIMEOUT_SECONDS):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.lock_timeout = lock_timeout
+        self.stats = {"restored": 0, "signed_in": 0, "rejected": 0}
+        self.stats_lock = threading.Lock()     # scenario threads share one store
+
+    def count(self, outcome):
+        with self.stats_lock:
+            self.stats[outcome] += 1
+
+    def locked(self):
+        """ The store's lock, a FileLock per use so threads sharing the store exclude each other too """
+        return FileLock(self.lock_path, self.lock_timeout)
+
+    @staticmethod
+    def key(origin, username):
+        return "{} {}".format(origin, username)
+
+    def read(self):
+        try:
+            with open(self.path) as sessions_file:
+                return json.load(sessions_file)
+        except (OSError, ValueError):
+            return dict()
+
+    def write(self, entries):
+        temporary = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(temporary, "w") as sessions_file:
+            json.dump(entries, sessions_file, indent=1)
+        if hasattr(os, "chmod"):
+            os.chmod(temporary, 0o600)
+        os.replace(temporary, self.path)
+
+    def load(self, origin, username):
+        entry = self.read().get(self.key(origin, username))
+        return AuthSession.from_dict(entry) if entry is not None else None
+
+    def save(self, session):
+        """ Store a session. The caller holds the lock """
+        entries = self.read()
+        entries[self.key(session.origin, session.username)] = session.as_dict()
+        self.write(entries)
+
+    def restore(self, tester, session):
+        """ Inject a session into the tester's browser, load the site and check the user tag.
+        Returns whether the page came up signed in. Local storage can only be written once a page of the
+        site is open, and that page's scripts have read it by then: the site is loaded again when there is
+        any to restore """
+        if session.is_expired():
+            return False
+        tester.driver.execute_cdp_cmd("Network.setCookies", {"cookies": session.cookie_params()})
+        tester.open_website()
+        if session.local_storage:
+            tester.driver.execute_script(RESTORE_STORAGE_SCRIPT, session.local_storage)
+            tester.open_website()
+        if tester.is_signed_in():
+            return True
+        self.count("rejected")
+        return False
+
+    def sign_in(self, tester, username, password):
+        """ Make the tester's browser signed in as username: with the stored session when the site still
+        accepts it, otherwise through the sign-in form, storing the new session. Returns "restored" or
+        "signed_in" """
+        origin = origin_of(tester.url)
+        session = self.load(origin, username)
+        if session is not None and self.restore(tester, session):
+            self.count("restored")
+            return "restored"
+
+        with self.locked():
+            latest = self.load(origin, username)
+            if latest is not None and (session is None or latest.saved_at != session.saved_at) \
+                    and self.restore(tester, latest):
+                # another worker signed in while this one waited for the lock
+                self.count("restored")
+                return "restored"
+            tester.driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            tester.sign_in_with_form(username, password)
+            self.save(capture_session(tester.driver, username, origin))
+        self.count("signed_in")
+        return "signed_in"
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="List or drop the stored signed-in sessions")
+    parser.add_argument("path", nargs="?", default=SESSIONS_PATH)
+    parser.add_argument("--clear", action="store_true", help="drop every stored session")
+    arguments = parser.parse_args()
+
+    store = SessionStore(arguments.path)
+    if arguments.clear:
+        with store.locked():
+            store.write(dict())
+    for entry in store.read().values():
+        session = AuthSession.from_dict(entry)
+        print("{:<40}{:<20}{:>4} cookies  saved {}  {}".format(
+            session.origin, session.username, len(session.cookies),
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(session.saved_at)),
+            "expired" if session.is_expired() else "live"))
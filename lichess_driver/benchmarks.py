@@ -0,0 +1,377 @@
+# Lichess.org Testing with Selenium
+# Offline benchmarks: WebDriver calls, wall time and Python memory of the tester operations, kept per commit
+
+from main import LichessTester, LichessEngine, play, MAX_WAIT_FOR_SECONDS, INPUT_MODE
+from engines import BrowserEngine, BROWSER_SYNC, BROWSER_SYNC_MODES
+from fixture_server import FixtureServer, PUZZLES, get_puzzle
+from fake_driver import FakeDriver, FAKE_URL
+from driver_pool import DriverPool
+from snapshot import key_to_position
+from gestures import INPUT_MODES
+from orchestrator import Orchestrator
+from shared_browser import SharedBrowser, ISOLATION_MODES, SHARED_BROWSER_ARGUMENTS
+from selenium.common.exceptions import WebDriverException
+import waits
+import collections
+import contextlib
+import subprocess
+import tracemalloc
+import argparse
+import datetime
+import json
+import time
+import sys
+import os
+
+
+RESULTS_PATH = "benchmark_results.jsonl"   # in the working directory, like every run artifact
+DEFAULT_ITERATIONS = 20
+MEMORY_ITERATIONS = 3           # extra traced runs per operation, tracemalloc slows Python down too much to time them
+REGRESSION_TOLERANCE = 0.15     # wall time and memory may grow this much before a change counts as a regression
+FAKE_STEP_TIMEOUT_SECONDS = 2   # the fake pages answer at once, a step that takes longer will never finish
+
+OPERATIONS = ("board_snapshot", "make_move", "pgn_read", "puzzle_solve", "puzzle_solve_concurrent")
+
+
+class CommandCounter:
+    """ Counts the WebDriver commands a session sends by wrapping its execute method. Every command of a
+    selenium session (find_element, execute_script, element properties, actions) goes through execute,
+    so the count is the number of round-trips to chromedriver """
+    driver = None
+    counts = None
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.counts = collections.Counter()
+        self.original_execute = driver.execute
+        driver.execute = self.execute
+
+    def execute(self, driver_command, params=None):
+        self.counts[driver_command] += 1
+        return self.original_execute(driver_command, params)
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def reset(self):
+        self.counts.clear()
+
+    def detach(self):
+        """ Give the session its own execute method back """
+        del self.driver.execute
+
+
+class FakeEnvironment:
+    """ A puzzle and an analysis session served by fake_driver.FakeDriver, no browser or network needed.
+    latency adds a fixed cost per command, e.g. 0.002 for a local chromedriver. With shared_browser
+    ("window" or "context") both are windows of one fake session, see shared_browser.SharedBrowser """
+    name = "fake"
+    shared_browser = None
+
+    def __init__(self, latency=0.0, shared_browser=None):
+        self.latency = latency
+        self.base_url = FAKE_URL
+        if shared_browser:
+            self.shared_browser = SharedBrowser(FakeDriver(latency=latency), shared_browser)
+            self.puzzle_driver = self.shared_browser.open_window("puzzle")
+            self.engine_driver = self.shared_browser.open_window("engine")
+            # the session's own commands, window switches included
+            self.drivers = [self.shared_browser.driver]
+        else:
+            self.puzzle_driver = FakeDriver(latency=latency)
+            self.engine_driver = FakeDriver(latency=latency)
+            self.drivers = [self.puzzle_driver, self.engine_driver]
+        self.step_timeouts = {step: FAKE_STEP_TIMEOUT_SECONDS for step in waits.STEP_TIMEOUTS}
+
+    def describe(self):
+        return {"driver": self.name, "latency_ms": self.latency*1000,
+                "shared_browser": self.shared_browser.isolation if self.shared_browser is not None else None}
+
+    def close(self):
+        pass
+
+
+class ChromeEnvironment:
+    """ Two headless Chrome sessions on the local fixture server, or two windows of one with shared_browser """
+    name = "chrome"
+    fixture = None
+    pool = None
+    shared_browser = None
+
+    def __init__(self, headless=True, executable_path=None, shared_browser=None):
+        self.fixture = FixtureServer().start()
+        self.base_url = self.fixture.url
+        self.pool = DriverPool(size=1 if shared_browser else 2, headless=headless, executable_path=executable_path,
+                               arguments=SHARED_BROWSER_ARGUMENTS if shared_browser else ()).start()
+        if shared_browser:
+            self.shared_browser = SharedBrowser(isolation=shared_browser, driver_pool=self.pool)
+            self.puzzle_driver = self.shared_browser.open_window("puzzle")
+            self.engine_driver = self.shared_browser.open_window("engine")
+            self.drivers = [self.shared_browser.driver]
+        else:
+            self.puzzle_driver = self.pool.acquire()
+            self.engine_driver = self.pool.acquire()
+            self.drivers = [self.puzzle_driver, self.engine_driver]
+        self.step_timeouts = None
+
+    def describe(self):
+        return {"driver": self.name, "latency_ms": None,
+                "shared_browser": self.shared_browser.isolation if self.shared_browser is not None else None}
+
+    def close(self):
+        if self.shared_browser is not None:
+            self.shared_browser.close()
+        else:
+            for driver in (self.puzzle_driver, self.engine_driver):
+                self.pool.release(driver)
+        self.pool.close()
+        self.fixture.stop()
+
+
+def percentile(samples, fraction):
+    """ Return the sample below which the given fraction of the sorted samples lie """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction*len(ordered)))]
+
+
+def measure(operation, counters, iterations, setup=None):
+    """ Run operation() iterations times and return its calls, wall time and peak Python allocation.
+    setup() runs before every iteration and is not measured. A WebDriverException (timeouts included)
+    counts as a failure """
+    wall = []
+    calls = collections.Counter()
+    failures = 0
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        for counter in counters:
+            counter.reset()
+        start = time.perf_counter()
+        try:
+            operation()
+        except WebDriverException:
+            failures += 1
+        wall.append(time.perf_counter() - start)
+        for counter in counters:
+            calls.update(counter.counts)
+
+    peak = 0
+    for _ in range(min(MEMORY_ITERATIONS, iterations)):
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            operation()
+        except WebDriverException:
+            pass
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "calls": sum(calls.values())/iterations,
+        "calls_by_command": {command: count/iterations for command, count in sorted(calls.items())},
+        "wall_ms": {
+            "mean": 1000*sum(wall)/len(wall),
+            "p50": 1000*percentile(wall, 0.5),
+            "max": 1000*max(wall)
+        },
+        "peak_kib": peak/1024,
+        "failures": failures
+    }
+
+
+def run_benchmarks(environment, iterations=DEFAULT_ITERATIONS, puzzle_id=PUZZLES[0]["id"], operations=OPERATIONS,
+                   input_mode=None, engine_sync=BROWSER_SYNC):
+    """ Benchmark the tester operations of one environment and return {operation: measurement}.
+    input_mode overrides main.INPUT_MODE for both testers, engine_sync is the BrowserEngine sync mode """
+    puzzle = get_puzzle(puzzle_id)
+    solution = puzzle["plies"][puzzle["start"]]
+
+    lichess_website_tester = LichessTester(driver=environment.puzzle_driver)
+    lichess_website_tester.url = environment.base_url
+    lichess_engine = LichessEngine(driver=environment.engine_driver)
+    lichess_engine.url = environment.base_url + "/analysis"
+    for tester in (lichess_website_tester, lichess_engine):
+        if input_mode is not None:
+            tester.gestures.mode = input_mode
+        if environment.step_timeouts:
+            tester.waiter = waits.Waiter(tester.driver, MAX_WAIT_FOR_SECONDS, environment.step_timeouts)
+    engine = BrowserEngine(lichess_engine, engine_sync)
+    engine.open()
+    puzzle_board = lichess_website_tester.get_board()
+    orchestrator = Orchestrator(lichess_website_tester, engine)
+
+    def open_puzzle():
+        lichess_website_tester.open_puzzle(puzzle_id)
+        lichess_website_tester.wait_for_puzzle_ready()
+
+    def make_move():
+        puzzle_board.make_move(key_to_position(solution[1]), key_to_position(solution[2]))
+
+    def puzzle_solve():
+        play(lichess_website_tester, engine, click_continue=False)
+
+    def puzzle_solve_concurrent():
+        orchestrator.play(click_continue=False)
+
+    benchmarks = {
+        "board_snapshot": (puzzle_board.update_board_state, None),
+        "make_move": (make_move, open_puzzle),
+        "pgn_read": (lichess_website_tester.get_puzzle_pgn, None),
+        "puzzle_solve": (puzzle_solve, open_puzzle),
+        "puzzle_solve_concurrent": (puzzle_solve_concurrent, open_puzzle),
+    }
+    counters = [CommandCounter(driver) for driver in environment.drivers]
+    results = dict()
+    try:
+        # keep anything the testers print out of the report and out of the timings' noise
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            open_puzzle()
+            for name in operations:
+                operation, setup = benchmarks[name]
+                results[name] = measure(operation, counters, iterations, setup)
+    finally:
+        orchestrator.close()
+        for counter in counters:
+            counter.detach()
+    return results
+
+
+def git_revision():
+    """ Return (short commit hash, working tree has uncommitted changes) of the checkout, or ("unknown", False) """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=directory, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=directory,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, bool(status)
+
+
+def make_record(environment, results, iterations, puzzle_id, input_mode, engine_sync=BROWSER_SYNC):
+    commit, dirty = git_revision()
+    record = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "iterations": iterations,
+        "input": input_mode,
+        "engine_sync": engine_sync,
+        "puzzle": puzzle_id,
+        "python": sys.version.split()[0],
+        "results": results
+    }
+    record.update(environment.describe())
+    return record
+
+
+def load_previous(path, record):
+    """ Return the latest stored record measured with the same driver setup, or None """
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path) as results_file:
+        for line in results_file:
+            line = line.strip()
+            if not line:
+                continue
+            candidate = json.loads(line)
+            if candidate["driver"] == record["driver"] and candidate["latency_ms"] == record["latency_ms"] \
+                    and candidate.get("input", INPUT_MODE) == record["input"] \
+                    and candidate.get("engine_sync", "import") == record["engine_sync"] \
+                    and candidate.get("shared_browser") == record["shared_browser"]:
+                previous = candidate
+    return previous
+
+
+def save_record(path, record):
+    """ Append a record to the results file, one JSON object per line """
+    with open(path, "a") as results_file:
+        results_file.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def compare(previous, record, tolerance=REGRESSION_TOLERANCE):
+    """ Return {operation: [regression descriptions]} between two records. Any extra WebDriver call or
+    failure is a regression, wall time and memory only beyond the tolerance """
+    regressions = dict()
+    for name, current in record["results"].items():
+        before = previous["results"].get(name)
+        if before is None:
+            continue
+        found = []
+        if current["calls"] > before["calls"]:
+            found.append("calls {:.1f} -> {:.1f}".format(before["calls"], current["calls"]))
+        if current["failures"] > before["failures"]:
+            found.append("failures {} -> {}".format(before["failures"], current["failures"]))
+        if current["wall_ms"]["p50"] > before["wall_ms"]["p50"]*(1 + tolerance):
+            found.append("p50 {:.2f}ms -> {:.2f}ms".format(before["wall_ms"]["p50"], current["wall_ms"]["p50"]))
+        if current["peak_kib"] > before["peak_kib"]*(1 + tolerance):
+            found.append("memory {:.1f}KiB -> {:.1f}KiB".format(before["peak_kib"], current["peak_kib"]))
+        if found:
+            regressions[name] = found
+    return regressions
+
+
+def print_report(record, previous=None, regressions=None):
+    print("{} driver{}, {} input, {} engine sync, commit {}{}, {} iterations on {}".format(
+        record["driver"], " ({} shared browser)".format(record["shared_browser"]) if record["shared_browser"] else "",
+        record["input"], record["engine_sync"], record["commit"], " (dirty)" if record["dirty"] else "",
+        record["iterations"], record["puzzle"]))
+    if previous is not None:
+        print("compared with commit {} from {}".format(previous["commit"], previous["timestamp"]))
+    print("{:<24}{:>10}{:>12}{:>12}{:>12}{:>10}".format("operation", "calls", "p50 ms", "mean ms", "peak KiB",
+                                                         "failures"))
+    for name, result in record["results"].items():
+        line = "{:<24}{:>10.1f}{:>12.2f}{:>12.2f}{:>12.1f}{:>10}".format(
+            name, result["calls"], result["wall_ms"]["p50"], result["wall_ms"]["mean"], result["peak_kib"],
+            result["failures"])
+        if previous is not None and name in previous["results"]:
+            line += "   calls {:+.1f}".format(result["calls"] - previous["results"][name]["calls"])
+        if regressions and name in regressions:
+            line += "   REGRESSION: " + ", ".join(regressions[name])
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the tester operations offline")
+    parser.add_argument("--driver", choices=("fake", "chrome"), default="fake",
+                        help="in-process fake driver, or headless Chrome on the local fixture server")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated cost of one fake driver command")
+    parser.add_argument("--puzzle", default=PUZZLES[0]["id"], help="fixture puzzle to benchmark on")
+    parser.add_argument("--operations", nargs="*", choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument("--input", choices=INPUT_MODES, default=INPUT_MODE, help="how board moves are sent")
+    parser.add_argument("--engine-sync", choices=BROWSER_SYNC_MODES, default=BROWSER_SYNC,
+                        help="how the analysis board is given the engine's own moves")
+    parser.add_argument("--shared-browser", choices=ISOLATION_MODES, default=None,
+                        help="run the puzzle and engine sessions as two windows of one browser")
+    parser.add_argument("--headed", action="store_true", help="show the Chrome windows")
+    parser.add_argument("--chromedriver", default=None, help="chromedriver path, selenium finds one by default")
+    parser.add_argument("--results", default=RESULTS_PATH, help="JSONL file the results are appended to")
+    parser.add_argument("--no-save", action="store_true", help="only compare, do not store this run")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    arguments = parser.parse_args()
+
+    if arguments.driver == "chrome":
+        environment = ChromeEnvironment(headless=not arguments.headed, executable_path=arguments.chromedriver,
+                                        shared_browser=arguments.shared_browser)
+    else:
+        environment = FakeEnvironment(latency=arguments.latency_ms/1000, shared_browser=arguments.shared_browser)
+    try:
+        results = run_benchmarks(environment, arguments.iterations, arguments.puzzle, arguments.operations,
+                                 arguments.input, arguments.engine_sync)
+    finally:
+        environment.close()
+
+    record = make_record(environment, results, arguments.iterations, arguments.puzzle, arguments.input,
+                         arguments.engine_sync)
+    previous = load_previous(arguments.results, record)
+    regressions = compare(previous, record) if previous is not None else dict()
+    print_report(record, previous, regressions)
+    if not arguments.no_save:
+        save_record(arguments.results, record)
+    if regressions and arguments.fail_on_regression:
+        sys.exit(1)
@@ -0,0 +1,296 @@
+# Lichess.org Testing with Selenium
+# Board events pushed from the page by a MutationObserver and drained in batches, instead of polling the board
+
+from selenium.common.exceptions import JavascriptException, TimeoutException
+from waits import WaitCancelled
+import collections
+import time
+
+
+LONG_POLL_MS = 2000     # a drain waits this long in the page for the next event before returning empty-handed
+CANCEL_POLL_MS = 250    # drains of a cancellable wait are this short, so a cancel is seen within that time
+EVENT_TYPES = ("piece_moved", "last_move", "move", "complete", "pv")
+
+# Installs the observer and returns the page's current state. The observer watches the cg-board, the moves table,
+# the engine line and the puzzle-complete marker, and reads them again on every batch of their mutations: a few
+# dozen children, in the page, instead of a round-trip per poll. lichess.org replaces these nodes as it goes, so a
+# second observer follows the body's children only, and moves the first one to a source's new node when it came
+# or went. Events are handed to a waiting drain from the observer's own callback, in the task that rendered them.
+# Arguments: cg-board css, moves table xpath, engine line css, puzzle-complete css (the last three optional)
+INSTALL_SCRIPT = """
+var sources = {board: arguments[0], moves: arguments[1], pv: arguments[2], complete: arguments[3]};
+if (window.__boardEvents) {
+    window.__boardEvents.observer.disconnect();
+    window.__boardEvents.structure.disconnect();
+}
+function find() {
+    return {
+        board: document.querySelector(sources.board),
+        moves: sources.moves ? document.evaluate(sources.moves, document, null,
+            XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue : null,
+        pv: sources.pv ? document.querySelector(sources.pv) : null,
+        complete: sources.complete ? document.querySelector(sources.complete) : null
+    };
+}
+var nodes = find();
+function read() {
+    var state = {last_move: null, pieces: null, ply: null, san: null, complete: false, pv: null, uci: null};
+    var board = nodes.board;
+    if (board) {
+        var keys = [], pieces = [];
+        for (var i = 0; i < board.children.length; i++) {
+            var node = board.children[i];
+            if (node.className === 'last-move') keys.push(node.cgKey);
+            else if (node.localName === 'piece') pieces.push(node.className + ':' + (node.cgKey || ''));
+        }
+        state.last_move = keys.length === 2 ? keys : null;
+        state.pieces = pieces.join(',');
+    }
+    var table = nodes.moves;
+    if (table) {
+        state.ply = 0;
+        for (var j = 0; j < table.children.length; j++) {
+            if (table.children[j].localName !== 'move') continue;
+            state.ply++;
+            state.san = table.children[j].textContent.trim();
+        }
+    }
+    state.complete = !!nodes.complete && nodes.complete.getClientRects().length > 0;
+    var pv = nodes.pv;
+    if (pv && pv.childNodes.length >= 3) {
+        state.pv = pv.innerText.trim() || null;
+        state.uci = (pv.getAttribute('data-uci') || '').split(' ')[0] || null;
+    }
+    return state;
+}
+var events = {queue: [], seq: 0, waiter: null, timer: null, state: read()};
+function emit(type, fields) {
+    fields.type = type;
+    fields.seq = ++events.seq;
+    fields.time = performance.now();
+    events.queue.push(fields);
+}
+function update() {
+    var state = read(), before = events.state;
+    if (state.pieces !== before.pieces) emit('piece_moved', {pieces: state.pieces});
+    if (String(state.last_move) !== String(before.last_move)) emit('last_move', {squares: state.last_move});
+    if (state.ply !== before.ply) emit('move', {ply: state.ply, san: state.san});
+    if (state.complete !== before.complete) emit('complete', {complete: state.complete});
+    if (state.pv !== before.pv) emit('pv', {text: state.pv, uci: state.uci});
+    events.state = state;
+    if (events.waiter && events.queue.length) {
+        var waiter = events.waiter;
+        events.waiter = null;
+        clearTimeout(events.timer);
+        waiter(events.queue.splice(0));
+    }
+}
+function watch() {
+    events.observer.disconnect();
+    for (var name in nodes) {
+        if (!nodes[name]) continue;
+        // pieces move by their style, the other sources only by their children, text and classes
+        events.observer.observe(nodes[name], {childList: true, subtree: true, characterData: true, attributes: true,
+                                              attributeFilter: name === 'board' ? ['class', 'style'] : ['class']});
+    }
+}
+events.observer = new MutationObserver(update);
+events.structure = new MutationObserver(function() {
+    var found = find();
+    for (var name in found) {
+        if (found[name] !== nodes[name]) {
+            nodes = found;
+            watch();
+            update();
+            return;
+        }
+    }
+});
+watch();
+events.structure.observe(document.body, {childList: true, subtree: true});
+window.__boardEvents = events;
+return events.state;
+"""
+
+# Long poll: the events buffered since the last drain, or the next ones within arguments[0] ms, or [] when
+# none came. null once the page was replaced and the observer with it
+DRAIN_SCRIPT = """
+var done = arguments[arguments.length - 1];
+var events = window.__boardEvents;
+if (!events) { done(null); return; }
+if (events.queue.length) { done(events.queue.splice(0)); return; }
+if (events.waiter) events.waiter([]);
+events.waiter = done;
+events.timer = setTimeout(function() {
+    if (events.waiter === done) { events.waiter = null; done([]); }
+}, arguments[0]);
+"""
+
+
+class BoardEvent:
+    """ Something that changed on the page: "piece_moved" (pieces), "last_move" (squares), "move" (ply and san
+    of the moves table's last move), "complete" (whether the puzzle shows as solved) or "pv" (the engine line's
+    text and uci). seq numbers the events of a page, time is the page's performance.now() in ms """
+    type = None
+    seq = None
+    time = None
+    squares = None
+    pieces = None
+    ply = None
+    san = None
+    complete = None
+    text = None
+    uci = None
+
+    def __init__(self, entry):
+        for name in ("type", "seq", "time", "squares", "pieces", "ply", "san", "complete", "text", "uci"):
+            setattr(self, name, entry.get(name))
+
+    def __repr__(self):
+        fields = ", ".join("{}={!r}".format(name, getattr(self, name))
+                           for name in ("squares", "ply", "san", "complete", "text") if getattr(self, name) is not None)
+        return "BoardEvent({}{})".format(self.type, ", " + fields if fields else "")
+
+
+class BoardEventStream:
+    """ The events of one board, pushed by the page and pulled in batches with one execute_async_script each.
+
+    events = BoardEventStream(driver, "cg-board", moves_xpath=..., complete_css="div[class=\\"complete\\"]")
+    for event in events:            # or events.next(timeout), events.drain()
+        ...
+    events.wait_until(lambda state: state["ply"] >= 4 or state["complete"], step="puzzle_reply")
+
+    state holds the latest value of every source (pieces, last_move, ply, san, complete, pv, uci), as of the
+    install and the events drained since. changes counts the board's piece and highlight changes for as long as
+    the stream lives, a page load that shows another board included. A page load drops the observer, the next
+    drain installs it again on the new page. cancel (a threading.Event, like waits.Waiter.cancel) makes a wait
+    give up """
+    driver = None
+    board_css = None
+    moves_xpath = None
+    pv_css = None
+    complete_css = None
+    long_poll_ms = None
+    state = None
+    changes = 0
+    cancel = None
+
+    def __init__(self, driver, board_css, moves_xpath=None, pv_css=None, complete_css=None, long_poll_ms=LONG_POLL_MS):
+        self.driver = driver
+        self.board_css = board_css
+        self.moves_xpath = moves_xpath
+        self.pv_css = pv_css
+        self.complete_css = complete_css
+        self.long_poll_ms = long_poll_ms
+        self.installed = False
+        self.synced = False
+        self.pending = collections.deque()
+        self.state = dict()
+        self.stats = {"installs": 0, "drains": 0, "empty_drains": 0, "events": 0}
+
+    def install(self):
+        """ Start observing the page the driver shows, from its current state """
+        state = self.driver.execute_script(INSTALL_SCRIPT, self.board_css, self.moves_xpath, self.pv_css,
+                                           self.complete_css)
+        state = state or dict()
+        # a new page counts as a change only when it shows another board than the last one seen, so a reload
+        # midway through a wait_until cannot pass for the change it waits for
+        if self.stats["installs"] and (state.get("pieces"), state.get("last_move")) != \
+                (self.state.get("pieces"), self.state.get("last_move")):
+            self.changes += 1
+        self.state = state
+        self.pending.clear()
+        self.installed = True
+        self.stats["installs"] += 1
+        return self.state
+
+    def reset(self):
+        """ Forget the page, e.g. after a navigation. The next drain installs the observer again """
+        self.installed = False
+        self.synced = False
+        self.pending.clear()
+
+    def apply(self, event):
+        """ Fold an event into state """
+        if event.type == "piece_moved":
+            self.state["pieces"] = event.pieces
+            self.changes += 1
+        elif event.type == "last_move":
+            self.state["last_move"] = event.squares
+            self.changes += 1
+        elif event.type == "move":
+            self.state["ply"] = event.ply
+            self.state["san"] = event.san
+        elif event.type == "complete":
+            self.state["complete"] = event.complete
+        elif event.type == "pv":
+            self.state["pv"] = event.text
+            self.state["uci"] = event.uci
+
+    def drain(self, timeout=None):
+        """ Return the events the page buffered, waiting up to timeout seconds (long_poll_ms by default)
+        for the first one. Returns [] when none came, and after installing the observer on a new page """
+        if not self.installed:
+            self.install()
+            return []
+        wait_ms = self.long_poll_ms if timeout is None else max(int(timeout*1000), 0)
+        try:
+            entries = self.driver.execute_async_script(DRAIN_SCRIPT, wait_ms)
+        except (JavascriptException, TimeoutException):
+            entries = None
+        self.stats["drains"] += 1
+        if entries is None:
+            self.install()
+            return []
+        events = [BoardEvent(entry) for entry in entries]
+        for event in events:
+            self.apply(event)
+        self.stats["events"] += len(events)
+        self.stats["empty_drains"] += 0 if events else 1
+        return events
+
+    def next(self, timeout=None):
+        """ Return the next event, or None when none came within timeout seconds """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self.pending:
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                return None
+            self.pending.extend(self.drain(None if remaining is None else min(remaining, self.long_poll_ms/1000)))
+        return self.pending.popleft()
+
+    def __iter__(self):
+        while True:
+            yield self.next()
+
+    def sync(self):
+        """ Bring state up to date with the page without waiting, e.g. before an action whose effect is then
+        waited for. Returns state """
+        self.drain(0)
+        self.synced = True
+        return self.state
+
+    def wait_until(self, test, timeout=10, step=None):
+        """ Drain until test(state) is truthy and return its value. Raises TimeoutException.
+        state is first brought up to date, unless sync() just did, so events of earlier moves cannot pass the test """
+        start = time.perf_counter()
+        deadline = start + timeout
+        wait = None if self.synced else 0
+        self.synced = False
+        while True:
+            if wait is not None:
+                self.drain(wait)
+            value = test(self.state)
+            if value:
+                return value
+            if self.cancel is not None and self.cancel.is_set():
+                raise WaitCancelled("Cancelled while waiting for board events (step: {})".format(step))
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise TimeoutException("Timed out after {:.2f}s waiting for board events (step: {})".format(
+                    time.perf_counter() - start, step))
+            poll_ms = self.long_poll_ms if self.cancel is None else min(self.long_poll_ms, CANCEL_POLL_MS)
+            wait = min(remaining, poll_ms/1000)
+
+    def get_stats(self):
+        return dict(self.stats)
@@ -0,0 +1,428 @@
+# Lichess.org Testing with Selenium
+# In-process model of the position: moves applied locally, SAN <-> square conversion and checks against the DOM
+
+from snapshot import EMPTY, NUM_FILES, NUM_RANKS, square_index, square_key, key_to_position
+import re
+
+
+START_SQUARES = "RNBQKBNR" + "P"*8 + EMPTY*32 + "p"*8 + "rnbqkbnr"    # a1 ... h8, like BoardSnapshot.squares
+KNIGHT_STEPS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+KING_STEPS = ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1))
+ROOK_DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (-1, 1), (-1, -1), (1, -1))
+PROMOTIONS = "qrbn"
+# king square, rook square, king destination, rook destination, squares that must be empty, right letter
+CASTLING = {
+    "K": ("e1", "h1", "g1", "f1", ("f1", "g1"), "K"),
+    "Q": ("e1", "a1", "c1", "d1", ("b1", "c1", "d1"), "Q"),
+    "k": ("e8", "h8", "g8", "f8", ("f8", "g8"), "k"),
+    "q": ("e8", "a8", "c8", "d8", ("b8", "c8", "d8"), "q"),
+}
+SAN_PATTERN = re.compile(r"^(?P<piece>[NBRQK])?(?P<file>[a-h])?(?P<rank>[1-8])?x?(?P<destination>[a-h][1-8])"
+                         r"(?:=?(?P<promotion>[NBRQnbrq]))?[+#]?[!?]*$")
+RESULT_TOKENS = ("1-0", "0-1", "1/2-1/2", "*")
+
+
+def pgn_to_sans(pgn):
+    """ Split a pgn string such as '1. e4 e5 2. Nf3' into its SAN moves, dropping move numbers and results """
+    sans = []
+    for token in pgn.split():
+        token = re.sub(r"^\d+\.+", "", token)
+        if token and token not in RESULT_TOKENS:
+            sans.append(token)
+    return sans
+
+
+def sans_to_pgn(sans, first_ply=1):
+    """ Join SAN moves into a pgn string in the "1. e4 e5 2. Nf3 " form LichessTester.get_puzzle_pgn returns """
+    pgn = ""
+    for offset, san in enumerate(sans):
+        ply = first_ply + offset
+        if ply % 2 == 1:
+            pgn += str((ply + 1)//2) + ". "
+        elif offset == 0:
+            pgn += str(ply//2) + "... "
+        pgn += san + " "
+    return pgn
+
+
+def is_white(piece):
+    return piece.isupper()
+
+
+class BoardModel:
+    """ A chess position kept in process, so questions about it cost no WebDriver call.
+
+    The 64 squares are a list of FEN piece letters indexed like BoardSnapshot.squares (a1 = 0, h8 = 63).
+    Along with them the model keeps what a board does not show: the side to move, castling rights, the
+    en passant square and the SAN of every move applied since the model was built.
+
+    model = BoardModel.from_pgn(lichess_website_tester.get_puzzle_pgn())
+    origin, destination, promotion = model.parse_san("Qxf7#")    # 'h5', 'f7', None
+    model.mismatches(puzzle_board.get_snapshot())                 # squares where the DOM disagrees """
+    squares = None
+    white_to_move = True
+    castling = None
+    en_passant = None
+    sans = None
+    first_ply = 1
+
+    def __init__(self, squares=START_SQUARES, white_to_move=True, castling="KQkq", en_passant=None, first_ply=1):
+        self.squares = list(squares)
+        self.white_to_move = white_to_move
+        self.castling = castling if castling != "-" else ""
+        self.en_passant = en_passant
+        self.sans = []
+        self.first_ply = first_ply
+
+    @classmethod
+    def from_pgn(cls, pgn):
+        """ Play a game's moves from the initial position. Raises ValueError on a move that is not legal """
+        model = cls()
+        for san in pgn_to_sans(pgn):
+            model.push_san(san)
+        return model
+
+    @classmethod
+    def from_snapshot(cls, snapshot, white_to_move):
+        """ Build a model from a BoardSnapshot. Castling rights are guessed from kings and rooks on their home
+        squares and the en passant square from the last-move highlight, like snapshot.snapshot_to_fen """
+        model = cls(snapshot.squares, white_to_move, "")
+        for right, (king, rook, _, _, _, _) in CASTLING.items():
+            king_piece, rook_piece = ("K", "R") if right.isupper() else ("k", "r")
+            if model.piece_at(king) == king_piece and model.piece_at(rook) == rook_piece:
+                model.castling += right
+        if len(snapshot.last_move) == 2:
+            for start, end in (snapshot.last_move, snapshot.last_move[::-1]):
+                piece = model.piece_at(end)
+                if piece in ("P", "p") and start[0] == end[0] and abs(int(start[1:]) - int(end[1:])) == 2 \
+                        and model.piece_at(start) is None and is_white(piece) != white_to_move:
+                    model.en_passant = start[0] + str((int(start[1:]) + int(end[1:]))//2)
+        return model
+
+    def copy(self, with_history=True):
+        model = BoardModel(self.squares, self.white_to_move, self.castling, self.en_passant, self.first_ply)
+        if with_history:
+            model.sans = list(self.sans)
+        return model
+
+    def piece_at(self, key):
+        """ Return the piece letter on a square, or None if it is empty """
+        code = self.squares[square_index(key)]
+        return None if code == EMPTY else code
+
+    def square_string(self):
+        """ The squares in the BoardSnapshot.squares layout """
+        return "".join(self.squares)
+
+    def mismatches(self, snapshot):
+        """ Return the cgKeys of the squares where a BoardSnapshot shows something else than the model """
+        return [square_key(index) for index, (model_code, dom_code) in enumerate(zip(self.squares, snapshot.squares))
+                if model_code != dom_code]
+
+    def pgn(self):
+        """ The moves applied so far as a pgn string """
+        return sans_to_pgn(self.sans, self.first_ply)
+
+    def fen(self):
+        """ The exact FEN of the position, move counters aside """
+        rows = []
+        for rank in range(NUM_RANKS - 1, -1, -1):
+            row = ""
+            empty = 0
+            for file in range(NUM_FILES):
+                code = self.squares[file + NUM_FILES*rank]
+                if code == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += code
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        castling = "".join(right for right in "KQkq" if right in self.castling) or "-"
+        return "{} {} {} {} 0 {}".format("/".join(rows), "w" if self.white_to_move else "b", castling,
+                                         self.en_passant or "-", (self.first_ply + len(self.sans) + 1)//2)
+
+    # Move generation
+
+    def king_index(self, white):
+        king = "K" if white else "k"
+        return self.squares.index(king) if king in self.squares else None
+
+    def is_attacked(self, index, by_white):
+        """ Whether a side attacks a square """
+        file, rank = index % NUM_FILES, index//NUM_FILES
+
+        def piece_on(file_step, rank_step):
+            target_file, target_rank = file + file_step, rank + rank_step
+            if not (0 <= target_file < NUM_FILES and 0 <= target_rank < NUM_RANKS):
+                return None
+            return self.squares[target_file + NUM_FILES*target_rank]
+
+        pawn_rank_step = -1 if by_white else 1
+        for file_step in (-1, 1):
+            if piece_on(file_step, pawn_rank_step) == ("P" if by_white else "p"):
+                return True
+        for steps, piece in ((KNIGHT_STEPS, "N"), (KING_STEPS, "K")):
+            piece = piece if by_white else piece.lower()
+            if any(piece_on(*step) == piece for step in steps):
+                return True
+        for directions, pieces in ((ROOK_DIRECTIONS, "RQ"), (BISHOP_DIRECTIONS, "BQ")):
+            pieces = pieces if by_white else pieces.lower()
+            for file_step, rank_step in directions:
+                distance = 1
+                while True:
+                    code = piece_on(file_step*distance, rank_step*distance)
+                    if code is None:
+                        break
+                    if code != EMPTY:
+                        if code in pieces:
+                            return True
+                        break
+                    distance += 1
+        return False
+
+    def in_check(self, white=None):
+        white = self.white_to_move if white is None else white
+        king = self.king_index(white)
+        return king is not None and self.is_attacked(king, not white)
+
+    def pseudo_legal_moves(self):
+        """ Yield (origin, destination, promotion) square indices of the side to move, ignoring checks """
+        white = self.white_to_move
+        for origin, code in enumerate(self.squares):
+            if code == EMPTY or is_white(code) != white:
+                continue
+            file, rank = origin % NUM_FILES, origin//NUM_FILES
+            role = code.lower()
+            if role == "p":
+                yield from self.pawn_moves(origin, file, rank, white)
+                continue
+            if role in ("n", "k"):
+                for file_step, rank_step in (KNIGHT_STEPS if role == "n" else KING_STEPS):
+                    target_file, target_rank = file + file_step, rank + rank_step
+                    if 0 <= target_file < NUM_FILES and 0 <= target_rank < NUM_RANKS:
+                        destination = target_file + NUM_FILES*target_rank
+                        target = self.squares[destination]
+                        if target == EMPTY or is_white(target) != white:
+                            yield origin, destination, None
+                continue
+            directions = {"r": ROOK_DIRECTIONS, "b": BISHOP_DIRECTIONS, "q": ROOK_DIRECTIONS + BISHOP_DIRECTIONS}[role]
+            for file_step, rank_step in directions:
+                target_file, target_rank = file + file_step, rank + rank_step
+                while 0 <= target_file < NUM_FILES and 0 <= target_rank < NUM_RANKS:
+                    destination = target_file + NUM_FILES*target_rank
+                    target = self.squares[destination]
+                    if target != EMPTY:
+                        if is_white(target) != white:
+                            yield origin, destination, None
+                        break
+                    yield origin, destination, None
+                    target_file, target_rank = target_file + file_step, target_rank + rank_step
+        yield from self.castling_moves(white)
+
+    def pawn_moves(self, origin, file, rank, white):
+        forward = NUM_FILES if white else -NUM_FILES
+        start_rank, last_rank = (1, 7) if white else (6, 0)
+        en_passant = square_index(self.en_passant) if self.en_passant else None
+        destinations = []
+        one_step = origin + forward
+        if 0 <= one_step < 64 and self.squares[one_step] == EMPTY:
+            destinations.append(one_step)
+            two_steps = one_step + forward
+            if rank == start_rank and self.squares[two_steps] == EMPTY:
+                destinations.append(two_steps)
+        for file_step in (-1, 1):
+            if not 0 <= file + file_step < NUM_FILES:
+                continue
+            destination = one_step + file_step
+            if not 0 <= destination < 64:
+                continue
+            target = self.squares[destination]
+            if (target != EMPTY and is_white(target) != white) or destination == en_passant:
+                destinations.append(destination)
+        for destination in destinations:
+            if destination//NUM_FILES == last_rank:
+                for promotion in PROMOTIONS:
+                    yield origin, destination, promotion
+            else:
+                yield origin, destination, None
+
+    def castling_moves(self, white):
+        for right in ("KQ" if white else "kq"):
+            if right not in self.castling:
+                continue
+            king, rook, king_destination, _, between, _ = CASTLING[right]
+            if self.piece_at(king) != ("K" if white else "k") or self.piece_at(rook) != ("R" if white else "r"):
+                continue
+            if any(self.piece_at(key) is not None for key in between):
+                continue
+            # the king may not castle out of, through or into check
+            passed = (king, CASTLING[right][3], king_destination)
+            if any(self.is_attacked(square_index(key), not white) for key in passed):
+                continue
+            yield square_index(king), square_index(king_destination), None
+
+    def is_legal(self, move):
+        """ Whether a pseudo-legal (origin, destination, promotion) leaves the mover's king safe """
+        after = self.copy(with_history=False)
+        after.move_indices(*move)
+        return not after.in_check(self.white_to_move)
+
+    def legal_moves(self, destination=None):
+        """ Return every legal (origin, destination, promotion) of the side to move, as square indices,
+        or only those to one destination square """
+        return [move for move in self.pseudo_legal_moves()
+                if (destination is None or move[1] == destination) and self.is_legal(move)]
+
+    # Applying moves
+
+    def move_indices(self, origin, destination, promotion=None):
+        """ Apply a move given as square indices, without checking it, and return the piece that moved """
+        piece = self.squares[origin]
+        if piece == EMPTY:
+            raise ValueError("No piece on " + square_key(origin))
+        white = is_white(piece)
+        role = piece.lower()
+        target = self.squares[destination]
+
+        # lichess may show castling as the king taking its own rook
+        if role == "k" and target != EMPTY and is_white(target) == white and target.lower() == "r":
+            side = "K" if destination % NUM_FILES > origin % NUM_FILES else "Q"
+            destination = square_index(CASTLING[side if white else side.lower()][2])
+        if role == "k" and abs(destination % NUM_FILES - origin % NUM_FILES) == 2:
+            right = ("K" if destination % NUM_FILES > origin % NUM_FILES else "Q")
+            _, rook, _, rook_destination, _, _ = CASTLING[right if white else right.lower()]
+            self.squares[square_index(rook_destination)] = self.squares[square_index(rook)]
+            self.squares[square_index(rook)] = EMPTY
+
+        if role == "p" and self.en_passant is not None and destination == square_index(self.en_passant) \
+                and target == EMPTY:
+            captured = destination - NUM_FILES if white else destination + NUM_FILES
+            self.squares[captured] = EMPTY
+
+        self.squares[destination] = piece
+        self.squares[origin] = EMPTY
+        if promotion:
+            self.squares[destination] = promotion.upper() if white else promotion.lower()
+
+        self.en_passant = None
+        if role == "p" and abs(destination - origin) == 2*NUM_FILES:
+            self.en_passant = square_key((origin + destination)//2)
+        for right, (king, rook, _, _, _, _) in CASTLING.items():
+            if square_index(king) in (origin, destination) or square_index(rook) in (origin, destination):
+                self.castling = self.castling.replace(right, "")
+        self.white_to_move = not white
+        return piece
+
+    def apply(self, origin, destination, promotion=None):
+        """ Play a move given as cgKeys (promotion is a piece letter or None), recording its SAN.
+        Returns the piece that moved. Raises ValueError when the move is not legal """
+        origin_index, destination_index = square_index(origin), square_index(destination)
+        if promotion is None and self.squares[origin_index] in ("P", "p") \
+                and destination_index//NUM_FILES in (0, NUM_RANKS - 1):
+            promotion = "q"    # clicking a pawn to the last rank promotes it to a queen unless asked otherwise
+        san = self.to_san(origin, destination, promotion)
+        self.sans.append(san)
+        return self.move_indices(origin_index, self.castling_destination(origin_index, destination_index),
+                                 promotion.lower() if promotion else None)
+
+    def apply_move(self, move):
+        """ Play a move in the get_last_move() layout and return it with its piece filled in """
+        piece = self.apply(move[1][0] + str(move[1][1]), move[2][0] + str(move[2][1]))
+        return [piece, move[1], move[2]]
+
+    def castling_destination(self, origin, destination):
+        """ Map a king-takes-own-rook castling destination to the king's square """
+        piece, target = self.squares[origin], self.squares[destination]
+        if piece.lower() == "k" and target != EMPTY and is_white(target) == is_white(piece) and target.lower() == "r":
+            side = "K" if destination % NUM_FILES > origin % NUM_FILES else "Q"
+            return square_index(CASTLING[side if is_white(piece) else side.lower()][2])
+        return destination
+
+    # SAN
+
+    def to_san(self, origin, destination, promotion=None):
+        """ Return the SAN of a legal move given as cgKeys. Raises ValueError when it is not legal """
+        origin_index = square_index(origin)
+        destination_index = self.castling_destination(origin_index, square_index(destination))
+        promotion = promotion.lower() if promotion else None
+        legal = self.legal_moves(destination_index)
+        if (origin_index, destination_index, promotion) not in legal:
+            raise ValueError("{}{} is not legal in {}".format(origin, destination, self.fen()))
+
+        piece = self.squares[origin_index]
+        role = piece.lower()
+        if role == "k" and abs(destination_index % NUM_FILES - origin_index % NUM_FILES) == 2:
+            san = "O-O" if destination_index % NUM_FILES > origin_index % NUM_FILES else "O-O-O"
+        else:
+            capture = self.squares[destination_index] != EMPTY or \
+                (role == "p" and self.en_passant is not None and destination_index == square_index(self.en_passant))
+            if role == "p":
+                san = (origin[0] + "x" if capture else "") + square_key(destination_index)
+                if promotion:
+                    san += "=" + promotion.upper()
+            else:
+                rivals = [other for other, other_destination, _ in legal
+                          if other_destination == destination_index and other != origin_index
+                          and self.squares[other] == piece]
+                disambiguation = ""
+                if rivals:
+                    if all(other % NUM_FILES != origin_index % NUM_FILES for other in rivals):
+                        disambiguation = origin[0]
+                    elif all(other//NUM_FILES != origin_index//NUM_FILES for other in rivals):
+                        disambiguation = origin[1:]
+                    else:
+                        disambiguation = origin
+                san = role.upper() + disambiguation + ("x" if capture else "") + square_key(destination_index)
+
+        after = self.copy(with_history=False)
+        after.move_indices(origin_index, destination_index, promotion)
+        if after.in_check():
+            san += "#" if not after.legal_moves() else "+"
+        return san
+
+    def parse_san(self, san):
+        """ Return the (origin, destination, promotion) cgKeys of a SAN move. Raises ValueError when no legal
+        move or more than one matches it """
+        text = san.strip().rstrip("+#!?").replace("0", "O")
+        if text in ("O-O", "O-O-O"):
+            right = "K" if text == "O-O" else "Q"
+            king, _, king_destination, _, _, _ = CASTLING[right if self.white_to_move else right.lower()]
+            move = (square_index(king), square_index(king_destination), None)
+            if move not in self.legal_moves(move[1]):
+                raise ValueError("{} is not legal in {}".format(san, self.fen()))
+            return king, king_destination, None
+
+        match = SAN_PATTERN.match(text)
+        if match is None:
+            raise ValueError("Cannot read the move " + repr(san))
+        role = (match.group("piece") or "P").lower()
+        piece = role.upper() if self.white_to_move else role
+        destination = square_index(match.group("destination"))
+        promotion = match.group("promotion").lower() if match.group("promotion") else None
+        if role == "p" and promotion is None and destination//NUM_FILES in (0, NUM_RANKS - 1):
+            promotion = "q"
+        candidates = [(origin, move_destination, move_promotion)
+                      for origin, move_destination, move_promotion in self.legal_moves(destination)
+                      if move_promotion == promotion and self.squares[origin] == piece
+                      and (match.group("file") is None or square_key(origin)[0] == match.group("file"))
+                      and (match.group("rank") is None or square_key(origin)[1] == match.group("rank"))]
+        if len(candidates) != 1:
+            raise ValueError("{} matches {} legal moves in {}".format(san, len(candidates), self.fen()))
+        origin, destination, promotion = candidates[0]
+        return square_key(origin), square_key(destination), promotion
+
+    def push_san(self, san):
+        """ Play a SAN move and return it in the get_last_move() layout, piece filled in """
+        origin, destination, promotion = self.parse_san(san)
+        piece = self.piece_at(origin)
+        self.sans.append(san)
+        self.move_indices(square_index(origin), square_index(destination), promotion)
+        return [piece, key_to_position(origin), key_to_position(destination)]
+
+    def __repr__(self):
+        return "BoardModel({!r})".format(self.fen())
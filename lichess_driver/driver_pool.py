@@ -0,0 +1,242 @@
+# Lichess.org Testing with Selenium
+# Pre-launched Chrome sessions handed out to testers and reset between uses
+
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import WebDriverException
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import threading
+import time
+
+
+DEFAULT_WINDOW_SIZE = (1920, 1080)
+DEFAULT_MAX_USES = 50   # a session is quit and replaced after this many leases
+
+# Switches that skip Chrome's first-run work and background services
+FAST_START_ARGUMENTS = [
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--disable-extensions",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-client-side-phishing-detection",
+    "--mute-audio",
+]
+
+# What reset clears for every origin a lease visited, cookies are cleared for all of them at once
+CLEARED_STORAGE_TYPES = "local_storage,session_storage,indexeddb,cache_storage"
+
+
+def chrome_options(headless=False, fast_start=True, window_size=DEFAULT_WINDOW_SIZE, page_load_strategy=None,
+                   arguments=()):
+    """ Build ChromeOptions for a tester session. page_load_strategy is "normal" (the default), "eager" or "none",
+    see page_load.PageLoadProfile. arguments are extra Chrome switches, e.g. shared_browser.SHARED_BROWSER_ARGUMENTS """
+    options = webdriver.ChromeOptions()
+    if page_load_strategy is not None:
+        options.page_load_strategy = page_load_strategy
+    options.add_experimental_option('excludeSwitches', ['enable-logging'])
+    if headless:
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size={},{}".format(*window_size))
+    if fast_start:
+        for argument in FAST_START_ARGUMENTS:
+            options.add_argument(argument)
+    for argument in arguments:
+        options.add_argument(argument)
+    return options
+
+
+def visited_origins(driver):
+    """ Return the origins, e.g. "https://lichess.org", of the pages in the current window's history """
+    origins = set()
+    for entry in driver.execute_cdp_cmd("Page.getNavigationHistory", {})["entries"]:
+        url = urlsplit(entry.get("url", ""))
+        if url.scheme in ("http", "https") and url.netloc:
+            origins.add("{}://{}".format(url.scheme, url.netloc))
+    return origins
+
+
+def launch_driver(executable_path=None, options=None):
+    """ Start a Chrome session with its own chromedriver process. Without an executable_path selenium
+    locates chromedriver itself """
+    if options is None:
+        options = chrome_options()
+    return webdriver.Chrome(service=Service(executable_path), options=options)
+
+
+class DriverPool:
+    """ Keeps warm Chrome sessions ready so a scenario starts without paying browser startup.
+
+    with pool.lease() as driver:
+        lichess_website_tester = LichessTester(driver=driver)
+        ...
+    """
+    size = None
+    executable_path = None
+    options = None
+    max_uses = None
+    idle = None
+    uses = None
+
+    def __init__(self, size=2, headless=True, fast_start=True, max_uses=DEFAULT_MAX_USES, executable_path=None,
+                 window_size=DEFAULT_WINDOW_SIZE, page_load_strategy=None, arguments=()):
+        """
+        :param size: number of sessions kept alive (leased and idle together)
+        :param max_uses: a session is quit and replaced after this many leases
+        :param executable_path: chromedriver path, e.g. main.CHROMEDRIVER_PATH
+        :param page_load_strategy: the sessions' load strategy, fixed at launch (see page_load.PageLoadProfile)
+        :param arguments: extra Chrome switches of the sessions, see chrome_options
+        """
+        self.size = size
+        self.executable_path = executable_path
+        self.headless = headless
+        self.options = chrome_options(headless, fast_start, window_size, page_load_strategy, arguments)
+        self.window_size = window_size
+        self.max_uses = max_uses
+        self.idle = []
+        self.uses = dict()
+        self.launching = 0
+        self.leased = 0
+        self.closed = False
+        self.launch_error = None
+        self.condition = threading.Condition()
+        self.stats = {"launched": 0, "leases": 0, "recycled": 0, "replaced": 0, "reset_seconds": 0.0}
+
+    def launch(self):
+        """ Start one session on the calling thread and add it to the idle list """
+        try:
+            driver = launch_driver(self.executable_path, self.options)
+            if not self.headless:
+                driver.set_window_size(*self.window_size)
+        except WebDriverException as error:
+            with self.condition:
+                self.launching -= 1
+                self.launch_error = error
+                self.condition.notify_all()
+            return
+        with self.condition:
+            self.launching -= 1
+            self.stats["launched"] += 1
+            if self.closed:
+                driver.quit()
+                return
+            self.uses[id(driver)] = 0
+            self.idle.append(driver)
+            self.condition.notify_all()
+
+    def launch_in_background(self):
+        """ Start a session on its own thread. The caller must hold self.condition """
+        self.launching += 1
+        thread = threading.Thread(target=self.launch, daemon=True)
+        thread.start()
+        return thread
+
+    def start(self):
+        """ Pre-launch every session concurrently and wait until they are up """
+        with self.condition:
+            threads = [self.launch_in_background()
+                       for _ in range(self.size - len(self.idle) - self.leased - self.launching)]
+        for thread in threads:
+            thread.join()
+        if self.launch_error is not None and not self.idle:
+            raise self.launch_error
+        return self
+
+    def acquire(self, timeout=None):
+        """ Take an idle session, starting one if the pool is below its size """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self.condition:
+            while not self.idle:
+                if self.closed:
+                    raise RuntimeError("DriverPool is closed")
+                if self.launch_error is not None and self.launching == 0:
+                    # the last launch failed and nothing else is on its way, do not retry in a loop
+                    error = self.launch_error
+                    self.launch_error = None
+                    raise error
+                if self.leased + self.launching < self.size:
+                    self.launch_in_background()
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No browser session became free within {}s".format(timeout))
+                self.condition.wait(remaining)
+            driver = self.idle.pop()
+            self.leased += 1
+            self.uses[id(driver)] += 1
+            self.stats["leases"] += 1
+            return driver
+
+    def release(self, driver, retire=False):
+        """ Reset a session and return it to the pool, or replace it if it is worn out or broken.
+        retire replaces it whatever its uses, e.g. once soak.SoakMonitor finds it bloated """
+        start = time.perf_counter()
+        healthy = True if retire else self.reset(driver)
+        with self.condition:
+            self.stats["reset_seconds"] += time.perf_counter() - start
+            self.leased -= 1
+            worn_out = retire or self.uses[id(driver)] >= self.max_uses
+            if healthy and not worn_out and not self.closed:
+                self.idle.append(driver)
+                self.condition.notify_all()
+                return
+            del self.uses[id(driver)]
+            self.stats["recycled" if healthy else "replaced"] += 1
+            if not self.closed:
+                self.launch_in_background()
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """ Context manager that hands out a warm session and takes it back afterwards """
+        driver = self.acquire(timeout)
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def reset(self, driver):
+        """ Close extra windows, clear cookies and the storage of every origin the windows' histories visited,
+        not only the one each shows, and lift URL blocking. Returns False if the session is dead """
+        try:
+            handles = driver.window_handles
+            origins = set()
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                origins |= visited_origins(driver)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            origins |= visited_origins(driver)
+            for origin in sorted(origins):
+                driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin,
+                                                                      "storageTypes": CLEARED_STORAGE_TYPES})
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+            driver.get("about:blank")
+            return True
+        except WebDriverException:
+            return False
+
+    def close(self):
+        """ Quit every idle session. Leased sessions are quit when they come back """
+        with self.condition:
+            self.closed = True
+            idle = self.idle
+            self.idle = []
+            self.condition.notify_all()
+        for driver in idle:
+            try:
+                driver.quit()
+            except WebDriverException:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,433 @@
+# Lichess.org Testing with Selenium
+# Engine backends that play() asks for the puzzle's best moves
+
+from snapshot import key_to_position, position_to_key
+from board_model import BoardModel
+from position_cache import position_key, CacheEntry
+from waits import WaitCancelled
+from readiness import ReadinessPolicy, FIRST_LINE
+from tracing import Latencies
+import subprocess
+import threading
+import queue
+import time
+
+
+UCI_ENGINE_PATH = "stockfish"   # Any UCI engine on the PATH, or an absolute path to its executable
+UCI_DEPTH = 12                  # Search depth used when no movetime is given
+UCI_MOVETIME_MS = None          # Fixed thinking time per move in milliseconds, overrides UCI_DEPTH
+UCI_OPTIONS = {
+    "Threads": 1,
+    "Hash": 64,
+}
+UCI_READ_TIMEOUT_SECONDS = 30   # Give up on an engine that stops answering
+
+# How BrowserEngine puts its own moves on the analysis board:
+# "incremental": click the best move on the board, the engine keeps its search and hash between plies
+# "import":      append the move to the pgn and import the whole game again, like the testers always did
+BROWSER_SYNC = "incremental"
+BROWSER_SYNC_MODES = ("incremental", "import")
+
+
+class EngineBackend:
+    """ Interface between play() and whatever finds the best move.
+
+    play() calls new_puzzle() once with the puzzle's starting position, then alternates best_move()
+    (the move to play on the puzzle board) and push() (the puzzle's reply) until the puzzle is solved.
+    Moves use the get_last_move() layout: [piece, (file, rank) source, (file, rank) destination] """
+    name = "engine"
+    latencies = None
+
+    def __init__(self):
+        self.latencies = Latencies()
+
+    def open(self):
+        """ Start the engine. Called once, the engine then stays warm across puzzles """
+        pass
+
+    def close(self):
+        """ Stop the engine """
+        pass
+
+    def restart(self):
+        """ Start the engine again after a failure, see recovery.Supervisor. The next new_puzzle() syncs it """
+        self.close()
+        self.open()
+
+    def new_puzzle(self, pgn, snapshot):
+        """ Sync the engine to a puzzle's starting position (the game's pgn and a BoardSnapshot of it) """
+        raise NotImplementedError
+
+    def push(self, move, snapshot):
+        """ Apply the opponent's move. snapshot is the puzzle board after the move """
+        raise NotImplementedError
+
+    def think(self):
+        """ Find and apply the best move, returning it in the get_last_move() layout """
+        raise NotImplementedError
+
+    def predict_reply(self):
+        """ Return the reply the engine expects to the move think() just played, or None when it cannot tell.
+        orchestrator.Orchestrator speculates on it while the puzzle answers """
+        return None
+
+    def speculate(self, move):
+        """ Apply a predicted reply that the puzzle has not played yet, so think() can start on it """
+        raise NotImplementedError
+
+    def interrupt(self):
+        """ Make a predict_reply() or think() running on another thread return early (it may raise WaitCancelled) """
+        pass
+
+    def resume(self):
+        """ Undo interrupt() once the interrupted call has returned """
+        pass
+
+    def best_move(self):
+        """ Return the best move of the current position and record how long the engine took """
+        start = time.perf_counter()
+        move = self.think()
+        self.latencies.add(time.perf_counter() - start)
+        return move
+
+    def get_latency_stats(self):
+        """ Return the number of moves searched and the engine latency in seconds: mean, worst, and the median
+        and 95th percentile of the recent moves """
+        return {
+            "moves": self.latencies.count,
+            "mean": self.latencies.mean(),
+            "max": self.latencies.max,
+            "p50": self.latencies.percentile(0.5),
+            "p95": self.latencies.percentile(0.95)
+        }
+
+
+class BrowserEngine(EngineBackend):
+    """ The lichess.org analysis board driven through a LichessEngine browser tab. The pgn is imported once
+    per puzzle, after that both sides' moves are played on the board (see BROWSER_SYNC) """
+    name = "browser"
+    lichess_engine = None
+    sync = None
+    policy = None
+    pv_before = None
+    pv = None
+    searched_depth = None
+
+    def __init__(self, lichess_engine, sync=BROWSER_SYNC, policy=None):
+        """ policy is the readiness.ReadinessPolicy a line must meet before it is played """
+        super().__init__()
+        if sync not in BROWSER_SYNC_MODES:
+            raise ValueError("Unknown sync mode {!r}, expected one of {}".format(sync, BROWSER_SYNC_MODES))
+        self.lichess_engine = lichess_engine
+        self.sync = sync
+        self.policy = policy if policy is not None else ReadinessPolicy()
+
+    def open(self):
+        self.lichess_engine.open_website()
+        self.lichess_engine.enable_engine()
+
+    def close(self):
+        """ Quit the browser the LichessEngine launched. A leased one (driver_pool.DriverPool, or a window of
+        shared_browser.SharedBrowser) is left to whoever handed it out, to reset and reuse """
+        if self.lichess_engine.owns_driver:
+            self.lichess_engine.driver.quit()
+
+    def restart(self):
+        """ Load the analysis board again in the same browser """
+        self.open()
+
+    def new_puzzle(self, pgn, snapshot):
+        board = self.lichess_engine.get_board()
+        self.pv_before = self.lichess_engine.get_pv_text()
+        signature_before = board.get_board_signature()
+        self.lichess_engine.import_pgn(pgn)
+        self.lichess_engine.enter_pgn()
+        self.lichess_engine.wait_for_board_change(signature_before)
+        board.sync_model(pgn)
+
+    def push(self, move, snapshot):
+        board = self.lichess_engine.get_board()
+        self.pv_before = self.lichess_engine.get_pv_text()
+        signature_before = board.get_board_signature()
+        board.make_move(move[1], move[2])
+        self.lichess_engine.wait_for_board_change(signature_before, step="engine_move")
+        board.update_model([move])
+
+    def think(self):
+        board = self.lichess_engine.get_board()
+        line = self.lichess_engine.wait_for_engine(self.policy, self.pv_before)  # wait for a good enough line
+        self.pv = line.pv
+        self.searched_depth = line.depth
+        uci = line.uci
+        model = board.get_model()
+        if uci is None and model is not None:
+            # a line without data-uci: the board model finds the squares of its SAN
+            try:
+                origin, destination, promotion = model.parse_san(line.san)
+                uci = origin + destination + (promotion or "")
+            except ValueError:
+                pass
+        last_move_before = board.get_last_move_squares()
+        if self.sync == "incremental":
+            self.lichess_engine.play_best_move(uci, line.san)
+        else:
+            self.lichess_engine.make_best_move(line.san)
+        self.lichess_engine.wait_for_move(last_move_before)  # wait for pieces to move
+        if model is not None and uci is not None and len(uci) == 4:
+            # the model already knows where the pieces went, the board is not read back
+            return board.update_model([["", key_to_position(uci[0:2]), key_to_position(uci[2:4])]])[0]
+        board.update_board_state()
+        return board.update_model([board.get_last_move()])[0]
+
+    def predict_reply(self):
+        # after think() the analysis board shows the opponent's side, whose best move leads its line
+        line = self.lichess_engine.wait_for_engine(FIRST_LINE, self.pv)
+        self.pv = line.pv
+        return line.move()
+
+    def speculate(self, move):
+        self.push(move, None)
+
+    def interrupt(self):
+        self.lichess_engine.waiter.cancel.set()
+
+    def resume(self):
+        self.lichess_engine.waiter.cancel.clear()
+
+
+class UciEngine(EngineBackend):
+    """ A local UCI engine subprocess (e.g. Stockfish). The position is sent as a FEN from a board_model.BoardModel
+    that plays the puzzle's pgn and every move since, so no second browser is needed. When the model and the
+    puzzle board's snapshot disagree, the FEN is built from the snapshot instead """
+    name = "uci"
+    path = None
+    depth = None
+    movetime = None
+    options = None
+    process = None
+    lines = None
+    model = None
+    fen = None
+    moves = None
+    pv = None
+    searched_depth = None
+    stopped = None
+
+    def __init__(self, path=UCI_ENGINE_PATH, depth=UCI_DEPTH, movetime=UCI_MOVETIME_MS, options=None):
+        super().__init__()
+        self.path = path
+        self.depth = depth
+        self.movetime = movetime
+        self.options = dict(UCI_OPTIONS)
+        if options:
+            self.options.update(options)
+        self.moves = []
+        self.stopped = threading.Event()
+        self.send_lock = threading.Lock()
+
+    def open(self):
+        if self.process is not None:
+            return
+        self.process = subprocess.Popen([self.path], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, universal_newlines=True, bufsize=1)
+        self.lines = queue.Queue()
+        reader = threading.Thread(target=self.read_output, daemon=True)
+        reader.start()
+
+        self.send("uci")
+        self.read_until("uciok")
+        for name, value in self.options.items():
+            self.send("setoption name {} value {}".format(name, value))
+        self.send("ucinewgame")
+        self.send("isready")
+        self.read_until("readyok")
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.send("quit")
+            self.process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+        self.process = None
+
+    def read_output(self):
+        """ Forward the engine's stdout to a queue so reads can time out """
+        for line in self.process.stdout:
+            self.lines.put(line.strip())
+        self.lines.put(None)
+
+    def send(self, command):
+        # interrupt() sends 'stop' from another thread than the one searching
+        with self.send_lock:
+            self.process.stdin.write(command + "\n")
+            self.process.stdin.flush()
+
+    def read_line(self):
+        try:
+            line = self.lines.get(timeout=UCI_READ_TIMEOUT_SECONDS)
+        except queue.Empty:
+            raise TimeoutError("UCI engine '{}' did not answer within {}s".format(self.path, UCI_READ_TIMEOUT_SECONDS))
+        if line is None:
+            raise EOFError("UCI engine '{}' exited".format(self.path))
+        return line
+
+    def read_until(self, prefix):
+        """ Read engine output until a line starting with prefix, returning that line """
+        while True:
+            line = self.read_line()
+            if line.startswith(prefix):
+                return line
+            self.parse_info(line)
+
+    def parse_info(self, line):
+        """ Remember the depth and principal variation of the latest 'info' line """
+        if not line.startswith("info ") or " pv " not in line:
+            return
+        tokens = line.split()
+        if "depth" in tokens:
+            self.searched_depth = int(tokens[tokens.index("depth") + 1])
+        self.pv = tokens[tokens.index("pv") + 1:]
+
+    def new_puzzle(self, pgn, snapshot):
+        # It is the player's turn when a puzzle starts, and the board is oriented towards the player
+        white_to_move = snapshot.orientation == "orientation-white"
+        try:
+            self.model = BoardModel.from_pgn(pgn)
+        except ValueError:
+            self.model = None
+        if self.model is None or self.model.white_to_move != white_to_move or self.model.mismatches(snapshot):
+            self.model = BoardModel.from_snapshot(snapshot, white_to_move)
+        self.fen = self.model.fen()
+        self.moves = []
+
+    def push(self, move, snapshot):
+        try:
+            self.model.apply_move(move)
+            in_sync = not self.model.mismatches(snapshot)
+        except ValueError:
+            in_sync = False
+        if not in_sync:
+            # The side that did not make the move is to play next. Look at both squares as the last-move
+            # highlights do not say which one is the destination
+            moved_piece = snapshot.piece_at(position_to_key(move[2])) or snapshot.piece_at(position_to_key(move[1]))
+            self.model = BoardModel.from_snapshot(snapshot, moved_piece is not None and moved_piece.islower())
+        self.fen = self.model.fen()
+        self.moves = []
+
+    def think(self):
+        self.pv = None
+        self.searched_depth = None
+        if self.stopped.is_set():
+            raise WaitCancelled("UCI search cancelled before it started")
+        self.send("position fen " + self.fen + (" moves " + " ".join(self.moves) if self.moves else ""))
+        if self.movetime is not None:
+            self.send("go movetime {}".format(self.movetime))
+        else:
+            self.send("go depth {}".format(self.depth))
+        best_move = self.read_until("bestmove").split()[1]
+        self.moves.append(best_move)
+        self.model.apply(best_move[0:2], best_move[2:4], best_move[4:] or None)
+
+        # The promotion letter of moves like e7e8q is dropped, make_move only knows two clicks
+        return ["", key_to_position(best_move[0:2]), key_to_position(best_move[2:4])]
+
+    def predict_reply(self):
+        # the second move of the principal variation is the reply the engine was pondering on
+        if not self.pv or len(self.pv) < 2 or len(self.pv[1]) < 4:
+            return None
+        return ["", key_to_position(self.pv[1][0:2]), key_to_position(self.pv[1][2:4])]
+
+    def speculate(self, move):
+        # the position stays the last FEN, the moves played since are sent after it
+        self.moves.append(position_to_key(move[1]) + position_to_key(move[2]))
+        self.model.apply_move(move)
+
+    def interrupt(self):
+        self.stopped.set()
+        if self.process is not None:
+            self.send("stop")
+
+    def resume(self):
+        self.stopped.clear()
+
+
+class CachedEngine(EngineBackend):
+    """ Answers from a position_cache.PositionCache and only asks the wrapped engine on a miss.
+
+    A hit does not play the move on the wrapped engine, which then falls behind the puzzle. It is synced
+    again, from pgn_source() (e.g. LichessTester.get_puzzle_pgn) and the latest snapshot, the next time
+    a position is not in the cache. A puzzle answered from the cache never touches the engine at all.
+    Speculation is passed on to a synced engine. Its answer is not cached, as a predicted position has no
+    snapshot to make a key from """
+    name = "cached"
+    engine = None
+    cache = None
+    snapshot = None
+    pgn = None
+    synced = False
+    speculated = False
+
+    def __init__(self, engine, cache, pgn_source):
+        super().__init__()
+        self.engine = engine
+        self.cache = cache
+        self.pgn_source = pgn_source
+
+    def open(self):
+        self.engine.open()
+
+    def close(self):
+        self.engine.close()
+
+    def restart(self):
+        self.engine.restart()
+        self.synced = False
+
+    def new_puzzle(self, pgn, snapshot):
+        self.pgn = pgn
+        self.snapshot = snapshot
+        self.synced = False
+        self.speculated = False
+
+    def push(self, move, snapshot):
+        self.pgn = None
+        self.snapshot = snapshot
+        if self.synced:
+            self.engine.push(move, snapshot)
+
+    def predict_reply(self):
+        return self.engine.predict_reply() if self.synced else None
+
+    def speculate(self, move):
+        self.engine.speculate(move)
+        self.speculated = True
+
+    def interrupt(self):
+        self.engine.interrupt()
+
+    def resume(self):
+        self.engine.resume()
+
+    def think(self):
+        if self.speculated:
+            self.speculated = False
+            return self.engine.best_move()
+
+        # play() only asks for a move on the player's turn, and the board is oriented towards the player
+        key = position_key(self.snapshot, self.snapshot.orientation == "orientation-white")
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.synced = False
+            return ["", key_to_position(entry.move[0:2]), key_to_position(entry.move[2:4])]
+
+        if not self.synced:
+            self.engine.new_puzzle(self.pgn if self.pgn is not None else self.pgn_source(), self.snapshot)
+            self.synced = True
+        move = self.engine.best_move()
+        pv = getattr(self.engine, "pv", None)
+        self.cache.put(key, CacheEntry(position_to_key(move[1]) + position_to_key(move[2]),
+                                       " ".join(pv) if isinstance(pv, list) else pv,
+                                       getattr(self.engine, "searched_depth", None), self.engine.name))
+        return move
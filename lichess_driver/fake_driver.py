@@ -0,0 +1,1189 @@
+# Lichess.org Testing with Selenium
+# In-process stand-in for a Chrome session showing the fixture pages, for benchmarks that need no browser
+
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, \
+    JavascriptException, InvalidSessionIdException, NoSuchWindowException, WebDriverException
+from fixture_server import PUZZLES, ENGINE_MAX_DEPTH, HEAVY_ASSETS, HEAVY_PAGES, SESSION_COOKIE, SESSION_SECONDS, \
+    FIXTURE_ACCOUNTS, get_puzzle, get_setup
+from move_history import MOVES_SCRIPT
+from snapshot import SNAPSHOT_SCRIPT, square_index, square_key, EMPTY
+from geometry import GEOMETRY_SCRIPT
+from readiness import CEVAL_SCRIPT
+from page_load import PAGE_STATS_SCRIPT
+from auth_sessions import READ_STORAGE_SCRIPT, RESTORE_STORAGE_SCRIPT
+from board_events import INSTALL_SCRIPT, DRAIN_SCRIPT
+from urllib.parse import urlsplit
+import waits
+import collections
+import fnmatch
+import html
+import secrets
+import re
+import time
+
+
+FAKE_URL = "http://fixture.invalid"
+SQUARE = 60                 # pixel size of a square, like the fixture's FixtureBoard
+BOARD_LEFT = 10             # viewport position of cg-board
+BOARD_TOP = 60
+MOVES_TABLE_XPATH = "//*[@id=\"main-wrap\"]/ main/div[2]/div[2]/div"
+ELEMENT_KEY = "element-6066-11e4-a52e-4f735466cecf"
+DOCUMENT_BYTES = 4096       # what a fixture page's own html counts for in its page stats
+HEAP_BYTES = 8*1024*1024    # the JS heap a fresh fake session reports in its Performance metrics
+SIGNIN_XPATH = "//*[@id=\"top\"]/div[2]/a"
+SIGNOUT_XPATH = "//*[@id=\"dasher_app\"]/div/div[1]/form/button"
+LOGIN_BUTTON_XPATH = "//*[@id=\"main-wrap\"]/main/form/div[1]/button"
+# What a session still answers once its current window was closed
+WINDOWLESS_COMMANDS = (Command.SWITCH_TO_WINDOW, Command.W3C_GET_WINDOW_HANDLES, Command.NEW_WINDOW, Command.QUIT)
+ASSET_PATTERN = re.compile(r"(?:src=\"|url\()(?P<path>/[^\")]+)")
+
+ROLES = {'p': 'pawn', 'n': 'knight', 'b': 'bishop', 'r': 'rook', 'q': 'queen', 'k': 'king'}
+START = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR"
+
+# WebDriver key codes that the pages react to. Other special keys are ignored
+KEY_CODES = {
+    "\ue004": "\t",     # Keys.TAB
+    "\ue00d": " ",      # Keys.SPACE
+}
+
+# Sign-in sessions the fake pages accept, shared by every FakeDriver of the process like one fixture server.
+# Maps a session cookie's value to (username, expiry time); clear it to expire every session
+FAKE_SESSIONS = dict()
+
+CSS_PATTERN = re.compile(r"^(?P<tag>[\w-]+|\*)?(?P<classes>(?:\.[\w-]+)*)"
+                         r"(?:\[class(?P<operator>\*?)=[\"'](?P<value>[^\"']*)[\"']\])?$")
+DESCENDANT_PATTERN = re.compile(r"\s+(?![^\[]*\])")     # whitespace outside of [...]
+XPATH_PATTERN = re.compile(r"^//(?P<tag>[\w-]+|\*)\[@(?P<attribute>[\w-]+)=[\"'](?P<value>[^\"']*)[\"']\]$")
+
+
+def typed_text(keys):
+    """ Return the characters a string of WebDriver keys types, dropping special keys the pages ignore """
+    return "".join(KEY_CODES.get(key, key) for key in keys
+                   if key in KEY_CODES or " " <= key < "\ue000")
+
+
+def start_pieces():
+    """ Return the cgKey -> (color, role) dictionary of the initial position """
+    pieces = dict()
+    for row, text in enumerate(START.split('/')):
+        file_index = 0
+        for code in text:
+            if code.isdigit():
+                file_index += int(code)
+                continue
+            key = chr(ord('a') + file_index) + str(8 - row)
+            pieces[key] = ("white" if code.isupper() else "black", ROLES[code.lower()])
+            file_index += 1
+    return pieces
+
+
+class FakeNode:
+    """ One element of a fake page. rect is (x, y, width, height) in viewport pixels """
+    __slots__ = ("tag", "class_name", "attributes", "rect", "text", "children", "xpaths", "alive")
+
+    def __init__(self, tag, class_name="", attributes=None, rect=None, text="", xpaths=()):
+        self.tag = tag
+        self.class_name = class_name
+        self.attributes = attributes or dict()
+        self.rect = rect
+        self.text = text
+        self.children = []
+        self.xpaths = xpaths
+        self.alive = True
+
+    def matches_css(self, selector):
+        """ Match the selector forms the testers use: tag, tag.class, tag[class="..."] and tag[class*="..."].
+        Of a descendant selector such as '.ceval .engine .info' only the last part is matched """
+        match = CSS_PATTERN.match(DESCENDANT_PATTERN.split(selector.strip())[-1])
+        if match is None:
+            return False
+        if match.group("tag") not in (None, "*", self.tag):
+            return False
+        classes = self.class_name.split()
+        for name in match.group("classes").split(".")[1:]:
+            if name not in classes:
+                return False
+        if match.group("value") is not None:
+            if match.group("operator"):
+                return match.group("value") in self.class_name
+            return match.group("value") == self.class_name
+        return True
+
+    def matches_xpath(self, xpath):
+        """ Match //tag[@attribute='value'] or one of the absolute paths the node answers to """
+        if xpath in self.xpaths:
+            return True
+        match = XPATH_PATTERN.match(xpath.strip())
+        if match is None:
+            return False
+        if match.group("tag") not in ("*", self.tag):
+            return False
+        if match.group("attribute") == "class":
+            return self.class_name == match.group("value")
+        return self.attributes.get(match.group("attribute")) == match.group("value")
+
+    def contains(self, x, y):
+        if self.rect is None:
+            return False
+        left, top, width, height = self.rect
+        return left <= x < left + width and top <= y < top + height
+
+    def centre(self):
+        left, top, width, height = self.rect
+        return left + width//2, top + height//2
+
+    def inner_text(self):
+        return self.text + "".join(child.inner_text() for child in self.children)
+
+    def outer_html(self):
+        attributes = dict(self.attributes, **({"class": self.class_name} if self.class_name else {}))
+        return "<{}{}>{}{}</{}>".format(self.tag, "".join(' {}="{}"'.format(name, html.escape(str(value)))
+                                                          for name, value in attributes.items()),
+                                        html.escape(self.text), "".join(child.outer_html() for child in self.children),
+                                        self.tag)
+
+
+class FakeBoard:
+    """ Python copy of the fixture's FixtureBoard: pieces, last-move highlight and click-to-move """
+    orientation = None
+    pieces = None
+    last_move = None
+    selected = None
+
+    def __init__(self, orientation, on_user_move):
+        self.orientation = orientation
+        self.on_user_move = on_user_move
+        self.reset()
+
+    def reset(self):
+        self.pieces = start_pieces()
+        self.last_move = None
+        self.selected = None
+
+    def key_at(self, x, y):
+        """ Return the cgKey under a point given relative to the top-left corner of the board """
+        column, row = int(x//SQUARE), int(y//SQUARE)
+        if column < 0 or column > 7 or row < 0 or row > 7:
+            return None
+        if self.orientation == "white":
+            return chr(ord('a') + column) + str(8 - row)
+        return chr(ord('a') + 7 - column) + str(row + 1)
+
+    def click(self, x, y):
+        key = self.key_at(x, y)
+        if key is None:
+            return
+        if self.selected is None:
+            if key in self.pieces:
+                self.selected = key
+            return
+        origin = self.selected
+        self.selected = None
+        if origin != key:
+            self.on_user_move(origin, key)
+
+    def set_position(self, squares, last_move):
+        """ Show a recorded position: 64 BoardSnapshot squares and the [from, to] of the move that led to it """
+        self.pieces = {square_key(index): ("white" if code.isupper() else "black", ROLES[code.lower()])
+                       for index, code in enumerate(squares) if code != EMPTY}
+        self.last_move = tuple(last_move)
+        self.selected = None
+
+    def move(self, origin, destination):
+        self.pieces[destination] = self.pieces.pop(origin)
+        self.last_move = (origin, destination)
+
+    def highlight_keys(self):
+        """ Last-move squares in chessground's DOM order: destination first """
+        return [] if self.last_move is None else [self.last_move[1], self.last_move[0]]
+
+    def signature(self):
+        keys = ["last-move:" + key for key in self.highlight_keys()]
+        keys += ["{} {}:{}".format(color, role, key) for key, (color, role) in self.pieces.items()]
+        return ",".join(keys)
+
+    def squares(self):
+        squares = [EMPTY]*64
+        for key, (color, role) in self.pieces.items():
+            code = 'n' if role == "knight" else role[0]
+            squares[square_index(key)] = code.upper() if color == "white" else code
+        return "".join(squares)
+
+
+class FakePage:
+    """ A page of the fake browser: a flat list of nodes plus the behaviour of the fixture page's scripts """
+    board = None
+    table = None
+    event_sources = None
+    event_state = None
+
+    def __init__(self, driver, url):
+        self.driver = driver
+        self.url = url
+        self.nodes = []
+        self.events = []
+        self.focus = None
+        self.add(FakeNode("a", attributes={"href": "/training"}, rect=(10, 10, 80, 30)))
+        self.add(FakeNode("a", attributes={"href": "/analysis"}, rect=(100, 10, 120, 30)))
+        self.add_account()
+
+    def add_account(self):
+        """ Add the header's account corner: the sign-in link, or the user tag and the sign-out button """
+        username = self.driver.signed_in_user()
+        if username is None:
+            self.add(FakeNode("a", "signin button button-empty", attributes={"href": "/login"},
+                              rect=(1700, 10, 80, 30), xpaths=(SIGNIN_XPATH,)))
+            return
+        self.add(FakeNode("a", "toggle link", attributes={"id": "user_tag"}, rect=(1700, 10, 120, 30), text=username))
+        self.add(FakeNode("button", "text", attributes={"formaction": "/logout"}, rect=(1700, 50, 120, 30),
+                          xpaths=(SIGNOUT_XPATH,)))
+    def add(self, node):
+        self.nodes.append(node)
+        return node
+
+    def page_source(self):
+        return "<html><body>{}</body></html>".format("".join(node.outer_html() for node in self.nodes))
+
+    def remove(self, node):
+        node.alive = False
+        for child in node.children:
+            child.alive = False
+        self.nodes.remove(node)
+
+    def add_board(self, orientation):
+        """ Add the cg-wrap > cg-container > cg-board + coords structure of a chessground board """
+        rect = (BOARD_LEFT, BOARD_TOP, 8*SQUARE, 8*SQUARE)
+        self.wrap = self.add(FakeNode("div", "cg-wrap orientation-" + orientation, rect=rect))
+        self.container = self.add(FakeNode("cg-container", rect=rect))
+        self.board_node = self.add(FakeNode("cg-board", rect=rect))
+        for name, labels in (("ranks", "12345678"), ("files", "abcdefgh")):
+            coords = self.add(FakeNode("coords", name))
+            coords.children = [FakeNode("coord", text=label) for label in labels]
+        self.board = FakeBoard(orientation, self.user_move)
+
+    def schedule(self, delay_ms, callback):
+        """ Run callback once delay_ms have passed, the way the page's setTimeout would """
+        self.events.append((time.perf_counter() + delay_ms/1000, callback))
+
+    def advance(self):
+        """ Fire every timer that is due. Called before each command the driver serves """
+        now = time.perf_counter()
+        while self.events:
+            due = [event for event in self.events if event[0] <= now]
+            if not due:
+                return
+            event = min(due, key=lambda event: event[0])
+            self.events.remove(event)
+            event[1]()
+
+    def query_css(self, selector):
+        for node in self.nodes:
+            if node.matches_css(selector):
+                return node
+        return None
+
+    def find(self, by, value):
+        if by == By.CSS_SELECTOR:
+            return [node for node in self.nodes if node.matches_css(value)]
+        if by == By.XPATH:
+            return [node for node in self.nodes if node.matches_xpath(value)]
+        if by == By.CLASS_NAME:
+            return [node for node in self.nodes if value in node.class_name.split()]
+        raise WebDriverException("The fake driver cannot locate elements by " + by)
+
+    def hit(self, x, y):
+        """ Return the topmost node under a viewport point """
+        for node in reversed(self.nodes):
+            if node.contains(x, y):
+                return node
+        return None
+
+    def click(self, node, x, y):
+        self.focus = node
+        if node.tag == "a" and "href" in node.attributes:
+            self.driver.navigate(node.attributes["href"])
+        elif node.tag == "button" and "formaction" in node.attributes:
+            self.driver.post(node.attributes["formaction"], self.form_values())
+        elif node is getattr(self, "board_node", None):
+            self.board.click(x - BOARD_LEFT, y - BOARD_TOP)
+
+    def press(self, key):
+        """ A key typed into the page, not into a form field """
+        pass
+
+    def type_text(self, node, text):
+        pass
+
+    def form_values(self):
+        """ The fields a button of the page posts """
+        return dict()
+
+    def user_move(self, origin, destination):
+        pass
+
+    # execute_script handlers, one per known script. Each returns what the script returns in Chrome
+    def board_signature(self, board_css):
+        node = self.query_css(board_css)
+        return None if node is None or self.board is None else self.board.signature()
+
+    def last_move_squares(self, board_css):
+        node = self.query_css(board_css)
+        return None if node is None or self.board is None else self.board.highlight_keys()
+
+    def snapshot(self, board_css, orientation_css):
+        if self.board is None or self.query_css(board_css) is None:
+            return None
+        wrap = self.query_css(orientation_css)
+        orientation = "fail"
+        if wrap is not None:
+            for name in ("orientation-white", "orientation-black"):
+                if name in wrap.class_name.split():
+                    orientation = name
+        return {"squares": self.board.squares(), "lastMove": self.board.highlight_keys(), "orientation": orientation}
+
+    def geometry(self, container_css, files_css, ranks_css):
+        container = self.query_css(container_css)
+        files = self.query_css(files_css)
+        ranks = self.query_css(ranks_css)
+        if container is None or files is None or ranks is None:
+            return None
+        return [container.rect[2], container.rect[3], len(files.children), len(ranks.children), container.rect[0],
+                container.rect[1]]
+
+    def visible(self, css):
+        node = self.query_css(css)
+        return node is not None and node.rect is not None
+
+    def table_moves(self, xpath):
+        if self.table is None or not self.table.matches_xpath(xpath):
+            return None
+        return self.table.attributes["moves"]
+
+    def ply_count(self, moves_xpath):
+        moves = self.table_moves(moves_xpath)
+        return None if moves is None else len(moves)
+
+    def players_turn(self, moves_xpath, orientation_css):
+        moves = self.table_moves(moves_xpath)
+        wrap = self.query_css(orientation_css)
+        if moves is None or wrap is None or len(moves) == 0:
+            return False
+        return (len(moves) % 2 == 0) == ("orientation-white" in wrap.class_name.split())
+
+    def moves(self, moves_xpath, from_ply, token):
+        moves = self.table_moves(moves_xpath)
+        if moves is None:
+            return None
+        if self.table.attributes.get("token") != token or from_ply > len(moves):
+            from_ply = 0
+        self.table.attributes["token"] = token
+        return {"from": from_ply, "moves": [list(move) for move in moves[from_ply:]]}
+
+    def pv_text(self, pv_css):
+        node = self.query_css(pv_css)
+        if node is None or len(node.children) < 3:
+            return None
+        text = node.inner_text().strip()
+        return text if text else None
+
+    def pv_uci(self, pv_css):
+        node = self.query_css(pv_css)
+        return node.attributes.get("data-uci") if node is not None else None
+
+    def board_events_state(self):
+        """ What board_events.INSTALL_SCRIPT's read() finds on the page """
+        board_css, moves_xpath, pv_css, complete_css = self.event_sources
+        last_move = self.last_move_squares(board_css)
+        moves = self.table_moves(moves_xpath) if moves_xpath else None
+        return {"last_move": last_move if last_move and len(last_move) == 2 else None,
+                "pieces": self.board_signature(board_css),
+                "ply": len(moves) if moves is not None else None,
+                "san": moves[-1][0] if moves else None,
+                "complete": self.visible(complete_css) if complete_css else False,
+                "pv": self.pv_text(pv_css) if pv_css else None,
+                "uci": ((self.pv_uci(pv_css) or "").split(" ")[0] or None) if pv_css else None}
+
+    def board_events_install(self, board_css, moves_xpath, pv_css, complete_css):
+        self.event_sources = (board_css, moves_xpath, pv_css, complete_css)
+        self.event_state = self.board_events_state()
+        self.event_seq = 0
+        return dict(self.event_state)
+
+    def board_events_drain(self, wait_ms):
+        """ The events the page's observer would have queued, found by comparing the page with its state at the
+        previous drain. Like the long poll it waits, firing the page's timers as they come due, until one came """
+        if self.event_sources is None:
+            return None
+        deadline = time.perf_counter() + wait_ms/1000
+        while True:
+            state, before = self.board_events_state(), self.event_state
+            events = []
+            if state["pieces"] != before["pieces"]:
+                events.append({"type": "piece_moved", "pieces": state["pieces"]})
+            if state["last_move"] != before["last_move"]:
+                events.append({"type": "last_move", "squares": state["last_move"]})
+            if state["ply"] != before["ply"]:
+                events.append({"type": "move", "ply": state["ply"], "san": state["san"]})
+            if state["complete"] != before["complete"]:
+                events.append({"type": "complete", "complete": state["complete"]})
+            if state["pv"] != before["pv"]:
+                events.append({"type": "pv", "text": state["pv"], "uci": state["uci"]})
+            self.event_state = state
+            now = time.perf_counter()
+            if events or now >= deadline:
+                for event in events:
+                    self.event_seq += 1
+                    event.update(seq=self.event_seq, time=now*1000)
+                return events
+            time.sleep(max(min([event[0] for event in self.events] + [deadline]) - now, 0))
+            self.advance()
+
+    def ceval(self, pv_css, info_css):
+        node = self.query_css(pv_css)
+        if node is None or len(node.children) < 3:
+            return None
+        info = self.query_css(info_css)
+        depth = re.search(r"Depth (\d+)", info.text) if info is not None else None
+        return {"depth": int(depth.group(1)) if depth else None, "eval": node.children[0].text,
+                "pv": node.inner_text().strip(), "san": node.children[2].text, "uci": node.attributes.get("data-uci")}
+
+    def read_storage(self):
+        return dict(self.driver.local_storage)
+
+    def restore_storage(self, items):
+        self.driver.local_storage.update(items)
+
+    def resources(self):
+        """ The url paths of the heavy assets the page references """
+        return []
+
+    def page_stats(self):
+        """ What the fixture page costs in a browser that honours the driver's blocked url patterns """
+        fetched = [path for path in self.resources() if not self.driver.is_blocked(path)]
+        return {
+            "url": self.url,
+            "requests": 1 + len(fetched),
+            "bytes": DOCUMENT_BYTES + sum(HEAVY_ASSETS[path][1] for path in fetched),
+            "dom_ready_ms": None,
+            "load_ms": None
+        }
+
+
+class FakeHomePage(FakePage):
+    pass
+
+
+class FakeLoginPage(FakePage):
+    """ The fixture's /login page: the username and password fields and the sign-in button """
+
+    def __init__(self, driver, url):
+        super().__init__(driver, url)
+        self.username = self.add(FakeNode("input", "form-control", attributes={"id": "form3-username", "value": ""},
+                                          rect=(700, 200, 300, 40)))
+        self.password = self.add(FakeNode("input", "form-control", attributes={"id": "form3-password", "value": ""},
+                                          rect=(700, 260, 300, 40)))
+        self.add(FakeNode("button", "submit button", attributes={"formaction": "/login"}, rect=(700, 320, 120, 40),
+                          xpaths=(LOGIN_BUTTON_XPATH,)))
+
+    def press(self, key):
+        if key == "\t":
+            self.focus = self.password if self.focus is self.username else self.username
+        elif self.focus in (self.username, self.password):
+            self.focus.attributes["value"] += key
+
+    def type_text(self, node, text):
+        for key in text:
+            self.focus = node
+            self.press(key)
+
+    def form_values(self):
+        return {"username": self.username.attributes["value"], "password": self.password.attributes["value"]}
+
+
+class FakeHeavyPage(FakePage):
+    """ One of the fixture's HEAVY_PAGES: its list element, and the heavy assets its html references """
+
+    def __init__(self, driver, url, path):
+        super().__init__(driver, url)
+        self.html = HEAVY_PAGES[path]
+        name = re.search(r'<main class="(\w+)"', self.html).group(1)
+        self.add(FakeNode("div", name + "-list", rect=(10, 60, 800, 450)))
+
+    def page_source(self):
+        return self.html
+
+    def resources(self):
+        return [match.group("path") for match in ASSET_PATTERN.finditer(self.html)
+                if match.group("path") in HEAVY_ASSETS]
+
+
+class FakePuzzlePage(FakePage):
+    """ The fixture's /training/<id> page: plays the opening, answers correct moves, then shows continue """
+
+    def __init__(self, driver, url, puzzle, next_url):
+        super().__init__(driver, url)
+        self.puzzle = puzzle
+        self.next_url = next_url
+        self.played = 0
+        self.add_board(puzzle["orientation"])
+        self.table = self.add(FakeNode("div", "tview2 tview2-column", attributes={"moves": []},
+                                       xpaths=(MOVES_TABLE_XPATH,)))
+        while self.played < puzzle["start"] - 1:
+            self.play_ply()
+        self.schedule(driver.opening_delay_ms, self.play_ply)
+
+    def play_ply(self):
+        san, origin, destination = self.puzzle["plies"][self.played]
+        setup = self.puzzle.get("setup")
+        if setup is not None and self.played == self.puzzle["start"] - 1:
+            self.board.set_position(setup["squares"], setup["last_move"])
+        elif origin is not None:
+            self.board.move(origin, destination)
+        moves = self.table.attributes["moves"]
+        if moves:
+            moves[-1][1] = "hist"
+        moves.append([san, "hist active"])
+        self.played += 1
+
+    def complete(self):
+        self.add(FakeNode("div", "complete", rect=(500, 300, 200, 30), text="Success!"))
+        self.add(FakeNode("a", "continue", attributes={"href": self.next_url}, rect=(500, 340, 200, 30),
+                          text="Continue training"))
+
+    def user_move(self, origin, destination):
+        plies = self.puzzle["plies"]
+        if self.played >= len(plies) or plies[self.played][1:] != [origin, destination]:
+            return
+        self.play_ply()
+        if self.played >= len(plies):
+            self.complete()
+            return
+        self.schedule(self.driver.reply_delay_ms, self.play_ply)
+
+
+class FakeAnalysisPage(FakePage):
+    """ The fixture's /analysis page: pgn import, click-to-move and a principal variation for the next ply """
+
+    def __init__(self, driver, url, puzzles):
+        super().__init__(driver, url)
+        self.games = [puzzle["plies"] for puzzle in puzzles]
+        self.setups = [get_setup(puzzle) for puzzle in puzzles]
+        self.line = []
+        self.engine_on = False
+        self.select_all = False
+        self.add_board("white")
+        self.info = self.add(FakeNode("span", "info", rect=(500, 30, 200, 20)))
+        self.pv = self.add(FakeNode("div", "pv pv--nowrap", rect=(500, 60, 400, 30)))
+        self.pgn = self.add(FakeNode("div", "pgn", rect=(500, 560, 400, 150)))
+        self.textarea = self.add(FakeNode("textarea", "copyable autoselect", attributes={"value": ""},
+                                          rect=(500, 560, 400, 100)))
+        self.button = self.add(FakeNode("button", "button button-thin action text", rect=(500, 670, 120, 30)))
+
+    def next_ply(self, accept=None):
+        for plies in self.games:
+            if len(plies) <= len(self.line):
+                continue
+            if [ply[0] for ply in plies[:len(self.line)]] != self.line:
+                continue
+            ply = plies[len(self.line)]
+            if accept is None or accept(ply):
+                return ply
+        return None
+
+    def apply_setup(self):
+        for plies, setup in zip(self.games, self.setups):
+            if setup is not None and setup["start"] == len(self.line) \
+                    and [ply[0] for ply in plies[:len(self.line)]] == self.line:
+                self.board.set_position(setup["squares"], setup["last_move"])
+                return True
+        return False
+
+    def pgn_text(self):
+        text = ""
+        for index, san in enumerate(self.line):
+            if index % 2 == 0:
+                text += str(index//2 + 1) + ". "
+            text += san + " "
+        return text.strip()
+
+    def show_pv(self):
+        self.events = []
+        for child in self.pv.children:
+            child.alive = False
+        self.pv.children = []
+        self.pv.attributes.pop("data-uci", None)
+        self.info.text = ""
+        ply = self.next_ply()
+        if not self.engine_on or ply is None:
+            return
+        index = str(len(self.line)//2 + 1) + ("." if len(self.line) % 2 == 0 else "...")
+        evaluation = "+9.9" if not ply[0].endswith("#") else "#1" if len(self.line) % 2 == 0 else "#-1"
+
+        def deepen(depth):
+            self.info.text = "Depth {}/99".format(depth)
+            if depth < ENGINE_MAX_DEPTH:
+                self.schedule(self.driver.engine_depth_ms, lambda: deepen(depth + 1))
+
+        def render():
+            self.pv.children = [FakeNode("strong", text=evaluation), FakeNode("span", text=index),
+                                FakeNode("span", text=ply[0])]
+            if ply[1] is not None:
+                self.pv.attributes["data-uci"] = ply[1] + ply[2]
+            # without a depth step the search is over at once
+            deepen(1 if self.driver.engine_depth_ms else ENGINE_MAX_DEPTH)
+        self.schedule(self.driver.engine_delay_ms, render)
+
+    def user_move(self, origin, destination):
+        ply = self.next_ply(lambda ply: ply[1] == origin and ply[2] == destination)
+        if ply is None:
+            return
+        self.board.move(origin, destination)
+        self.line.append(ply[0])
+        self.textarea.attributes["value"] = self.pgn_text()
+        self.show_pv()
+
+    def import_pgn(self):
+        tokens = [re.sub(r"^\d+\.+", "", token) for token in self.textarea.attributes["value"].split()
+                  if not re.match(r"^\d+\.+$", token)]
+        self.board.reset()
+        self.line = []
+        for token in tokens:
+            ply = self.next_ply(lambda ply: ply[0] == token)
+            if ply is None:
+                break
+            self.line.append(ply[0])
+            if not self.apply_setup() and ply[1] is not None:
+                self.board.move(ply[1], ply[2])
+        self.show_pv()
+
+    def click(self, node, x, y):
+        super().click(node, x, y)
+        self.select_all = False
+        if node is self.pgn or node is self.textarea:
+            # clicking the pgn box focuses and selects the textarea, typing then replaces its text
+            self.focus = self.textarea
+            self.select_all = True
+        elif node is self.button:
+            self.import_pgn()
+
+    def press(self, key):
+        if self.focus is self.textarea:
+            self.type_text(self.textarea, key)
+        elif key == " ":
+            self.engine_on = not self.engine_on
+            self.show_pv()
+
+    def type_text(self, node, text):
+        if node is not self.textarea:
+            return
+        if self.select_all:
+            node.attributes["value"] = ""
+            self.select_all = False
+        node.attributes["value"] += text
+
+
+class FakeElement(WebElement):
+    """ A WebElement whose commands are answered by a FakeDriver """
+
+    def __init__(self, parent, id_, node):
+        super().__init__(parent, id_)
+        self.node = node
+
+
+class FakeWindow:
+    """ What a window of the fake browser keeps while another one is current. The windows of a browser
+    context share its cookies and storage """
+    page = None
+    rect = None
+    pointer = (0, 0)
+    pressed = None
+    blocked_urls = None
+    context = None
+    history = None
+
+    def __init__(self, page, rect, context):
+        self.page = page
+        self.rect = rect
+        self.blocked_urls = []
+        self.context = context
+        self.history = []
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def window(self, handle):
+        self.driver.execute(Command.SWITCH_TO_WINDOW, {"handle": handle})
+
+
+class FakeDriver:
+    """ Answers the WebDriver commands main.py sends, in process, from a Python model of the fixture pages.
+
+    Every command goes through execute(), like in a real session, and is counted in commands, so the
+    round-trips of an operation can be measured without a browser. latency adds a fixed cost per command
+    to mimic the chromedriver hop, leak_bytes makes the reported JS heap grow with every command to try
+    out soak.SoakMonitor. Windows can be opened, switched to and closed, and browser contexts created with
+    the Target DevTools commands, like shared_browser.SharedBrowser does; only the current window's page
+    runs, the others catch up with their timers when switched to. Scripts are recognised by identity: only
+    the probe scripts of waits, snapshot, geometry, move_history, page_load, auth_sessions and
+    board_events can be run """
+    _is_remote = False
+    session_id = "fake-session"
+    page = None
+    commands = None
+
+    def __init__(self, puzzles=None, base_url=FAKE_URL, latency=0.0, opening_delay_ms=0, reply_delay_ms=0,
+                 engine_delay_ms=0, engine_depth_ms=0, window_size=(1920, 1080), login_delay_ms=0, sessions=None,
+                 leak_bytes=0):
+        self.puzzles = puzzles if puzzles is not None else PUZZLES
+        self.base_url = base_url
+        self.latency = latency
+        self.opening_delay_ms = opening_delay_ms
+        self.reply_delay_ms = reply_delay_ms
+        self.engine_delay_ms = engine_delay_ms
+        self.engine_depth_ms = engine_depth_ms
+        self.window_rect = {"x": 0, "y": 0, "width": window_size[0], "height": window_size[1]}
+        self.commands = collections.Counter()
+        self.elements = dict()
+        self.element_ids = dict()
+        self.pointer = (0, 0)
+        self.pressed = None
+        self.closed = False
+        self.blocked_urls = []
+        self.login_delay_ms = login_delay_ms
+        self.sessions = sessions if sessions is not None else FAKE_SESSIONS
+        self.cookies = dict()
+        self.local_storage = dict()
+        self.leak_bytes = leak_bytes
+        self.page = FakeHomePage(self, "about:blank")
+        self.handle = "fake-window"
+        self.windows = {self.handle: FakeWindow(self.page, self.window_rect, "default")}
+        self.contexts = {"default": (self.cookies, self.local_storage)}
+        self.handlers = {
+            Command.GET: self.command_get,
+            Command.GET_CURRENT_URL: lambda params: self.page.url,
+            Command.GET_PAGE_SOURCE: lambda params: self.page.page_source(),
+            Command.W3C_EXECUTE_SCRIPT: self.command_execute_script,
+            Command.W3C_EXECUTE_SCRIPT_ASYNC: self.command_execute_async_script,
+            Command.FIND_ELEMENT: self.command_find_element,
+            Command.FIND_ELEMENTS: self.command_find_elements,
+            Command.GET_ELEMENT_PROPERTY: self.command_get_property,
+            Command.SEND_KEYS_TO_ELEMENT: self.command_send_keys,
+            Command.W3C_ACTIONS: self.command_actions,
+            Command.W3C_CLEAR_ACTIONS: lambda params: None,
+            Command.GET_WINDOW_RECT: lambda params: dict(self.window_rect),
+            Command.SET_WINDOW_RECT: self.command_set_window_rect,
+            Command.W3C_MAXIMIZE_WINDOW: lambda params: dict(self.window_rect),
+            Command.W3C_GET_WINDOW_HANDLES: lambda params: list(self.windows),
+            Command.W3C_GET_CURRENT_WINDOW_HANDLE: lambda params: self.handle,
+            Command.SWITCH_TO_WINDOW: lambda params: self.switch_window(params["handle"]),
+            Command.NEW_WINDOW: lambda params: {"handle": self.open_window("default"), "type": "window"},
+            Command.CLOSE: self.command_close,
+            Command.QUIT: self.command_quit,
+            Command.GET_ALL_COOKIES: lambda params: [dict(cookie) for cookie in self.cookies.values()],
+            Command.ADD_COOKIE: lambda params: self.set_cookie(params["cookie"]),
+            Command.DELETE_ALL_COOKIES: lambda params: self.cookies.clear(),
+            "executeCdpCommand": self.command_cdp,
+        }
+        self.scripts = {
+            waits.BOARD_SIGNATURE_SCRIPT: "board_signature",
+            waits.LAST_MOVE_SCRIPT: "last_move_squares",
+            waits.PV_TEXT_SCRIPT: "pv_text",
+            waits.PV_UCI_SCRIPT: "pv_uci",
+            CEVAL_SCRIPT: "ceval",
+            waits.VISIBLE_SCRIPT: "visible",
+            waits.PLY_COUNT_SCRIPT: "ply_count",
+            waits.PLAYERS_TURN_SCRIPT: "players_turn",
+            SNAPSHOT_SCRIPT: "snapshot",
+            GEOMETRY_SCRIPT: "geometry",
+            MOVES_SCRIPT: "moves",
+            PAGE_STATS_SCRIPT: "page_stats",
+            READ_STORAGE_SCRIPT: "read_storage",
+            RESTORE_STORAGE_SCRIPT: "restore_storage",
+            INSTALL_SCRIPT: "board_events_install",
+        }
+        self.async_scripts = {
+            DRAIN_SCRIPT: "board_events_drain",
+        }
+
+    def execute(self, command, params=None):
+        self.commands[command] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.closed:
+            raise InvalidSessionIdException("The fake session was quit")
+        handler = self.handlers.get(command)
+        if handler is None:
+            raise WebDriverException("The fake driver does not implement " + command)
+        if self.handle is None:
+            if command not in WINDOWLESS_COMMANDS:
+                raise NoSuchWindowException("no such window: target window already closed")
+        else:
+            self.page.advance()
+        return {"value": handler(params or dict())}
+
+    # WebDriver API used by main.py, each method is one command like in selenium's WebDriver
+    def get(self, url):
+        self.execute(Command.GET, {"url": url})
+
+    @property
+    def current_url(self):
+        return self.execute(Command.GET_CURRENT_URL)["value"]
+
+    @property
+    def page_source(self):
+        return self.execute(Command.GET_PAGE_SOURCE)["value"]
+
+    def execute_script(self, script, *args):
+        return self.execute(Command.W3C_EXECUTE_SCRIPT, {"script": script, "args": list(args)})["value"]
+
+    def execute_async_script(self, script, *args):
+        return self.execute(Command.W3C_EXECUTE_SCRIPT_ASYNC, {"script": script, "args": list(args)})["value"]
+
+    def find_element(self, by=By.ID, value=None):
+        return self.execute(Command.FIND_ELEMENT, {"using": by, "value": value})["value"]
+
+    def find_elements(self, by=By.ID, value=None):
+        return self.execute(Command.FIND_ELEMENTS, {"using": by, "value": value})["value"]
+
+    def get_window_size(self, windowHandle="current"):
+        rect = self.execute(Command.GET_WINDOW_RECT)["value"]
+        return {"width": rect["width"], "height": rect["height"]}
+
+    def set_window_size(self, width, height, windowHandle="current"):
+        self.execute(Command.SET_WINDOW_RECT, {"width": int(width), "height": int(height)})
+
+    def get_window_position(self, windowHandle="current"):
+        rect = self.execute(Command.GET_WINDOW_RECT)["value"]
+        return {"x": rect["x"], "y": rect["y"]}
+
+    def set_window_position(self, x, y, windowHandle="current"):
+        self.execute(Command.SET_WINDOW_RECT, {"x": int(x), "y": int(y)})
+
+    def maximize_window(self):
+        self.execute(Command.W3C_MAXIMIZE_WINDOW)
+
+    @property
+    def window_handles(self):
+        return self.execute(Command.W3C_GET_WINDOW_HANDLES)["value"]
+
+    @property
+    def current_window_handle(self):
+        return self.execute(Command.W3C_GET_CURRENT_WINDOW_HANDLE)["value"]
+
+    @property
+    def switch_to(self):
+        return FakeSwitchTo(self)
+
+    def get_cookies(self):
+        return self.execute(Command.GET_ALL_COOKIES)["value"]
+
+    def add_cookie(self, cookie_dict):
+        self.execute(Command.ADD_COOKIE, {"cookie": cookie_dict})
+
+    def delete_all_cookies(self):
+        self.execute(Command.DELETE_ALL_COOKIES)
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        return self.execute("executeCdpCommand", {"cmd": cmd, "params": cmd_args})["value"]
+
+    def close(self):
+        self.execute(Command.CLOSE)
+
+    def quit(self):
+        self.execute(Command.QUIT)
+
+    # Command handlers
+    def navigate(self, url):
+        """ Load the fake page of a url: /, /training, /training/<id>, /analysis, /login or one of the heavy pages """
+        for node in self.page.nodes:
+            node.alive = False
+        if self.handle in self.windows:
+            self.windows[self.handle].history.append(url)
+        path = url[len(self.base_url):] if url.startswith(self.base_url) else url
+        path = path.split("?")[0].rstrip("/")
+        self.pointer = (0, 0)
+        self.pressed = None
+        if path == "/training" or path.startswith("/training/"):
+            puzzle_id = path[len("/training/"):] if path.startswith("/training/") else self.puzzles[0]["id"]
+            puzzle = get_puzzle(puzzle_id, self.puzzles)
+            if puzzle is not None:
+                next_puzzle = self.puzzles[(self.puzzles.index(puzzle) + 1) % len(self.puzzles)]
+                self.page = FakePuzzlePage(self, self.base_url + path, puzzle, "/training/" + next_puzzle["id"])
+                return
+        elif path == "/analysis":
+            self.page = FakeAnalysisPage(self, self.base_url + path, self.puzzles)
+            return
+        elif path == "/login":
+            self.page = FakeLoginPage(self, self.base_url + path)
+            return
+        elif path in HEAVY_PAGES:
+            self.page = FakeHeavyPage(self, self.base_url + path, path)
+            return
+        self.page = FakeHomePage(self, url)
+
+    def signed_in_user(self):
+        """ The username of the session cookie, or None without a live session """
+        cookie = self.cookies.get(SESSION_COOKIE)
+        session = self.sessions.get(cookie["value"]) if cookie is not None else None
+        if session is None or session[1] < time.time():
+            return None
+        return session[0]
+
+    def set_cookie(self, cookie):
+        self.cookies[cookie["name"]] = dict(cookie)
+
+    def post(self, path, form):
+        """ Submit a form the way the fixture answers it: /login signs in, /logout signs out """
+        if path == "/login":
+            if self.login_delay_ms:
+                time.sleep(self.login_delay_ms/1000)
+            if FIXTURE_ACCOUNTS.get(form.get("username")) != form.get("password"):
+                self.navigate(self.base_url + "/login")
+                return
+            token = secrets.token_hex(16)
+            expiry = int(time.time() + SESSION_SECONDS)
+            self.sessions[token] = (form["username"], expiry)
+            self.set_cookie({"name": SESSION_COOKIE, "value": token, "path": "/",
+                             "domain": urlsplit(self.base_url).hostname, "secure": False, "httpOnly": True,
+                             "sameSite": "Lax", "expiry": expiry})
+        elif path == "/logout":
+            cookie = self.cookies.pop(SESSION_COOKIE, None)
+            if cookie is not None:
+                self.sessions.pop(cookie["value"], None)
+        self.navigate(self.base_url + "/")
+
+    def command_get(self, params):
+        self.navigate(params["url"])
+
+    def command_quit(self, params):
+        for window in self.windows.values():
+            for node in window.page.nodes:
+                node.alive = False
+        self.closed = True
+
+    def command_close(self, params):
+        """ Close the current window. The session ends with its last window, like chromedriver's """
+        self.drop_window(self.handle)
+        return list(self.windows)
+
+    def drop_window(self, handle):
+        self.save_window()
+        for node in self.windows.pop(handle).page.nodes:
+            node.alive = False
+        if handle == self.handle:
+            self.handle = None
+        if not self.windows:
+            self.closed = True
+
+    def open_window(self, context, url="about:blank"):
+        """ Open a window in a browser context, without switching to it, and return its handle """
+        handle = "fake-window-{}".format(secrets.token_hex(4))
+        self.save_window()
+        current = self.handle
+        self.handle = handle
+        self.cookies, self.local_storage = self.contexts[context]
+        self.windows[handle] = FakeWindow(FakeHomePage(self, "about:blank"), dict(self.window_rect), context)
+        self.load_window(handle)
+        self.navigate(url)
+        self.save_window()
+        self.handle = current
+        if current is not None:
+            self.load_window(current)
+        return handle
+
+    def switch_window(self, handle):
+        if handle not in self.windows:
+            raise NoSuchWindowException("no such window")
+        self.save_window()
+        self.handle = handle
+        self.load_window(handle)
+
+    def save_window(self):
+        """ Keep the current window's state in its FakeWindow """
+        if self.handle is None:
+            return
+        window = self.windows[self.handle]
+        window.page = self.page
+        window.rect = self.window_rect
+        window.pointer = self.pointer
+        window.pressed = self.pressed
+        window.blocked_urls = self.blocked_urls
+
+    def load_window(self, handle):
+        """ Make a window's state, and its context's cookies and storage, the current ones """
+        window = self.windows[handle]
+        self.page = window.page
+        self.window_rect = window.rect
+        self.pointer = window.pointer
+        self.pressed = window.pressed
+        self.blocked_urls = window.blocked_urls
+        self.cookies, self.local_storage = self.contexts[window.context]
+
+    def command_execute_script(self, params):
+        name = self.scripts.get(params["script"])
+        if name is None:
+            raise JavascriptException("The fake driver cannot run this script")
+        return getattr(self.page, name)(*params["args"])
+
+    def command_execute_async_script(self, params):
+        name = self.async_scripts.get(params["script"])
+        if name is None:
+            raise JavascriptException("The fake driver cannot run this async script")
+        return getattr(self.page, name)(*params["args"])
+
+    def wrap(self, node):
+        """ Return the FakeElement of a node, the same id for the same node like a real session """
+        element_id = self.element_ids.get(id(node))
+        if element_id is None or self.elements[element_id].node is not node:
+            element_id = "fake-element-{}".format(len(self.elements) + 1)
+            self.element_ids[id(node)] = element_id
+            self.elements[element_id] = FakeElement(self, element_id, node)
+        return self.elements[element_id]
+
+    def resolve(self, element_id):
+        element = self.elements.get(element_id)
+        if element is None or not element.node.alive:
+            raise StaleElementReferenceException("stale element reference: element is not attached to the page document")
+        return element.node
+
+    def command_find_element(self, params):
+        nodes = self.page.find(params["using"], params["value"])
+        if not nodes:
+            raise NoSuchElementException("no such element: Unable to locate element: "
+                                         "{{\"method\":\"{}\",\"selector\":\"{}\"}}".format(params["using"],
+                                                                                     params["value"]))
+        return self.wrap(nodes[0])
+
+    def command_find_elements(self, params):
+        return [self.wrap(node) for node in self.page.find(params["using"], params["value"])]
+
+    def command_get_property(self, params):
+        node = self.resolve(params["id"])
+        name = params["name"]
+        if name == "classList":
+            return node.class_name.split()
+        if name == "clientWidth":
+            return node.rect[2] if node.rect else 0
+        if name == "clientHeight":
+            return node.rect[3] if node.rect else 0
+        if name == "childElementCount":
+            return len(node.children)
+        if name == "childNodes":
+            return [self.wrap(child) for child in node.children]
+        if name in ("innerText", "textContent"):
+            return node.inner_text()
+        return node.attributes.get(name)
+
+    def command_send_keys(self, params):
+        node = self.resolve(params["id"])
+        self.page.focus = node
+        self.page.type_text(node, typed_text(params["text"]))
+
+    def command_cdp(self, params):
+        """ DevTools commands: mouse events are dispatched at viewport coordinates, blocked url patterns are
+        kept for page_stats, cookies are set and cleared, so is storage, Performance metrics are made up, the rest
+        are accepted """
+        if params["cmd"] == "Performance.getMetrics":
+            return {"metrics": self.performance_metrics()}
+        if params["cmd"] == "Target.createBrowserContext":
+            context = "fake-context-{}".format(len(self.contexts))
+            self.contexts[context] = (dict(), dict())
+            return {"browserContextId": context}
+        if params["cmd"] == "Target.createTarget":
+            arguments = params["params"]
+            return {"targetId": self.open_window(arguments.get("browserContextId", "default"),
+                                                 arguments.get("url", "about:blank"))}
+        if params["cmd"] == "Target.disposeBrowserContext":
+            context = params["params"]["browserContextId"]
+            for handle in [handle for handle, window in self.windows.items() if window.context == context]:
+                self.drop_window(handle)
+            del self.contexts[context]
+        if params["cmd"] == "Network.setBlockedURLs":
+            self.blocked_urls = list(params["params"]["urls"])
+        elif params["cmd"] == "Network.setCookies":
+            for cookie in params["params"]["cookies"]:
+                cookie = dict(cookie)
+                url = cookie.pop("url", None)
+                if url is not None:
+                    cookie["domain"] = urlsplit(url).hostname
+                if "expires" in cookie:
+                    cookie["expiry"] = cookie.pop("expires")
+                self.set_cookie(cookie)
+        elif params["cmd"] == "Network.clearBrowserCookies":
+            self.cookies.clear()
+        elif params["cmd"] == "Page.getNavigationHistory":
+            history = self.windows[self.handle].history or ["about:blank"]
+            return {"currentIndex": len(history) - 1, "entries": [{"url": url} for url in history]}
+        elif params["cmd"] == "Storage.clearDataForOrigin":
+            # the fake keeps one storage per browser context, of the fixture's origin
+            if self.base_url.startswith(params["params"]["origin"]):
+                self.local_storage.clear()
+        elif params["cmd"] == "Input.dispatchMouseEvent":
+            event = params["params"]
+            self.pointer = (event["x"], event["y"])
+            if event["type"] == "mousePressed":
+                self.pressed = self.page.hit(*self.pointer)
+            elif event["type"] == "mouseReleased":
+                self.release_pointer()
+        return dict()
+
+    def performance_metrics(self):
+        """ The page's DOM nodes, and a JS heap that grows by leak_bytes with every command the session
+        answered, like a page that leaks a little on every move """
+        heap = HEAP_BYTES + self.leak_bytes*sum(self.commands.values())
+        return [{"name": "JSHeapUsedSize", "value": heap}, {"name": "JSHeapTotalSize", "value": heap*1.25},
+                {"name": "Nodes", "value": len(self.page.nodes)}, {"name": "Documents", "value": 1},
+                {"name": "JSEventListeners", "value": 0}]
+
+    def is_blocked(self, path):
+        """ Whether a blocked url pattern matches the url of a path, * matching any run of characters """
+        url = self.base_url + path
+        return any(fnmatch.fnmatchcase(url, pattern) for pattern in self.blocked_urls)
+
+    def release_pointer(self):
+        node = self.page.hit(*self.pointer)
+        if node is not None and node is self.pressed:
+            self.page.click(node, *self.pointer)
+        self.pressed = None
+
+    def command_set_window_rect(self, params):
+        self.window_rect.update({key: value for key, value in params.items() if value is not None})
+        return dict(self.window_rect)
+
+    def command_actions(self, params):
+        """ Replay a W3C actions payload tick by tick. Pointer moves relative to an element start from the
+        element's centre, as the W3C spec (and chromedriver) define it """
+        sources = params["actions"]
+        ticks = max([len(source["actions"]) for source in sources] + [0])
+        for tick in range(ticks):
+            for source in sources:
+                if tick >= len(source["actions"]):
+                    continue
+                action = source["actions"][tick]
+                kind = action["type"]
+                if kind == "pointerMove":
+                    self.move_pointer(action)
+                elif kind == "pointerDown":
+                    self.pressed = self.page.hit(*self.pointer)
+                elif kind == "pointerUp":
+                    self.release_pointer()
+                elif kind == "keyDown":
+                    key = typed_text(action["value"])
+                    if key:
+                        self.page.press(key)
+
+    def move_pointer(self, action):
+        origin = action.get("origin", "viewport")
+        x, y = action.get("x", 0), action.get("y", 0)
+        if isinstance(origin, dict):
+            left, top = self.resolve(origin[ELEMENT_KEY]).centre()
+            self.pointer = (left + x, top + y)
+        elif origin == "pointer":
+            self.pointer = (self.pointer[0] + x, self.pointer[1] + y)
+        else:
+            self.pointer = (x, y)
@@ -0,0 +1,621 @@
+# Lichess.org Testing with Selenium
+# Local stand-in for the lichess.org pages the testers drive, so runs can happen offline
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+import secrets
+import json
+import threading
+import time
+
+
+OPENING_DELAY_MS = 300  # the puzzle plays the opponent's last move this long after the page loads
+REPLY_DELAY_MS = 300    # the puzzle answers a correct move after this long
+ENGINE_DELAY_MS = 50    # the analysis page shows a principal variation after this long
+ENGINE_DEPTH_MS = 20    # then searches one ply deeper every this many milliseconds
+ENGINE_MAX_DEPTH = 30   # and stops at this depth
+ASSET_DELAY_MS = 200    # every heavy asset is answered this late, so the load event waits on them like on a slow link
+LOGIN_DELAY_MS = 500    # a sign-in is answered this late, like lichess.org checking a password
+SESSION_SECONDS = 3600  # a sign-in cookie is valid this long
+SESSION_COOKIE = "lila2"
+FIXTURE_ACCOUNTS = {"Throwawayy123": "123456"}     # username -> password the stand-in login accepts
+
+# Short games from the initial position. Each puzzle starts after the opponent plays ply `start` - 1,
+# the player then has to find every remaining ply of its color.
+# A puzzle may also carry a "setup": the board after ply `start` - 1 as 64 BoardSnapshot squares and that
+# ply's [from, to]. The board then jumps to it, and the plies before it may have null squares (see replay.py)
+PUZZLES = [
+    {
+        "id": "fx001",
+        "orientation": "white",
+        "start": 6,
+        "plies": [
+            ["e4", "e2", "e4"], ["e5", "e7", "e5"], ["Bc4", "f1", "c4"], ["Nc6", "b8", "c6"],
+            ["Qh5", "d1", "h5"], ["Nf6", "g8", "f6"], ["Qxf7#", "h5", "f7"]
+        ]
+    },
+    {
+        "id": "fx002",
+        "orientation": "black",
+        "start": 3,
+        "plies": [
+            ["f3", "f2", "f3"], ["e5", "e7", "e5"], ["g4", "g2", "g4"], ["Qh4#", "d8", "h4"]
+        ]
+    },
+    {
+        "id": "fx003",
+        "orientation": "white",
+        "start": 10,
+        "plies": [
+            ["e4", "e2", "e4"], ["e5", "e7", "e5"], ["Nf3", "g1", "f3"], ["d6", "d7", "d6"],
+            ["Bc4", "f1", "c4"], ["Bg4", "c8", "g4"], ["Nc3", "b1", "c3"], ["g6", "g7", "g6"],
+            ["Nxe5", "f3", "e5"], ["Bxd1", "g4", "d1"], ["Bxf7+", "c4", "f7"], ["Ke7", "e8", "e7"],
+            ["Nd5#", "c3", "d5"]
+        ]
+    }
+]
+
+
+# A minimal chessground: same element names, classes and cgKey properties as lichess, driven by clicks
+BOARD_SCRIPT = """
+var SQUARE = 60;
+var ROLES = {p: 'pawn', n: 'knight', b: 'bishop', r: 'rook', q: 'queen', k: 'king'};
+var START = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR';
+
+function startPieces() {
+    var pieces = {};
+    var rows = START.split('/');
+    for (var row = 0; row < 8; row++) {
+        var file = 0;
+        for (var i = 0; i < rows[row].length; i++) {
+            var c = rows[row][i];
+            if (c >= '1' && c <= '8') { file += parseInt(c); continue; }
+            var key = String.fromCharCode(97 + file) + (8 - row);
+            pieces[key] = {color: c === c.toUpperCase() ? 'white' : 'black', role: ROLES[c.toLowerCase()]};
+            file++;
+        }
+    }
+    return pieces;
+}
+
+function FixtureBoard(wrap, orientation, onUserMove) {
+    var self = this;
+    this.orientation = orientation;
+    this.onUserMove = onUserMove;
+    this.pieces = startPieces();
+    this.lastMove = null;
+    this.selected = null;
+    wrap.className = 'cg-wrap orientation-' + orientation;
+    var container = document.createElement('cg-container');
+    container.style.cssText = 'display:block;position:relative;width:' + 8*SQUARE + 'px;height:' + 8*SQUARE + 'px';
+    this.board = document.createElement('cg-board');
+    this.board.style.cssText = 'display:block;position:absolute;top:0;left:0;width:100%;height:100%;background:#b58863';
+    container.appendChild(this.board);
+    var labels = {ranks: '12345678', files: 'abcdefgh'};
+    for (var name in labels) {
+        var coords = document.createElement('coords');
+        coords.className = name;
+        for (var i = 0; i < 8; i++) {
+            var coord = document.createElement('coord');
+            coord.textContent = labels[name][i];
+            coords.appendChild(coord);
+        }
+        container.appendChild(coords);
+    }
+    wrap.appendChild(container);
+    this.board.addEventListener('click', function(e) {
+        var rect = self.board.getBoundingClientRect();
+        var key = self.keyAt(e.clientX - rect.left, e.clientY - rect.top);
+        if (!key) return;
+        if (self.selected === null) {
+            if (self.pieces[key]) self.selected = key;
+        } else {
+            var from = self.selected;
+            self.selected = null;
+            if (from !== key && self.onUserMove) self.onUserMove(from, key);
+        }
+    });
+    this.render();
+}
+
+FixtureBoard.prototype.keyAt = function(x, y) {
+    var column = Math.floor(x/SQUARE), row = Math.floor(y/SQUARE);
+    if (column < 0 || column > 7 || row < 0 || row > 7) return null;
+    if (this.orientation === 'white') return String.fromCharCode(97 + column) + (8 - row);
+    return String.fromCharCode(97 + 7 - column) + (row + 1);
+};
+
+FixtureBoard.prototype.translate = function(key) {
+    var file = key.charCodeAt(0) - 97, rank = parseInt(key.slice(1)) - 1;
+    var x = this.orientation === 'white' ? file : 7 - file;
+    var y = this.orientation === 'white' ? 7 - rank : rank;
+    return 'position:absolute;width:' + SQUARE + 'px;height:' + SQUARE + 'px;transform:translate(' + x*SQUARE + 'px,' + y*SQUARE + 'px)';
+};
+
+FixtureBoard.prototype.reset = function() {
+    this.pieces = startPieces();
+    this.lastMove = null;
+    this.selected = null;
+    this.render();
+};
+
+FixtureBoard.prototype.setPosition = function(squares, lastMove) {
+    // squares run a1, b1, ... h8 like BoardSnapshot.squares
+    this.pieces = {};
+    for (var i = 0; i < 64; i++) {
+        var c = squares[i];
+        if (c === '.') continue;
+        var key = String.fromCharCode(97 + i % 8) + (Math.floor(i/8) + 1);
+        this.pieces[key] = {color: c === c.toUpperCase() ? 'white' : 'black', role: ROLES[c.toLowerCase()]};
+    }
+    this.lastMove = lastMove;
+    this.selected = null;
+    this.render();
+};
+
+FixtureBoard.prototype.move = function(from, to) {
+    this.pieces[to] = this.pieces[from];
+    delete this.pieces[from];
+    this.lastMove = [from, to];
+    this.render();
+};
+
+FixtureBoard.prototype.render = function() {
+    while (this.board.firstChild) this.board.removeChild(this.board.firstChild);
+    if (this.lastMove) {
+        // chessground lists the destination highlight first
+        var keys = [this.lastMove[1], this.lastMove[0]];
+        for (var i = 0; i < 2; i++) {
+            var square = document.createElement('square');
+            square.className = 'last-move';
+            square.cgKey = keys[i];
+            square.style.cssText = this.translate(keys[i]) + ';background:rgba(155,199,0,0.41)';
+            this.board.appendChild(square);
+        }
+    }
+    for (var key in this.pieces) {
+        var piece = document.createElement('piece');
+        piece.className = this.pieces[key].color + ' ' + this.pieces[key].role;
+        piece.cgKey = key;
+        piece.textContent = this.pieces[key].role[0].toUpperCase();
+        piece.style.cssText = this.translate(key) + ';color:' + this.pieces[key].color + ';font:40px sans-serif;text-align:center';
+        this.board.appendChild(piece);
+    }
+};
+"""
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{title}</title></head>
+<body>
+<header id="top">
+<div id="topnav">
+<section><a href="/training">Puzzles</a></section>
+<section><a href="/analysis">Analysis board</a></section>
+</div>
+<div class="site-buttons">{account}</div>
+</header>
+<div id="main-wrap">{main}</div>
+{scripts}
+</body>
+</html>
+"""
+
+HOME_MAIN = """<main class="lobby"><h1>lichess fixture</h1><a href="/training">Puzzles</a></main>"""
+
+# The header's account corner: //*[@id="top"]/div[2]/a signs in, //*[@id="user_tag"] tells a signed-in page
+SIGNIN_LINK = """<a href="/login" class="signin button button-empty">Sign in</a>"""
+USER_TAG = """<a id="user_tag" class="toggle link">{username}</a>
+<div id="dasher_app" class="dropdown"><div><div class="links">
+<a class="user-link" href="/@/{username}">Profile</a><a href="/inbox">Inbox</a><a href="/account/preferences">Preferences</a>
+<form class="logout" method="post" action="/logout"><button class="text" type="submit">Sign out</button></form>
+</div></div></div>"""
+
+# The sign-in button sits at //*[@id="main-wrap"]/main/form/div[1]/button like on lichess.org/login
+LOGIN_MAIN = """<main class="auth auth-login box box-pad"><h1>Sign in</h1>
+<form class="form3" method="post" action="/login"><div class="one-factor">{error}
+<input id="form3-username" name="username" class="form-control" autocomplete="username">
+<input id="form3-password" name="password" type="password" class="form-control" autocomplete="current-password">
+<button class="submit button" type="submit">Sign in</button>
+</div></form></main>"""
+
+# Deliberately heavy resources, served uncached with a body of the given size, for page_load.py to block
+HEAVY_ASSETS = {
+    "/assets/heavy/banner.jpg": ("image/jpeg", 400*1024),
+    "/assets/heavy/thumbnail.png": ("image/png", 120*1024),
+    "/assets/heavy/noto-sans.woff2": ("font/woff2", 160*1024),
+    "/assets/heavy/intro.mp4": ("video/mp4", 1536*1024),
+    "/youtube.com/embed/fixture": ("text/html", 300*1024),     # a stand-in player, under the embed url pattern
+}
+
+# Pages made of the heavy assets, each with the element a scenario waits for before using it
+HEAVY_PAGES = {
+    "/video": """<main class="video"><style>@font-face { font-family: heavy; src: url(/assets/heavy/noto-sans.woff2); }
+main.video { font-family: heavy; }</style>
+<div class="video-list"><img src="/assets/heavy/banner.jpg"><img src="/assets/heavy/thumbnail.png"></div>
+<iframe id="ytplayer" src="/youtube.com/embed/fixture"></iframe>
+<video src="/assets/heavy/intro.mp4" preload="auto"></video>
+</main>""",
+    "/blog": """<main class="blog"><div class="blog-list"><img src="/assets/heavy/banner.jpg"></div></main>""",
+}
+
+# The moves table sits at //*[@id="main-wrap"]/main/div[2]/div[2]/div like on lichess.org/training
+PUZZLE_MAIN = """<main class="puzzle">
+<div class="puzzle__board main-board"><div class="cg-wrap"></div></div>
+<div class="puzzle__tools"><div class="ceval-wrap"></div><div class="puzzle__moves"><div class="tview2 tview2-column"></div></div></div>
+<div class="puzzle__feedback"></div>
+</main>"""
+
+PUZZLE_SCRIPT = """
+var PUZZLE = {puzzle};
+var NEXT_URL = {next_url};
+var table = document.querySelector('.tview2');
+var played = 0;
+var board = new FixtureBoard(document.querySelector('.cg-wrap'), PUZZLE.orientation, userMove);
+
+function appendMove(san) {
+    if (played % 2 === 0) {
+        var index = document.createElement('index');
+        index.textContent = played/2 + 1;
+        table.appendChild(index);
+    }
+    var active = table.querySelector('move.active');
+    if (active) active.className = 'hist';
+    var move = document.createElement('move');
+    move.className = 'hist active';
+    move.textContent = san;
+    table.appendChild(move);
+}
+
+function playPly() {
+    var ply = PUZZLE.plies[played];
+    if (PUZZLE.setup && played === PUZZLE.start - 1) board.setPosition(PUZZLE.setup.squares, PUZZLE.setup.last_move);
+    else if (ply[1]) board.move(ply[1], ply[2]);
+    appendMove(ply[0]);
+    played++;
+}
+
+function complete() {
+    var feedback = document.querySelector('.puzzle__feedback');
+    var done = document.createElement('div');
+    done.className = 'complete';
+    done.textContent = 'Success!';
+    feedback.appendChild(done);
+    var next = document.createElement('a');
+    next.className = 'continue';
+    next.href = NEXT_URL;
+    next.textContent = 'Continue training';
+    feedback.appendChild(next);
+}
+
+function userMove(from, to) {
+    var ply = PUZZLE.plies[played];
+    if (!ply || ply[1] !== from || ply[2] !== to) return;
+    playPly();
+    if (played >= PUZZLE.plies.length) { complete(); return; }
+    setTimeout(playPly, {reply_delay});
+}
+
+while (played < PUZZLE.start - 1) playPly();
+setTimeout(playPly, {opening_delay});
+"""
+
+# The analysis page keeps the same pgn box, import button and principal variation markup as lichess.org/analysis
+ANALYSIS_MAIN = """<main class="analyse">
+<div class="analyse__board main-board"><div class="cg-wrap"></div></div>
+<div class="analyse__tools"><div class="ceval"><div class="engine">Stockfish <span class="info"></span></div>
+<div class="pv_box"><div class="pv pv--nowrap"></div></div></div></div>
+<div class="analyse__underboard">
+<div class="pgn"><textarea class="copyable autoselect" spellcheck="false"></textarea>
+<button class="button button-thin action text">Import PGN</button></div>
+</div>
+</main>"""
+
+ANALYSIS_SCRIPT = """
+var GAMES = {games};
+var SETUPS = {setups};
+var line = [];
+var engineOn = false;
+var pv = document.querySelector('div.pv');
+var info = document.querySelector('.ceval .engine .info');
+var textarea = document.querySelector('textarea.copyable');
+var board = new FixtureBoard(document.querySelector('.cg-wrap'), 'white', userMove);
+var pvTimer = null;
+var depthTimer = null;
+
+// Returns the next ply of the first game that continues the current line and passes accept()
+function nextPly(accept) {
+    for (var g = 0; g < GAMES.length; g++) {
+        var plies = GAMES[g];
+        if (plies.length <= line.length) continue;
+        var match = true;
+        for (var i = 0; i < line.length; i++) {
+            if (plies[i][0] !== line[i]) { match = false; break; }
+        }
+        var ply = plies[line.length];
+        if (match && (!accept || accept(ply))) return ply;
+    }
+    return null;
+}
+
+// Jumps to a game's setup once the line reaches the ply it was recorded after, returns whether it did
+function applySetup() {
+    for (var g = 0; g < GAMES.length; g++) {
+        var setup = SETUPS[g];
+        if (!setup || setup.start !== line.length) continue;
+        var match = true;
+        for (var i = 0; i < line.length; i++) {
+            if (GAMES[g][i][0] !== line[i]) { match = false; break; }
+        }
+        if (match) {
+            board.setPosition(setup.squares, setup.last_move);
+            return true;
+        }
+    }
+    return false;
+}
+
+function pgnText() {
+    var text = '';
+    for (var i = 0; i < line.length; i++) {
+        if (i % 2 === 0) text += (i/2 + 1) + '. ';
+        text += line[i] + ' ';
+    }
+    return text.trim();
+}
+
+function showPv() {
+    clearTimeout(pvTimer);
+    clearInterval(depthTimer);
+    while (pv.firstChild) pv.removeChild(pv.firstChild);
+    pv.removeAttribute('data-uci');
+    info.textContent = '';
+    var ply = nextPly();
+    if (!engineOn || !ply) return;
+    pvTimer = setTimeout(function() {
+        // the line never changes, only the depth it was searched to grows
+        var depth = 1;
+        info.textContent = 'Depth ' + depth + '/99';
+        depthTimer = setInterval(function() {
+            if (depth >= {max_depth}) return clearInterval(depthTimer);
+            depth++;
+            info.textContent = 'Depth ' + depth + '/99';
+        }, {depth_delay});
+        var evaluation = document.createElement('strong');
+        // evaluations are from white's side, like lichess.org shows them
+        evaluation.textContent = !/#$/.test(ply[0]) ? '+9.9' : line.length % 2 === 0 ? '#1' : '#-1';
+        var index = document.createElement('span');
+        index.textContent = Math.floor(line.length/2) + 1 + (line.length % 2 === 0 ? '.' : '...');
+        var san = document.createElement('span');
+        san.textContent = ply[0];
+        pv.appendChild(evaluation);
+        pv.appendChild(index);
+        pv.appendChild(san);
+        if (ply[1]) pv.setAttribute('data-uci', ply[1] + ply[2]);
+    }, {engine_delay});
+}
+
+function userMove(from, to) {
+    var ply = nextPly(function(ply) { return ply[1] === from && ply[2] === to; });
+    if (!ply) return;
+    board.move(from, to);
+    line.push(ply[0]);
+    textarea.value = pgnText();
+    showPv();
+}
+
+function importPgn() {
+    var tokens = textarea.value.split(/\\s+/).filter(function(token) {
+        return token.length > 0 && !/^\\d+\\.+$/.test(token);
+    });
+    tokens = tokens.map(function(token) { return token.replace(/^\\d+\\.+/, ''); });
+    board.reset();
+    line = [];
+    for (var i = 0; i < tokens.length; i++) {
+        var ply = nextPly(function(ply) { return ply[0] === tokens[i]; });
+        if (!ply) break;
+        line.push(ply[0]);
+        if (!applySetup() && ply[1]) board.move(ply[1], ply[2]);
+    }
+    showPv();
+}
+
+document.querySelector('div.pgn').addEventListener('click', function() {
+    textarea.focus();
+    textarea.select();
+});
+document.querySelector('div.pgn button').addEventListener('click', importPgn);
+document.addEventListener('keydown', function(e) {
+    if (e.key === ' ' && e.target !== textarea) {
+        engineOn = !engineOn;
+        e.preventDefault();
+        showPv();
+    }
+});
+"""
+
+
+def get_setup(puzzle):
+    """ Return a puzzle's setup with the number of plies it comes after, or None when it has none """
+    setup = puzzle.get("setup")
+    if setup is None:
+        return None
+    return {"start": puzzle["start"], "squares": setup["squares"], "last_move": setup["last_move"]}
+
+
+def get_puzzle(puzzle_id, puzzles=PUZZLES):
+    """ Return the fixture puzzle with the given id, or None """
+    for puzzle in puzzles:
+        if puzzle["id"] == puzzle_id:
+            return puzzle
+    return None
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """ Serves the home, puzzle, analysis, sign-in and heavy pages. self.server.puzzles holds the puzzle set """
+
+    def log_message(self, format, *args):
+        pass
+
+    def signed_in_user(self):
+        """ The username of the request's session cookie, or None without a live session """
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        if SESSION_COOKIE not in cookie:
+            return None
+        session = self.server.sessions.get(cookie[SESSION_COOKIE].value)
+        if session is None or session[1] < time.time():
+            return None
+        return session[0]
+
+    def send_page(self, title, main, script="", status=200):
+        scripts = ""
+        if script:
+            scripts = "<script>{}</script><script>{}</script>".format(BOARD_SCRIPT, script)
+        username = self.signed_in_user()
+        account = USER_TAG.format(username=username) if username is not None else SIGNIN_LINK
+        body = PAGE_TEMPLATE.format(title=title, main=main, scripts=scripts, account=account).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_asset(self, path):
+        content_type, size = HEAVY_ASSETS[path]
+        time.sleep(ASSET_DELAY_MS/1000)
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(size))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(bytes(size))
+
+    def send_redirect(self, location, cookie=None):
+        self.send_response(303)
+        self.send_header("Location", location)
+        if cookie is not None:
+            self.send_header("Set-Cookie", cookie)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def login(self):
+        """ Check the posted form against FIXTURE_ACCOUNTS; a match gets a session cookie and goes home """
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        username = form.get("username", [""])[0]
+        password = form.get("password", [""])[0]
+        time.sleep(LOGIN_DELAY_MS/1000)
+        if FIXTURE_ACCOUNTS.get(username) != password:
+            self.send_page("Sign in", LOGIN_MAIN.format(error="<p class=\"error\">Invalid username or password</p>"),
+                           status=401)
+            return
+        token = secrets.token_hex(16)
+        self.server.sessions[token] = (username, time.time() + SESSION_SECONDS)
+        self.send_redirect("/", "{}={}; Path=/; Max-Age={}; HttpOnly; SameSite=Lax".format(
+            SESSION_COOKIE, token, SESSION_SECONDS))
+
+    def logout(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        if SESSION_COOKIE in cookie:
+            self.server.sessions.pop(cookie[SESSION_COOKIE].value, None)
+        self.send_redirect("/", "{}=; Path=/; Max-Age=0".format(SESSION_COOKIE))
+
+    def send_not_found(self):
+        self.send_error(404)
+
+    def puzzle_page(self, puzzle_id):
+        puzzles = self.server.puzzles
+        puzzle = get_puzzle(puzzle_id, puzzles)
+        if puzzle is None:
+            self.send_not_found()
+            return
+        next_puzzle = puzzles[(puzzles.index(puzzle) + 1) % len(puzzles)]
+        script = PUZZLE_SCRIPT.replace("{puzzle}", json.dumps(puzzle)) \
+            .replace("{next_url}", json.dumps("/training/" + next_puzzle["id"])) \
+            .replace("{reply_delay}", str(REPLY_DELAY_MS)) \
+            .replace("{opening_delay}", str(OPENING_DELAY_MS))
+        self.send_page("Puzzle " + puzzle["id"], PUZZLE_MAIN, script)
+
+    def analysis_page(self):
+        games = [puzzle["plies"] for puzzle in self.server.puzzles]
+        setups = [get_setup(puzzle) for puzzle in self.server.puzzles]
+        script = ANALYSIS_SCRIPT.replace("{games}", json.dumps(games)) \
+            .replace("{setups}", json.dumps(setups)) \
+            .replace("{engine_delay}", str(ENGINE_DELAY_MS)) \
+            .replace("{depth_delay}", str(ENGINE_DEPTH_MS)) \
+            .replace("{max_depth}", str(ENGINE_MAX_DEPTH))
+        self.send_page("Analysis board", ANALYSIS_MAIN, script)
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "":
+            self.send_page("lichess fixture", HOME_MAIN)
+        elif path == "/training":
+            self.puzzle_page(self.server.puzzles[0]["id"])
+        elif path.startswith("/training/"):
+            self.puzzle_page(path[len("/training/"):])
+        elif path == "/analysis":
+            self.analysis_page()
+        elif path == "/login":
+            self.send_page("Sign in", LOGIN_MAIN.format(error=""))
+        elif path in HEAVY_PAGES:
+            self.send_page("lichess fixture", HEAVY_PAGES[path])
+        elif path in HEAVY_ASSETS:
+            self.send_asset(path)
+        else:
+            self.send_not_found()
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/login":
+            self.login()
+        elif path == "/logout":
+            self.logout()
+        else:
+            self.send_not_found()
+
+
+class FixtureServer:
+    """ Runs the fixture pages on a background thread. Use url as the testers' base url.
+    sessions maps the sign-in cookies handed out to (username, expiry time); clear it to expire them all """
+    server = None
+    thread = None
+
+    def __init__(self, host="127.0.0.1", port=0, puzzles=None, handler=FixtureHandler):
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.server.puzzles = puzzles if puzzles is not None else PUZZLES
+        self.server.sessions = dict()
+
+    @property
+    def sessions(self):
+        return self.server.sessions
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[0:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    fixture = FixtureServer(port=port)
+    print("Serving lichess fixture on", fixture.url)
+    fixture.server.serve_forever()
@@ -0,0 +1,84 @@
+# Lichess.org Testing with Selenium
+# Cached board layout with a precomputed square -> pixel offset table
+
+# Reads the board size, coordinate counts and viewport position in one execute_script call.
+# arguments: container, files and ranks css selectors
+GEOMETRY_SCRIPT = """
+var container = document.querySelector(arguments[0]);
+var files = document.querySelector(arguments[1]);
+var ranks = document.querySelector(arguments[2]);
+if (!container || !files || !ranks) return null;
+var rect = container.getBoundingClientRect();
+return [container.clientWidth, container.clientHeight, files.childElementCount, ranks.childElementCount,
+        Math.round(rect.left), Math.round(rect.top)];
+"""
+
+
+class BoardGeometry:
+    """ Pixel layout of a board. Offsets are measured from the top-left corner of the cg-board,
+    the way make_move has always computed them, and are precomputed for both orientations.
+    W3C pointer moves relative to an element start from its centre, pointer_offset converts to that """
+    width = None
+    height = None
+    num_files = None
+    num_ranks = None
+    offsets = None
+    left = None
+    top = None
+
+    def __init__(self, width, height, num_files, num_ranks, left=0, top=0):
+        self.width = width
+        self.height = height
+        self.num_files = num_files
+        self.num_ranks = num_ranks
+        self.left = left
+        self.top = top
+        self.offsets = {
+            "orientation-white": dict(),
+            "orientation-black": dict()
+        }
+        self.build_offset_table()
+
+    @classmethod
+    def read(cls, driver, css):
+        """ Measure the board described by a board css dictionary. Returns None if it is not on the page """
+        result = driver.execute_script(GEOMETRY_SCRIPT, css.get("container"), css.get("files"), css.get("ranks"))
+        if result is None or 0 in result[:4]:
+            return None
+        return cls(*result)
+
+    def get_file_pixel_size(self):
+        """ Return the width of an individual file as an integer using floor division """
+        return self.width//self.num_files
+
+    def get_rank_pixel_size(self):
+        """ Return the height of an individual rank as an integer using floor division """
+        return self.height//self.num_ranks
+
+    def build_offset_table(self):
+        """ Fill the square -> (x, y) lookup table for both orientations """
+        file_pixel_size = self.get_file_pixel_size()
+        rank_pixel_size = self.get_rank_pixel_size()
+        for file_index in range(self.num_files):
+            for rank_index in range(self.num_ranks):
+                position = (chr(ord('a') + file_index), rank_index + 1)
+                self.offsets["orientation-white"][position] = (
+                    file_pixel_size//2 + file_index*file_pixel_size,
+                    rank_pixel_size//2 + (self.num_ranks - rank_index - 1)*rank_pixel_size)
+                self.offsets["orientation-black"][position] = (
+                    file_pixel_size//2 + (self.num_files - file_index - 1)*file_pixel_size,
+                    rank_pixel_size//2 + rank_index*rank_pixel_size)
+
+    def offset(self, orientation, position):
+        """ Return the (x, y) pixel offset of the centre of a [file, rank] square for an orientation """
+        return self.offsets[orientation][(position[0], position[1])]
+
+    def pointer_offset(self, orientation, position):
+        """ Return the (x, y) offset of the centre of a [file, rank] square from the centre of the board,
+        the origin of a W3C pointer move to the board element """
+        x, y = self.offset(orientation, position)
+        return x - self.width//2, y - self.height//2
+
+    def viewport_centre(self):
+        """ Return the viewport position of the board's centre when it was measured """
+        return self.left + self.width//2, self.top + self.height//2
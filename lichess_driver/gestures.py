@@ -0,0 +1,107 @@
+# Lichess.org Testing with Selenium
+# Input gestures as fresh W3C action sequences, a whole board move per payload, or raw CDP mouse events
+
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.common.actions.action_builder import ActionBuilder
+from tracing import Latencies
+import time
+
+
+POINTER_MOVE_MS = 0     # ActionChains animates every pointer move for 250ms unless told otherwise
+LATENCY_WINDOW = 50     # moves averaged at the start and at the end of a session by get_latency_stats
+
+# "actions": one action sequence per click, like the testers always did
+# "batched": press and release on both squares in a single W3C actions payload
+# "cdp":     Input.dispatchMouseEvent at viewport coordinates, bypassing chromedriver's action state
+INPUT_MODES = ("actions", "batched", "cdp")
+
+
+class Gestures:
+    """ Builds every gesture on a new action builder, so nothing queued by an earlier (or failed) gesture
+    is ever sent again. Board moves go through move_squares, which uses the configured input mode and
+    records how long each move took """
+    driver = None
+    mode = None
+    latencies = None
+
+    def __init__(self, driver, mode="batched"):
+        if mode not in INPUT_MODES:
+            raise ValueError("Unknown input mode {!r}, expected one of {}".format(mode, INPUT_MODES))
+        self.driver = driver
+        self.mode = mode
+        self.latencies = Latencies(LATENCY_WINDOW)
+
+    def chain(self):
+        """ Return an empty ActionChains for one gesture """
+        return ActionChains(self.driver, duration=POINTER_MOVE_MS)
+
+    def hover(self, element):
+        self.chain().move_to_element(element).perform()
+
+    def hover_offset(self, element, x, y):
+        """ Hover at (x, y) pixels from the centre of an element """
+        self.chain().move_to_element_with_offset(element, x, y).perform()
+
+    def click(self, element):
+        self.chain().move_to_element(element).click().perform()
+
+    def click_offset(self, element, x, y):
+        """ Click at (x, y) pixels from the centre of an element """
+        self.chain().move_to_element_with_offset(element, x, y).click().perform()
+
+    def send_keys(self, *keys):
+        """ Type into whatever has the focus """
+        self.chain().send_keys(*keys).perform()
+
+    def click_and_type(self, element, *keys):
+        """ Click an element and type into it in one action sequence """
+        self.chain().move_to_element(element).click().send_keys(*keys).perform()
+
+    def move_squares(self, board_element, start_offset, end_offset, board_centre=None):
+        """ Click the origin square, then the destination square of a move.
+        Offsets are measured from the centre of board_element. The cdp mode needs board_centre, the viewport
+        position of that centre, and falls back to a batched payload without it """
+        start = time.perf_counter()
+        if self.mode == "actions":
+            self.click_offset(board_element, *start_offset)
+            self.click_offset(board_element, *end_offset)
+        elif self.mode == "cdp" and board_centre is not None:
+            self.dispatch_click(board_centre[0] + start_offset[0], board_centre[1] + start_offset[1])
+            self.dispatch_click(board_centre[0] + end_offset[0], board_centre[1] + end_offset[1])
+        else:
+            builder = ActionBuilder(self.driver, duration=POINTER_MOVE_MS)
+            builder.pointer_action.move_to(board_element, *start_offset).click()
+            builder.pointer_action.move_to(board_element, *end_offset).click()
+            builder.perform()
+        self.latencies.add(time.perf_counter() - start)
+
+    def drag_squares(self, board_element, start_offset, end_offset):
+        """ Drag a piece from the origin square to the destination square in one W3C actions payload """
+        start = time.perf_counter()
+        builder = ActionBuilder(self.driver, duration=POINTER_MOVE_MS)
+        builder.pointer_action.move_to(board_element, *start_offset).pointer_down()
+        builder.pointer_action.move_to(board_element, *end_offset).pointer_up()
+        builder.perform()
+        self.latencies.add(time.perf_counter() - start)
+
+    def dispatch_click(self, x, y):
+        """ Press and release the left button at viewport coordinates through the DevTools protocol """
+        for event in ("mousePressed", "mouseReleased"):
+            self.driver.execute_cdp_cmd("Input.dispatchMouseEvent", {
+                "type": event, "x": x, "y": y, "button": "left", "buttons": 1 if event == "mousePressed" else 0,
+                "clickCount": 1
+            })
+
+    def get_latency_stats(self):
+        """ Return the number of board moves and their input latency in seconds: mean, worst, median and 95th
+        percentile of the recent moves, and the mean of the first and of the last LATENCY_WINDOW moves, which
+        should stay level over a long session """
+        return {
+            "moves": self.latencies.count,
+            "mean": self.latencies.mean(),
+            "max": self.latencies.max,
+            "p50": self.latencies.percentile(0.5),
+            "p95": self.latencies.percentile(0.95),
+            "first": self.latencies.first_mean(),
+            "last": self.latencies.last_mean()
+        }
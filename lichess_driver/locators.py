@@ -0,0 +1,75 @@
+# Lichess.org Testing with Selenium
+# Caches resolved elements of the xpath/css locator maps for the lifetime of a page
+
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException
+
+
+class LocatorCache:
+    """ Resolves (By, selector) locators once per page generation.
+
+    A cached element is used without re-checking it. If the page replaced it, the first command on it
+    fails with StaleElementReferenceException; use() then starts a new generation and resolves again,
+    so staleness costs nothing until it actually happens.
+
+    on_missing(by, selector), when set, is asked for an element the page does not have yet instead of
+    failing at once, e.g. to wait for it on a page that is handed over before it finished loading """
+    driver = None
+    elements = None
+    on_missing = None
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.elements = dict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, by, selector):
+        """ Return the element for a locator, resolving it only when it is not cached """
+        key = (by, selector)
+        element = self.elements.get(key)
+        if element is not None:
+            self.hits += 1
+            return element
+        self.misses += 1
+        try:
+            element = self.driver.find_element(by, selector)
+        except NoSuchElementException:
+            if self.on_missing is None:
+                raise
+            element = self.on_missing(by, selector)
+        self.elements[key] = element
+        return element
+
+    def remember(self, by, selector, element):
+        """ Cache an element that was found some other way, e.g. by find_elements """
+        self.elements[(by, selector)] = element
+
+    def new_page(self):
+        """ Forget every element: the page navigated or its DOM was replaced """
+        self.generation += 1
+        self.elements.clear()
+
+    def use(self, by, selector, action, on_stale=None):
+        """ Run action(element) on the cached element, re-resolving and retrying once if it went stale.
+        on_stale is called before the retry, e.g. to drop half-built action chains """
+        try:
+            return action(self.get(by, selector))
+        except StaleElementReferenceException:
+            self.stale += 1
+            self.new_page()
+            if on_stale is not None:
+                on_stale()
+            return action(self.get(by, selector))
+
+    def get_stats(self):
+        """ Return hit/miss counts, stale re-resolutions and the hit rate """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "generation": self.generation,
+            "hit_rate": self.hits/lookups if lookups else 0.0
+        }
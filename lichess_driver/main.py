@@ -7,12 +7,29 @@ from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.keys import Keys  # Gives access to input keys to interface with the website
 from selenium.webdriver.common.by import By  # Allows us to identify the xpath of element
-from selenium.webdriver.common.action_chains import \
-    ActionChains  # Allows us to perform generic actions on modules such as hovering, clicking, etc.
-from selenium.webdriver.support.ui import WebDriverWait # Allows us to stall the driver to wait for a particular element to load
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException
 import time  # Allows us to sleep for a certain number of seconds
+import waits  # Condition-driven waits that replace fixed sleeps
+from snapshot import BoardSnapshot, key_to_position  # Single round-trip copies of the cg-board
+from board_model import BoardModel  # The position kept in process: SAN and squares without asking the page
+from geometry import BoardGeometry  # Cached square -> pixel offsets for make_move
+from engines import BrowserEngine, UciEngine, CachedEngine  # Engine backends consumed by play()
+from position_cache import PositionCache  # Best moves of positions seen in earlier puzzles and runs
+from driver_pool import DriverPool, chrome_options  # Warm, reusable Chrome sessions
+from move_history import MoveHistory  # One-shot and incremental reads of a moves table
+from locators import LocatorCache  # Elements resolved once per page instead of once per action
+from gestures import Gestures  # Hovering, clicking and typing with a fresh action sequence per gesture
+from tracing import CommandTracer  # Per-command and per-caller WebDriver latency histograms
+from results import PuzzleRecord, ResultWriter, summarize, print_summary, RESULTS_PATH  # Per-puzzle result log
+from orchestrator import Orchestrator  # Puzzle and engine sessions as concurrent asyncio tasks
+from readiness import ReadinessPolicy, wait_until_ready  # When the analysis engine's line is good enough
+from replay import BundleRecorder, ReplayServer  # Offline, repeatable runs from recorded puzzles and pages
+from page_load import PageLoadReport, SCENARIO_PROFILES, read_page_stats  # Load strategy and blocking of heavy resources
+from auth_sessions import SessionStore  # Signed-in sessions reused across browsers instead of the sign-in form
+from soak import SoakMonitor  # Memory sampled along long runs, bloated sessions recycled
+from recovery import Supervisor  # Failed puzzles retried after the cheapest fix, up to replacing a dead browser
+from board_events import BoardEventStream, LONG_POLL_MS  # Moves pushed from the page by a MutationObserver instead of polled
+from shared_browser import SharedBrowser, WindowDriver, SHARED_BROWSER_ARGUMENTS, LONG_POLL_MS as SHARED_LONG_POLL_MS  # Testers as windows of one Chrome
 
 
 
@@ -20,93 +37,200 @@ CHROMEDRIVER_PATH = "E:\\chromedriver\\chromedriver.exe"
 #CHROMEDRIVER_PATH = "D:\\Software Expert\\chromedriver.exe"
 SERVICE = Service(CHROMEDRIVER_PATH)
 MAX_WAIT_FOR_SECONDS = 10
+ENGINE_BACKEND = "browser"  # "browser" for the lichess.org analysis board, "uci" for a local engine (engines.UCI_ENGINE_PATH)
+INPUT_MODE = "batched"  # how board moves are sent, see gestures.INPUT_MODES
+TRACE_SUMMARY_PATH = "trace_summary.json"  # per-command and per-caller latency histograms of a run
+TRACE_EVENTS_PATH = "trace.json"  # the same run in Chrome trace-event format (chrome://tracing, ui.perfetto.dev)
+CONCURRENT = True  # solve with orchestrator.Orchestrator, engine speculating on the replies, instead of play()
+RECORD_BUNDLE_PATH = None  # e.g. "puzzles.replay.jsonl.gz": record every solved puzzle into this replay bundle
+REPLAY_BUNDLE_PATH = None  # e.g. "puzzles.replay.jsonl.gz": solve the recorded puzzles offline instead of lichess.org
+PAGE_LOAD_PROFILE = None  # e.g. "puzzles": load pages with page_load.SCENARIO_PROFILES["puzzles"], eager and without heavy resources
+SOAK = False  # follow the run's memory in soak.SOAK_TIMELINE_PATH and recycle bloated browsers, for runs of SOAK_PUZZLES
+SOAK_PUZZLES = 10000
+BOARD_EVENTS = True  # wait for moves with board_events.BoardEventStream, pushed by the page, instead of polling the board
+SHARED_BROWSER = None  # "window" or "context": puzzle and engine testers as two windows of one Chrome, see shared_browser.SharedBrowser
 
 class WebTester:
     driver = None
-    action = None
+    gestures = None
     window_size = None
-
-    def __init__(self):
-        """ Initiate Selenium webdriver for Chrome """
-        self.options = webdriver.ChromeOptions()
-        self.options.add_experimental_option('excludeSwitches', ['enable-logging'])
-        self.driver = webdriver.Chrome(service=SERVICE, options=self.options)
-        self.chrome_window_maximize()
+    waiter = None
+    locators = None
+    board = None
+    owns_driver = True
+    page_load = None
+    page_load_report = None
+
+    def __init__(self, driver=None, headless=False, page_load=None):
+        """ Initiate Selenium webdriver for Chrome, or adopt a session leased from a driver_pool.DriverPool.
+        page_load is a page_load.PageLoadProfile; an adopted session keeps the load strategy it was launched
+        with, so a pool serving lazy profiles is built with DriverPool(page_load_strategy=...) """
+        if driver is None:
+            self.options = chrome_options(headless=headless,
+                                          page_load_strategy=page_load.strategy if page_load is not None else None)
+            self.driver = webdriver.Chrome(service=SERVICE, options=self.options)
+            if not headless:
+                self.chrome_window_maximize()
+        else:
+            # the pool owns the session, it sizes the window and resets it when the lease ends
+            self.driver = driver
+            self.owns_driver = False
         self.window_size = self.driver.get_window_size()
-        self.action = ActionChains(self.driver)
-
+        self.gestures = Gestures(self.driver, INPUT_MODE)
+        self.waiter = waits.Waiter(self.driver, MAX_WAIT_FOR_SECONDS)
+        self.locators = LocatorCache(self.driver)
+        if page_load is not None:
+            self.set_page_load_profile(page_load)
 
     def __del__(self):
-        """ Close the driver """
-        self.driver.close()
+        """ Close the driver unless it belongs to a DriverPool """
+        if self.owns_driver and self.driver is not None:
+            self.driver.close()
 
     def chrome_window_maximize(self):
         """ Maximize the chrome window """
         self.driver.maximize_window()
+        self.invalidate_geometry()
+
+    def set_window_size(self, width, height):
+        """ Resize the chrome window. The board's cached geometry no longer applies """
+        self.driver.set_window_size(width, height)
+        self.invalidate_geometry()
+
+    def set_window_position(self, x, y):
+        """ Move the chrome window """
+        self.driver.set_window_position(x, y)
+
+    def invalidate_geometry(self):
+        """ Drop the board's cached layout after a resize or a navigation """
+        if self.board is not None:
+            self.board.invalidate_geometry()
+
+    def on_navigation(self):
+        """ Forget everything cached about the previous page """
+        self.locators.new_page()
+        self.invalidate_geometry()
+        if self.board is not None and self.board.events is not None:
+            self.board.events.reset()
+
+    def set_page_load_profile(self, profile, report=False):
+        """ Block the profile's heavy resources from now on. With a lazy strategy pages are handed over
+        early, so an element a page does not have yet is waited for instead of missing. With report, every
+        navigate() adds what the page fetched to page_load_report """
+        profile.install(self.driver)
+        self.page_load = profile
+        self.locators.on_missing = self.wait_for_element if profile.is_lazy() else None
+        if report:
+            self.page_load_report = PageLoadReport(profile.name)
+
+    def wait_for_element(self, by, selector):
+        """ Return the element of a locator once the page has it """
+        return self.wait_until(waits.element_located(by, selector), step="page_ready")
+
+    def navigate(self, url):
+        """ Load a url and forget the previous page """
+        self.driver.get(url)
+        self.on_navigation()
+        if self.page_load_report is not None:
+            self.page_load_report.add(read_page_stats(self.driver))
+
+    def find(self, xpath):
+        """ Return the element of an xpath, from the locator cache when this page already resolved it """
+        return self.locators.get(By.XPATH, xpath)
+
+    def use(self, xpath, gesture):
+        """ Run gesture(element) on the cached element of an xpath, resolving it again if it went stale """
+        return self.locators.use(By.XPATH, xpath, gesture)
+
+    def use_css(self, css, gesture):
+        """ Run gesture(element) on the cached element of a css selector, resolving it again if it went stale """
+        return self.locators.use(By.CSS_SELECTOR, css, gesture)
+
+    def get_locator_stats(self):
+        """ Return hit/miss statistics of the locator cache """
+        return self.locators.get_stats()
+
+    def enable_tracing(self, tracer=None, name=None):
+        """ Record every WebDriver command of this tester, its board included, in a tracing.CommandTracer.
+        Several testers can share one tracer, name labels this one's commands """
+        if tracer is None:
+            tracer = CommandTracer()
+        tracer.attach(self.driver, name if name is not None else type(self).__name__)
+        return tracer
+
+    def hover_element(self, element):
+        """ Hover over an element based on a given element """
+        self.gestures.hover(element)
 
     def hover(self, xpath):
         """ Hover over an element based on a given xpath """
-        element = self.driver.find_element(By.XPATH, xpath)
-        self.action.move_to_element(element)
-        self.action.perform()
+        self.use(xpath, self.hover_element)
 
     def hover_offset(self, xpath, x, y):
-        """ Hover over an element based on a given xpath """
-        element = self.driver.find_element(By.XPATH, xpath)
-        self.action.move_to_element_with_offset(element, x, y)
-        self.action.perform()
+        """ Hover over an element based on a given xpath and an offset from its centre """
+        self.use(xpath, lambda element: self.gestures.hover_offset(element, x, y))
 
     def click_element(self, element):
         """ Click on an element based on a given element """
-        self.action.move_to_element(element)
-        self.action.click()
-        self.action.perform()
+        self.gestures.click(element)
 
     def click_element_offset(self, element, x, y):
-        """ Click on an element based on a given element and offset """
-        self.action.move_to_element_with_offset(element, x, y)
-        self.action.click()
-        self.action.perform()
+        """ Click on an element based on a given element and offset from its centre """
+        self.gestures.click_offset(element, x, y)
 
     def click(self, xpath):
         """ Click on an element based on a given xpath """
-        element = self.driver.find_element(By.XPATH, xpath)
-        self.click_element(element)
+        self.use(xpath, self.click_element)
 
     def click_offset(self, xpath, x, y):
-        """ Click on an element based on a given xpath and offset """
-        element = self.driver.find_element(By.XPATH, xpath)
-        self.click_element_offset(element, x, y)
+        """ Click on an element based on a given xpath and offset from its centre """
+        self.use(xpath, lambda element: self.click_element_offset(element, x, y))
 
     def press_key(self, key):
         """ Press a key """
-        self.action.send_keys(key)
-        self.action.perform()
+        self.gestures.send_keys(key)
 
     def check_exists_by_xpath(self, xpath):
         """ If the xpath exists, return True. Otherwise, return false """
-        try:
-            self.driver.find_element(By.XPATH, xpath)
-        except NoSuchElementException:
+        elements = self.driver.find_elements(By.XPATH, xpath)
+        if len(elements) == 0:
             return False
+        self.locators.remember(By.XPATH, xpath, elements[0])
         return True
 
     def wait_for(self, xpath):
-        """ Waits for an element, given by its xpath, to appear on the page before proceeding """
-        try:
-            element = WebDriverWait(self.driver, MAX_WAIT_FOR_SECONDS).until(
-                EC.presence_of_element_located((By.XPATH, xpath))
-            )
-        except Exception as error:
-            print('Error: {}'.format(error))
-            self.driver.quit()
+        """ Waits for an element, given by its xpath, to appear on the page before proceeding.
+        Raises TimeoutException otherwise, which recovery.Supervisor fixes by reloading the page """
+        return self.wait_until(waits.element_present(xpath))
+
+    def wait_until(self, condition, step=None, timeout=None):
+        """ Poll a waits.Condition until it holds and return its value.
+        The timeout defaults to the step's budget in waits.STEP_TIMEOUTS """
+        return self.waiter.until(condition, step, timeout)
+
+    def wait_for_event(self, test, step):
+        """ Like wait_until, with test(state) checked on the board's events as the page pushes them """
+        events = self.board.events
+        events.cancel = self.waiter.cancel
+        start = time.perf_counter()
+        value = events.wait_until(test, self.waiter.step_timeouts.get(step, self.waiter.default_timeout), step)
+        self.waiter.record_latency(step, time.perf_counter() - start)
+        return value
 
 
 class LichessBoard:
     css = None
     driver = None
     state = None
-    action = None
+    snapshot = None
+    geometry = None
+    cg_board = None
+    orientation = None
+    gestures = None
+    model = None
+    events = None
+    retries = 0
+    mismatches = 0
 
     piece_abbreviation = {
         'pawn': '',
@@ -117,12 +241,13 @@ class LichessBoard:
         'king': 'K'
     }
 
-    def __init__(self, driver, action, css):
+    def __init__(self, driver, gestures, css):
         super().__init__()
         self.driver = driver
-        self.action = action
+        self.gestures = gestures
         self.css = css
         self.state = dict()
+        self.snapshot = BoardSnapshot.empty()
 
     def get_board_orientation(self):
         board_properties = self.driver.find_element(By.CSS_SELECTOR, self.css.get("orientation")).get_property("classList")
@@ -136,6 +261,47 @@ class LichessBoard:
     def get_cg_board(self):
         return self.driver.find_element(By.CSS_SELECTOR, self.css.get("state"))
 
+    def get_geometry(self):
+        """ Return the cached BoardGeometry, measuring the board in one round-trip the first time """
+        if self.geometry is None:
+            self.geometry = BoardGeometry.read(self.driver, self.css)
+        return self.geometry
+
+    def get_cached_cg_board(self):
+        """ Return the cg-board element, looking it up again only after invalidate_geometry """
+        if self.cg_board is None:
+            self.cg_board = self.get_cg_board()
+        return self.cg_board
+
+    def invalidate_geometry(self):
+        """ Forget the cached layout, orientation and cg-board element (window resize or navigation) """
+        self.geometry = None
+        self.cg_board = None
+        self.orientation = None
+
+    def subscribe(self, moves_xpath=None, pv_css=None, complete_css=None):
+        """ Follow the board, and the moves table, engine line or puzzle-complete banner of its page, with a
+        board_events.BoardEventStream instead of polling. The tester's waits then use it. In a shared browser
+        the drains are short, a drain waiting in one window holds up the others """
+        long_poll_ms = SHARED_LONG_POLL_MS if isinstance(self.driver, WindowDriver) else LONG_POLL_MS
+        self.events = BoardEventStream(self.driver, self.css.get("state"), moves_xpath, pv_css, complete_css,
+                                       long_poll_ms)
+        return self.events
+
+    def get_board_signature(self):
+        """ Return a value that changes whenever a piece or highlight on the board changes. With events it is
+        their count, brought up to date in one call """
+        if self.events is not None:
+            self.events.sync()
+            return self.events.changes
+        return waits.board_signature(self.driver, self.css.get("state"))
+
+    def get_last_move_squares(self):
+        """ Return the cgKeys of the last-move highlight squares in one call """
+        if self.events is not None:
+            return self.events.sync().get("last_move")
+        return waits.last_move_squares(self.driver, self.css.get("state"))
+
     def get_board_pixel_size(self):
         """ Return the width x height of the board in pixels """
         board_size_element = self.driver.find_element(By.CSS_SELECTOR, self.css.get("container"))
@@ -165,39 +331,75 @@ class LichessBoard:
         return [board_pixel_size[0]/self.get_num_files(), board_pixel_size[1]/self.get_num_ranks()]
 
     def get_last_move(self):
-        # Note: A better way would be to use linked-list property of web elements to get the corresponding nodes
+        """ Return [piece, source, destination] of the highlighted last move, read from the latest snapshot.
+        piece is the FEN letter of the piece that moved, e.g. 'N' or 'p' """
         piece = ""
         last_move0 = ""
         last_move1 = ""
-        print(self.state)
-        for key, val in self.state.items():
-            if (str(key) == "last-move0"):
-                piece = ""  # str(self.state[val.get_property("cgKey")].get_property("cgPiece"))
-                last_move0 = (val.get_property("cgKey")[0], int(val.get_property("cgKey")[1:]))
-            elif (str(key) == "last-move1"):
-                last_move1 = (val.get_property("cgKey")[0], int(val.get_property("cgKey")[1:]))
+        keys = self.snapshot.last_move
+        if len(keys) > 1 and self.snapshot.piece_at(keys[0]) is None and self.snapshot.piece_at(keys[1]) is not None:
+            # the moved piece stands on the destination, whatever order the highlights come in
+            keys = keys[::-1]
+        if len(keys) > 0:
+            last_move0 = key_to_position(keys[0])
+            piece = self.snapshot.piece_at(keys[0]) or ""
+        if len(keys) > 1:
+            last_move1 = key_to_position(keys[1])
 
         return [piece, last_move1, last_move0]
 
+    def sync_model(self, pgn):
+        """ Rebuild the board model from a game's pgn. Returns it, or None when the pgn cannot be played """
+        try:
+            self.model = BoardModel.from_pgn(pgn)
+        except ValueError:
+            self.model = None
+        return self.model
+
+    def update_model(self, moves):
+        """ Play moves in the get_last_move() layout on the board model and return them with their piece filled
+        in. A move the model cannot play drops the model, get_model() is None until the next sync_model """
+        if self.model is None:
+            return moves
+        played = []
+        try:
+            for move in moves:
+                played.append(self.model.apply_move(move))
+        except ValueError:
+            self.mismatches += 1
+            self.model = None
+            return moves
+        return played
+
+    def check_model(self):
+        """ Compare the board model with the latest snapshot. On a mismatch the model is dropped and counted in
+        mismatches, and the squares that differ are returned """
+        if self.model is None:
+            return []
+        squares = self.model.mismatches(self.snapshot)
+        if squares:
+            self.mismatches += 1
+            self.model = None
+        return squares
+
+    def get_model(self):
+        """ Return the BoardModel following this board, or None while it is not in sync """
+        return self.model
+
     def get_board_state(self):
         """ Return the state of the board (dictionary) """
         return self.state
 
+    def get_snapshot(self):
+        """ Return the BoardSnapshot taken by the latest update_board_state """
+        return self.snapshot
+
     def update_board_state(self):
-        """ The board state is a dictionary mapping position to web element (square/piece)"""
-        print(id(self.state))
-        self.state.clear()
-        cg_board = self.get_cg_board()
-        cg_board_properties = cg_board.get_property("childNodes")
-        last_move = ""
-        last_move_found = 0
-        for cell in cg_board_properties:
-            # if (cell.get_property("className") == "last-move"):
-            if (cell.get_attribute("class") == "last-move"):
-                self.state["last-move" + str(last_move_found)] = cell
-                last_move_found += 1
-            elif (cell.get_property("localName") == "piece"):
-                self.state[str(cell.get_property("cgKey"))] = cell
+        """ Read the whole cg-board in a single round-trip. The board state is a dictionary mapping
+        position to piece letter plus the 'last-move0'/'last-move1' highlight squares """
+        snapshot = BoardSnapshot.read(self.driver, self.css.get("state"), self.css.get("orientation"))
+        self.snapshot = snapshot if snapshot is not None else BoardSnapshot.empty()
+        self.state = self.snapshot.to_state()
 
     def print_board_state(self):
         for key, value in self.state.items():
@@ -209,45 +411,39 @@ class LichessBoard:
         :param start_move, end_move: [file, rank]
         :return: None
         """
-        orientation = self.get_board_orientation()
-        board_element = self.get_cg_board()
-
-        file_pixel_size = self.get_file_pixel_size()
-        rank_pixel_size = self.get_rank_pixel_size()
-
-        num_files = self.get_num_files()
-        num_ranks = self.get_num_ranks()
-
-        start_file_index = ord(start_move[0]) - ord('a')
-        start_rank_index = start_move[1] - 1
-        end_file_index = ord(end_move[0]) - ord('a')
-        end_rank_index = end_move[1] - 1
-
-        if orientation == "orientation-white":
-            start_file_pixel_offset = file_pixel_size//2 + start_file_index*file_pixel_size
-            start_rank_pixel_offset = rank_pixel_size//2 + (num_ranks - start_rank_index - 1)*rank_pixel_size
-            self.action.move_to_element_with_offset(board_element, start_file_pixel_offset, start_rank_pixel_offset)
-            self.action.click()
-            self.action.perform()
-
-            end_file_pixel_offset = file_pixel_size//2 + end_file_index*file_pixel_size
-            end_rank_pixel_offset = rank_pixel_size//2 + (num_ranks - end_rank_index - 1)*rank_pixel_size
-            self.action.move_to_element_with_offset(board_element, end_file_pixel_offset, end_rank_pixel_offset)
-            self.action.click()
-            self.action.perform()
-            pass
-        elif orientation == "orientation-black":
-            start_file_pixel_offset = file_pixel_size//2 + (num_files - start_file_index - 1)*file_pixel_size
-            start_rank_pixel_offset = rank_pixel_size//2 + start_rank_index*rank_pixel_size
-            self.action.move_to_element_with_offset(board_element, start_file_pixel_offset, start_rank_pixel_offset)
-            self.action.click()
-            self.action.perform()
+        # The latest snapshot knows the orientation, only ask the page when no board has been read yet. A board
+        # followed by its model alone is read once per page
+        orientation = self.snapshot.orientation
+        if orientation not in ("orientation-white", "orientation-black"):
+            if self.orientation is None:
+                self.orientation = self.get_board_orientation()
+            orientation = self.orientation
+            if orientation == "fail":
+                self.orientation = None
+                raise NoSuchElementException("cg-board has no orientation")
 
-            end_file_pixel_offset = file_pixel_size//2 + (num_files - end_file_index - 1)*file_pixel_size
-            end_rank_pixel_offset = rank_pixel_size//2 + end_rank_index*rank_pixel_size
-            self.action.move_to_element_with_offset(board_element, end_file_pixel_offset, end_rank_pixel_offset)
-            self.action.click()
-            self.action.perform()
+        try:
+            self.click_squares(self.get_cached_cg_board(), self.get_measured_geometry(), orientation, start_move,
+                               end_move)
+        except StaleElementReferenceException:
+            # The board was re-rendered (new puzzle, page change): measure it again and retry once
+            self.retries += 1
+            self.invalidate_geometry()
+            self.click_squares(self.get_cached_cg_board(), self.get_measured_geometry(), orientation, start_move,
+                               end_move)
+
+    def get_measured_geometry(self):
+        """ Like get_geometry, raising NoSuchElementException when the board is not on the page to be measured """
+        geometry = self.get_geometry()
+        if geometry is None:
+            raise NoSuchElementException("cg-board not measurable")
+        return geometry
+
+    def click_squares(self, board_element, geometry, orientation, start_move, end_move):
+        """ Click the origin square, then the destination square. Pointer offsets are taken from the
+        centre of the board element, as W3C actions define them """
+        self.gestures.move_squares(board_element, geometry.pointer_offset(orientation, start_move),
+                                   geometry.pointer_offset(orientation, end_move), geometry.viewport_centre())
 
 
 class LichessTester(WebTester):
@@ -301,16 +497,24 @@ class LichessTester(WebTester):
         "continue" : "a[class=\"continue\"]"
     }
 
-    board = None
+    move_history = None
 
-    def __init__(self):
+    def __init__(self, driver=None, headless=False, page_load=None):
         """ Initiate LichessTester and setup the board """
-        super().__init__()
-        self.board = LichessBoard(self.driver, self.action, self.puzzles_board_css)
+        super().__init__(driver, headless, page_load)
+        self.board = LichessBoard(self.driver, self.gestures, self.puzzles_board_css)
+        self.move_history = MoveHistory(self.xpath.get("puzzles_moves_table"))
+        if BOARD_EVENTS:
+            self.board.subscribe(moves_xpath=self.xpath.get("puzzles_moves_table"),
+                                 complete_css=self.puzzles_board_css["complete"])
 
     def open_website(self):
         """ Open a website given a URL """
-        self.driver.get(self.url)
+        self.navigate(self.url)
+
+    def open_puzzle(self, puzzle_id):
+        """ Open a puzzle directly by its id """
+        self.navigate(self.url + "/training/" + puzzle_id)
 
     def hover_puzzles(self):
         """ Hover over the Puzzles tab on the top bar menu """
@@ -323,26 +527,31 @@ class LichessTester(WebTester):
     def click_puzzles(self):
         """ Click on the Puzzles tab on the top bar menu """
         self.click(self.xpath.get("puzzles"))
+        self.on_navigation()
 
     def click_puzzles_dashboard(self):
         """ Click on the Puzzles Dashboard button under the Puzzles tab """
         self.hover_puzzles()
-        self.click(self.xpath.get("streak"))
+        self.click(self.xpath.get("dashboard"))
+        self.on_navigation()
 
     def click_puzzles_streak(self):
         """ Click on the Puzzles Streak button under the Puzzles tab """
         self.hover_puzzles()
         self.click(self.xpath.get("streak"))
+        self.on_navigation()
 
     def click_puzzles_storm(self):
         """ Click on the Puzzles Storm button under the Puzzles tab """
         self.hover_puzzles()
         self.click(self.xpath.get("storm"))
+        self.on_navigation()
 
     def click_puzzles_racer(self):
         """ Click on the Puzzles Racer button under the Puzzles tab """
         self.hover_puzzles()
         self.click(self.xpath.get("racer"))
+        self.on_navigation()
 
     def click_spotlight(self, index):
         """ Click on the Highlighted Tournaments on the left of the webpage """
@@ -350,17 +559,16 @@ class LichessTester(WebTester):
         if index not in tournaments:
             return "ERROR: Invalid Highlighted tournament ID input"
         else:
-            self.hover(self.xpath.get("spotlight" + str(index)))
             self.click(self.xpath.get("spotlight" + str(index)))
-            time.sleep(2)   # delay so we can see the tournament page
+            self.on_navigation()
+            self.wait_until(waits.url_contains("/tournament/"), step="page_ready")
             self.click_spotlight_info()
 
     def click_spotlight_info(self):
         """ Click on the Highlighted Tournament's description """
         if (self.check_exists_by_xpath(self.xpath.get("spotlight_info"))):
-            self.hover(self.xpath.get("spotlight_info"))
             self.click(self.xpath.get("spotlight_info"))
-            time.sleep(3)   # delay so we can see the tournament description
+            self.wait_until(waits.window_count(2), step="page_ready")
             self.driver.switch_to.window(self.driver.window_handles[1])
             self.driver.close()
             self.driver.switch_to.window(self.driver.window_handles[0])
@@ -371,16 +579,17 @@ class LichessTester(WebTester):
         """ Click on the Video library button under the Watch tab """
         self.hover_watch()
         self.click(self.xpath.get("video_library"))
+        self.on_navigation()
 
     def click_beginner(self):
         """ Hover and click on the Beginner button """
-        self.hover(self.xpath.get("beginner"))
         self.click(self.xpath.get("beginner"))
+        self.on_navigation()
 
     def click_beginner_video(self, vid):
         """ Hover and click on the video """
-        self.hover(self.xpath.get("beginner_video" + str(vid)))
         self.click(self.xpath.get("beginner_video" + str(vid)))
+        self.on_navigation()
 
     def click_video_player(self):
         """ Click the video player to play video"""
@@ -388,37 +597,46 @@ class LichessTester(WebTester):
 
     def click_signin_button(self):
         """ Hover and click on the Sign in button """
-        self.hover(self.xpath.get("signin"))
         self.click(self.xpath.get("signin"))
+        self.on_navigation()
 
     def click_signout(self):
         """ Signout from lichess account """
-        self.hover(self.xpath.get("signedin"))
         self.click(self.xpath.get("signedin"))
-        time.sleep(0.75) # delay so we can see cascaded menu
-        self.hover(self.xpath.get("signout"))
+        self.wait_for(self.xpath.get("signout"))    # the cascaded menu is built when it first opens
         self.click(self.xpath.get("signout"))
+        self.on_navigation()
 
     def fill_signin_form(self, string_input1, string_input2):
         """ Fill out the signin information """
-        id_form = self.driver.find_element(By.XPATH, self.xpath.get("username_email_form"))
-        self.action.move_to_element(id_form)
-        self.action.click()
-        self.action.send_keys(string_input1)
-        self.action.perform()
-        time.sleep(1)   # delay so we can see the input on the id form
-        self.action.send_keys(Keys.TAB)
-        self.action.send_keys(string_input2)
-        self.action.perform()
+        self.use(self.xpath.get("username_email_form"), lambda id_form: self.gestures.click_and_type(id_form, string_input1))
+        self.gestures.send_keys(Keys.TAB, string_input2)
         #signin_button = self.driver.find_element(By.XPATH, self.xpath.get("signin_signin"))
-        #self.action.move_to_element(signin_button)
-        self.action.move_to_element(self.driver.find_element(By.XPATH, self.xpath.get("signin_signin")))
-        self.action.click()
-        self.action.perform()
+        self.click(self.xpath.get("signin_signin"))
+        self.on_navigation()
+
+    def is_signed_in(self):
+        """ Whether the page shows the user tag of a signed-in account: one round-trip """
+        return self.check_exists_by_xpath(self.xpath.get("signedin"))
+
+    def sign_in_with_form(self, username, password):
+        """ Sign in through the sign-in form and wait for the signed-in page """
+        self.open_website()
+        self.click_signin_button()
+        self.wait_until(waits.element_present(self.xpath.get("username_email_form")), step="page_ready")
+        self.fill_signin_form(username, password)
+        self.wait_until(waits.element_present(self.xpath.get("signedin")), step="sign_in")
+
+    def sign_in(self, username, password, store=None):
+        """ Start signed in as username, reusing the session an earlier sign-in stored when it is still
+        valid (see auth_sessions.SessionStore). Returns "restored" or "signed_in" """
+        store = store if store is not None else SessionStore()
+        return store.sign_in(self, username, password)
 
     def click_home(self):
         """ Click home page link """
         self.click(self.xpath.get("home"))
+        self.on_navigation()
 
     def hover_community(self):
         """ Hover over the Community tab on the top bar menu """
@@ -427,51 +645,41 @@ class LichessTester(WebTester):
     def click_forum(self):
         """ Hover and click on the forum button """
         self.hover_community()
-        self.hover(self.xpath.get("forum"))
         self.click(self.xpath.get("forum"))
+        self.on_navigation()
 
     def click_blog(self):
         """ Hover and click on the blog button """
         self.hover_community()
-        self.hover(self.xpath.get("blog"))
         self.click(self.xpath.get("blog"))
+        self.on_navigation()
 
     def click_swag(self):
         """ Click on the swag link """
         self.click(self.xpath.get("swag"))
+        self.on_navigation()
 
     def click_preferences(self):
         """ Click on preferences on the cascaded menu after clicking the user """
-        self.hover(self.xpath.get("signedin"))
         self.click(self.xpath.get("signedin"))
-        self.hover(self.xpath.get("preferences"))
         self.click(self.xpath.get("preferences"))
+        self.on_navigation()
 
     def click_kid_mode(self):
         """ Click Kid mode in preferences """
-        self.hover(self.xpath.get("kid_mode"))
         self.click(self.xpath.get("kid_mode"))
 
     def switch_kid_mode(self, string_input):
         """ Enable or disable kid mode for the account """
-        self.action.move_to_element(self.driver.find_element(By.XPATH, self.xpath.get("kid_mode_pwform")))
-        self.action.click()
-        self.action.send_keys(string_input)
-        self.action.perform()
-        time.sleep(1)
-        self.hover(self.xpath.get("kid_mode_submit"))
+        self.use(self.xpath.get("kid_mode_pwform"), lambda pwform: self.gestures.click_and_type(pwform, string_input))
         self.click(self.xpath.get("kid_mode_submit"))
+        self.on_navigation()
 
     def search(self, string_input):
         """ Search given an input """
-        search_bar = self.driver.find_element(By.XPATH, self.xpath.get("search_bar"))
-        self.action.move_to_element(search_bar)
-        self.action.click()
-        self.action.send_keys(string_input)
-        self.action.perform()
-        time.sleep(1)   # delay so we can see the input on the search bar
-        self.action.send_keys(Keys.RETURN)
-        self.action.perform()
+        self.use(self.xpath.get("search_bar"), lambda search_bar: self.gestures.click_and_type(search_bar, string_input))
+        self.gestures.send_keys(Keys.RETURN)
+        self.on_navigation()
         # self.action.move_to_element(element).click().send_keys(input).send_keys(Keys.RETURN).perform() # one liner
 
     def get_board(self):
@@ -479,25 +687,25 @@ class LichessTester(WebTester):
 
     def get_puzzle_pgn(self):
         """ Returns the pgn of a puzzle in string format """
-        moves_table = self.driver.find_element(By.XPATH, self.xpath.get("puzzles_moves_table"))
-
-        pgn = ""
-        num_elements = moves_table.get_property("childElementCount")
         # [!] ASSUME THERE IS AT LEAST 1 MOVE MADE IN THE PUZZLE POSITION (NEED AN ASSERTION TO CHECK)
+        self.move_history.read(self.driver, incremental=False)
+        return self.move_history.to_pgn()
 
-        for i in range(0, num_elements, 3):
-            pgn += str(((i//3) + 1)) + ". "
-
-            white_move = moves_table.get_property("childNodes")[i + 1]
-            pgn += white_move.get_property("innerText") + " "
+    def get_known_pgn(self):
+        """ Returns the pgn of the puzzle from the board model when it follows the board, from the page otherwise """
+        model = self.board.get_model()
+        return model.pgn() if model is not None else self.get_puzzle_pgn()
 
-            if (white_move.get_attribute("class") != "hist"):
-                break
+    def get_puzzle_id(self):
+        """ Returns the id of the puzzle on the page, the last part of its /training/<id> url """
+        url = self.driver.current_url.split("?")[0].rstrip("/")
+        return url.rsplit("/", 1)[-1] if "/training/" in url else None
 
-            black_move = moves_table.get_property("childNodes")[i + 2]
-            pgn += black_move.get_property("innerText") + " "
-
-        return pgn
+    def get_puzzle_moves(self, incremental=True):
+        """ Returns the puzzle's moves as move_history.Move objects. In incremental mode only the plies
+        added since the previous call are returned """
+        new_moves = self.move_history.read(self.driver, incremental)
+        return new_moves if incremental else self.move_history.get_moves()
 
 
     def puzzle_success(self):
@@ -508,7 +716,29 @@ class LichessTester(WebTester):
 
     def click_puzzle_continue(self):
         """ Click on the continue puzzle to continue to the next puzzle """
-        self.click_element(self.driver.find_element(By.CSS_SELECTOR, self.puzzles_board_css["continue"]))
+        self.use_css(self.puzzles_board_css["continue"], self.click_element)
+
+    def get_ply_count(self):
+        """ Returns the number of half-moves in the puzzle's moves table """
+        return waits.ply_count(self.driver, self.xpath.get("puzzles_moves_table"))
+
+    def wait_for_puzzle_ready(self):
+        """ Wait until a fresh puzzle has played its opening move and it is the player's turn """
+        return self.wait_until(
+            waits.players_turn(self.xpath.get("puzzles_moves_table"), self.puzzles_board_css["orientation"])
+            & ~waits.element_visible(self.puzzles_board_css["complete"])
+            & waits.last_move_present(self.puzzles_board_css["state"]),
+            step="puzzle_ready")
+
+    def wait_for_puzzle_reply(self, plies_before):
+        """ Wait until the puzzle answers the player's move or reports the puzzle as complete """
+        if self.board.events is not None:
+            return self.wait_for_event(
+                lambda state: (state.get("ply") or 0) >= plies_before + 2 or state.get("complete"), "puzzle_reply")
+        return self.wait_until(
+            waits.plies_at_least(self.xpath.get("puzzles_moves_table"), plies_before + 2)
+            | waits.element_visible(self.puzzles_board_css["complete"]),
+            step="puzzle_reply")
 
 
 class LichessEngine(WebTester):
@@ -516,6 +746,7 @@ class LichessEngine(WebTester):
 
     css = {
         "suggested_moves": "div[class=\"pv pv--nowrap\"]",
+        "depth": ".ceval .engine .info",
         "pgn": "div[class=\"pgn\"]",
         "pgn_button": "button[class='button button-thin action text']",
         "pgn_text": "textarea[class=\"copyable autoselect\"]"
@@ -530,15 +761,18 @@ class LichessEngine(WebTester):
         "files": "coords[class*=\"files\"]"
     }
 
-    board = None
+    engine_lines = None
 
-    def __init__(self):
-        super().__init__()
-        self.board = LichessBoard(self.driver, self.action, self.analysis_board_ccs)
+    def __init__(self, driver=None, headless=False, page_load=None):
+        super().__init__(driver, headless, page_load)
+        self.board = LichessBoard(self.driver, self.gestures, self.analysis_board_ccs)
+        self.engine_lines = []
+        if BOARD_EVENTS:
+            self.board.subscribe(pv_css=self.css.get("suggested_moves"))
 
     def open_website(self):
         """ Open a website given a URL """
-        self.driver.get(self.url)
+        self.navigate(self.url)
 
     def enable_engine(self):
         """ Enable the engine with the hotkey SPACE """
@@ -546,219 +780,290 @@ class LichessEngine(WebTester):
 
     def import_pgn(self, pgn_string):
         """ Import pgn to update analysis board """
-        pgn = self.driver.find_element(By.CSS_SELECTOR, self.css.get("pgn"))
-        self.action.move_to_element(pgn)
-        self.action.click()
-        self.action.send_keys(pgn_string)
-        self.action.perform()
+        self.use_css(self.css.get("pgn"), lambda pgn: self.gestures.click_and_type(pgn, pgn_string))
 
     def update_pgn(self, next_move):
         """ Concatenate to the pgn """
-        pgn_text = self.driver.find_element(By.CSS_SELECTOR, self.css.get("pgn_text"))
-        pgn_text.send_keys(" " + next_move)
-        self.action.perform()
+        self.use_css(self.css.get("pgn_text"), lambda pgn_text: pgn_text.send_keys(" " + next_move))
 
     def get_pgn(self):
         """ Returns the current pgn in string """
-        pgn_text = self.driver.find_element(By.CSS_SELECTOR, self.css.get("pgn_text"))
-        return pgn_text.get_property("value")
+        return self.use_css(self.css.get("pgn_text"), lambda pgn_text: pgn_text.get_property("value"))
 
     def enter_pgn(self):
         """ Click the blue import button when new text is added to the pgn form """
-        pgn_button = self.driver.find_element(By.CSS_SELECTOR, self.css.get("pgn_button"))
-        self.click_element(pgn_button)
-
-    def get_best_move(self):
-        """ Return the best move in string format """
-        suggested_moves = self.driver.find_element(By.CSS_SELECTOR, self.css.get("suggested_moves"))
-        # [!] ASSUME THERE IS AT LEAST 1 MOVE ALWAYS SUGGESTED BY ENGINE (NEED AN ASSERTION TO CHECK)
-        # NEED TO DELAY 2 SECONDS FOR ENGINE TO CALCULATE
-        # else error selenium.common.exceptions.NoSuchElementException: Message: no such element: Unable to locate element: {"method":"xpath","selector":"//*[@id="main-wrap"]/main/div[3]/div[2]/div"}
-
-        num_elements = suggested_moves.get_property("childElementCount")
-        best_move_element = suggested_moves.get_property("childNodes")[2]
-        best_move_string = best_move_element.get_property("innerText")
-        return best_move_string
-
-    def make_best_move(self):
-        """ Analysis board determines what the best move is """
-        best_move = self.get_best_move()
-        lichess_engine.update_pgn(best_move)
-        lichess_engine.enter_pgn()
+        self.use_css(self.css.get("pgn_button"), self.click_element)
+
+    def get_best_move(self, policy=None):
+        """ Return the best move in string format, once the engine's line meets the policy (a
+        readiness.ReadinessPolicy, the default one when None) """
+        return self.wait_for_engine(policy).san
+
+    def wait_for_engine(self, policy=None, previous_pv=None, on_line=None):
+        """ Follow the engine's depth, eval and line until the policy is met and return that readiness.EngineLine.
+        Lines showing previous_pv are skipped. Every line seen on the way is kept in engine_lines and passed to
+        on_line(line) as it comes """
+        self.engine_lines = []
+        return wait_until_ready(self.waiter, self.css.get("suggested_moves"), self.css.get("depth"),
+                                policy if policy is not None else ReadinessPolicy(), previous_pv,
+                                self.engine_lines, on_line)
+
+    def make_best_move(self, best_move=None):
+        """ Analysis board determines what the best move is. best_move (SAN) saves waiting for the engine again """
+        if best_move is None:
+            best_move = self.get_best_move()
+        self.update_pgn(best_move)
+        self.enter_pgn()
+
+    def get_best_move_uci(self):
+        """ Returns the first move of the engine's line in UCI notation (e.g. 'h5f7'), or None """
+        return waits.pv_uci(self.driver, self.css.get("suggested_moves"))
+
+    def play_best_move(self, best_move=None, san=None):
+        """ Play the engine's best move on the analysis board itself. Unlike make_best_move, which imports the
+        whole pgn again, the game tree and the engine's search carry on from the previous position.
+        best_move (UCI) and san are the move to play when the caller already waited for the engine """
+        if best_move is None:
+            best_move = self.get_best_move_uci()
+        if best_move is None or len(best_move) != 4:
+            # promotions need the promotion dialog, and a line without data-uci has no squares to click
+            self.make_best_move(san)
+            return
+        self.board.make_move(key_to_position(best_move[0:2]), key_to_position(best_move[2:4]))
 
     def get_board(self):
         """ Get the current board """
         return self.board
 
-# https://lichess.org/analysis
-
-
-def play(lichess_website_tester, lichess_engine):
-    time.sleep(1.5)
-    pgn = lichess_website_tester.get_puzzle_pgn()
-    time.sleep(1)
-    lichess_website_tester.get_board().update_board_state()
-    time.sleep(1)
-    lichess_engine.import_pgn(pgn)
-    time.sleep(1)
-    lichess_engine.enter_pgn()
-
-    # initial analysis board's moves
-    time.sleep(5)
-    lichess_engine.make_best_move()
-    time.sleep(1)
-    lichess_engine.get_board().update_board_state()
-    analysis_last_move = lichess_engine.get_board().get_last_move()
-    print("Analysis last move: ", analysis_last_move)
-
-
-    while (not lichess_website_tester.puzzle_success()):
-        # puzzle board's moves
-        time.sleep(0.1)
-        lichess_website_tester.get_board().make_move(analysis_last_move[1], analysis_last_move[2]) # analysis_last_move[1] is source position & analysis_last_move[2] is terminal position
-        time.sleep(1) # puzzle makes response move
-        lichess_website_tester.get_board().update_board_state() # update the board
-        puzzle_last_move = lichess_website_tester.get_board().get_last_move() # get the puzzle's last move
+    def get_pv_text(self):
+        """ Returns the text of the engine's principal variation, or None while the engine has no line """
+        return waits.pv_text(self.driver, self.css.get("suggested_moves"))
+
+    def wait_for_board_change(self, signature_before, step="engine_import"):
+        """ Wait until the analysis board differs from a signature taken with LichessBoard.get_board_signature """
+        if self.board.events is not None:
+            return self.wait_for_event(lambda state: self.board.events.changes != signature_before, step)
+        return self.wait_until(waits.board_changed(self.analysis_board_ccs["state"], signature_before), step=step)
+
+    def wait_for_pv(self, pv_before):
+        """ Wait until the engine reports a principal variation different from pv_before """
+        return self.wait_until(waits.engine_pv_populated(self.css.get("suggested_moves"), pv_before), step="engine_pv")
+
+    def wait_for_move(self, last_move_before):
+        """ Wait until the analysis board highlights a last move other than last_move_before """
+        if self.board.events is not None:
+            before = frozenset(last_move_before or ())
+            return self.wait_for_event(
+                lambda state: state.get("last_move") if state.get("last_move") and
+                frozenset(state["last_move"]) != before else None, "engine_move")
+        return self.wait_until(waits.last_move_present(self.analysis_board_ccs["state"], last_move_before),
+                               step="engine_move")
 
-        if (lichess_website_tester.puzzle_success()):
-            break
+# https://lichess.org/analysis
 
-        # analysis board's moves
-        lichess_engine.get_board().make_move(puzzle_last_move[1], puzzle_last_move[2])
-        time.sleep(1) # wait for engine to find the best move
-        lichess_engine.make_best_move() # engine makes best move
-        time.sleep(1) # wait for pieces to move
-        lichess_engine.get_board().update_board_state() # update the engine board
-        analysis_last_move = lichess_engine.get_board().get_last_move() # get the engine's last move
 
-    lichess_website_tester.click_puzzle_continue()
+def play(lichess_website_tester, engine, click_continue=True, position_cache=None, result_writer=None,
+         puzzle_id=None):
+    """ Solve one puzzle, asking an engines.EngineBackend for every move, and return its results.PuzzleRecord.
+    With a position_cache.PositionCache, positions solved before are answered without the engine.
+    With a result_writer (e.g. results.ResultWriter), the record is also written there, failed puzzles
+    included. puzzle_id saves reading it from the page url """
+    puzzle_board = lichess_website_tester.get_board()
+    if position_cache is not None:
+        engine = CachedEngine(engine, position_cache, lichess_website_tester.get_known_pgn)
+    record = PuzzleRecord(puzzle_id)
+    retries_before = puzzle_board.retries
+    mismatches_before = puzzle_board.mismatches
+    success = False
+    error = None
+
+    try:
+        with record.stage("wait"):
+            lichess_website_tester.wait_for_puzzle_ready()
+        with record.stage("read"):
+            if result_writer is not None and puzzle_id is None:
+                record.puzzle_id = lichess_website_tester.get_puzzle_id()
+            record.pgn = pgn = lichess_website_tester.get_puzzle_pgn()
+            puzzle_board.update_board_state()
+            record.snapshot = puzzle_board.get_snapshot()
+            puzzle_board.sync_model(pgn)
+            puzzle_board.check_model()
+
+        # initial engine move
+        with record.stage("engine"):
+            engine.new_puzzle(pgn, record.snapshot)
+            engine_move = engine.best_move()
+
+        while True:
+            # puzzle board's moves
+            with record.stage("read"):
+                plies_before = lichess_website_tester.get_ply_count()
+            with record.stage("input"):
+                puzzle_board.make_move(engine_move[1], engine_move[2]) # engine_move[1] is source position & engine_move[2] is terminal position
+            with record.stage("wait"):
+                lichess_website_tester.wait_for_puzzle_reply(plies_before) # puzzle makes response move
+            record.mark_move(engine_move)
+            with record.stage("read"):
+                if (lichess_website_tester.puzzle_success()):
+                    break
+                puzzle_board.update_board_state() # update the board
+                puzzle_last_move = puzzle_board.get_last_move() # get the puzzle's last move
+                record.mark_reply(puzzle_last_move)
+                puzzle_board.update_model([engine_move, puzzle_last_move])
+                puzzle_board.check_model()
+
+            # engine's moves
+            with record.stage("engine"):
+                engine.push(puzzle_last_move, puzzle_board.get_snapshot())
+                engine_move = engine.best_move()
+        success = True
+
+        if click_continue:
+            lichess_website_tester.click_puzzle_continue()
+    except Exception as exception:
+        error = repr(exception)
+        raise
+    finally:
+        record.retries = puzzle_board.retries - retries_before
+        record.mismatches = puzzle_board.mismatches - mismatches_before
+        record.finish(success, error)
+        if result_writer is not None:
+            result_writer.write(record.as_dict())
+    return record
 
 
 
 if __name__ == '__main__':
 
-    # Only able to run single test case.
-    # Comment out other tests.
-    # Super Puzzles Test: Lines 652-672
-    # Spotlight Tournaments Test: Lines 671-684
-    # Watch Library Test: Lines 688-706
-    # Puzzles Test: Lines 710-726
-    # Signin & Signout Test: Lines 730-748
-    # Community, Forum, Blog, Swag Test: Lines 752-764
-
+    # The full puzzle run. The other scenarios, and a shorter version of this one, are registered in
+    # scenarios.py and run concurrently with: python scenarios.py [names] [--shard INDEX/COUNT]
 
 
     """ Super Puzzles Test """
 
+    # Both browsers start at the same time, headed and sized to half of the screen each. With SHARED_BROWSER
+    # a single browser is started and both testers are windows of it
+    page_load = SCENARIO_PROFILES[PAGE_LOAD_PROFILE] if PAGE_LOAD_PROFILE else None
+    driver_pool = DriverPool(size=1 if ENGINE_BACKEND == "uci" or SHARED_BROWSER else 2, headless=False, max_uses=1, executable_path=CHROMEDRIVER_PATH,
+                             window_size=(960, 1080),
+                             page_load_strategy=page_load.strategy if page_load is not None else None,
+                             arguments=SHARED_BROWSER_ARGUMENTS if SHARED_BROWSER else ()).start()
+    shared_browser = SharedBrowser(isolation=SHARED_BROWSER, driver_pool=driver_pool) if SHARED_BROWSER else None
+
+    # a replay serves the bundle's puzzles and analysis board locally, in the order they were recorded
+    replay_server = ReplayServer(REPLAY_BUNDLE_PATH).start() if REPLAY_BUNDLE_PATH else None
+    recorder = BundleRecorder(RECORD_BUNDLE_PATH).open() if RECORD_BUNDLE_PATH else None
+
     #initiate puzzle webpage
-    lichess_website_tester = LichessTester()
-    lichess_website_tester.open_website()
-    time.sleep(1)
-    lichess_website_tester.click_puzzles()
-    lichess_website_tester.driver.set_window_size(lichess_website_tester.window_size['width']/2, lichess_website_tester.window_size['height'])
-    lichess_website_tester.driver.set_window_position(0, 0)
-
-    #initiate analysis webpage
-    lichess_engine = LichessEngine()
-    lichess_engine.open_website()
-    lichess_engine.driver.set_window_size(lichess_engine.window_size['width']/2, lichess_engine.window_size['height'])
-    lichess_engine.driver.set_window_position(lichess_engine.window_size['width']/2, 0)
-    lichess_engine.enable_engine()
-
-    for _ in range(0, 1000):
-        play(lichess_website_tester, lichess_engine)
-
-    time.sleep(1000)
-
-
-
-    """ Spotlighted Tournaments Test """
-    """
-    lichess_website_tester = LichessTester()
-    lichess_website_tester.open_website()
-    time.sleep(2)
-    lichess_website_tester.click_spotlight(1)
-    time.sleep(2)
-    lichess_website_tester.click_home()
-    time.sleep(2)
-    """
-
-
-    """ Watch Library Test """
-    """
-    lichess_website_tester = LichessTester()
-    lichess_website_tester.open_website()
-    time.sleep(2)
-    lichess_website_tester.hover_watch()
-    time.sleep(2)
-    lichess_website_tester.click_watch_video_library()
-    time.sleep(2)
-    lichess_website_tester.click_beginner()
-    time.sleep(2)
-    lichess_website_tester.click_beginner_video(1)
-    time.sleep(2)
-    lichess_website_tester.click_video_player()
-    time.sleep(5)
-    lichess_website_tester.click_video_player()
-    time.sleep(1)
-    lichess_website_tester.click_home()
-    time.sleep(2)
-    """
-
-
-    """ Puzzles Test """
-    """
-    lichess_tester = LichessTester()
-    lichess_tester.open_website()
-    time.sleep(2)
-    lichess_tester.click_puzzles()
-    time.sleep(2)
-    lichess_tester.click_puzzles_dashboard()
-    time.sleep(2)
-    lichess_tester.click_puzzles_streak()
-    time.sleep(2)
-    lichess_tester.click_puzzles_storm()
-    time.sleep(2)
-    lichess_tester.click_puzzles_racer()
-    time.sleep(2)
-    lichess_tester.search("Hello, world!")
-    time.sleep(10)
-    """
-
-
-    """ Signin & Signout Test """
-    """
-    lichess_website_tester = LichessTester()
-    lichess_website_tester.open_website()
-    time.sleep(0.2)
-    lichess_website_tester.click_signin_button()
-    time.sleep(0.2)
-    lichess_website_tester.fill_signin_form("Throwawayy123", "123456")
-    time.sleep(3)
-    lichess_website_tester.click_preferences()
-    time.sleep(1)
-    lichess_website_tester.click_kid_mode()
-    time.sleep(1)
-    lichess_website_tester.switch_kid_mode("123456")
-    time.sleep(1)
-    lichess_website_tester.click_signout()
-    time.sleep(1)
-    lichess_website_tester.click_home()
-    time.sleep(4)
-    """
-
-
-    """ Community, Forum, Blog, Swag Test """
-    """
-    lichess_website_tester = LichessTester()
-    lichess_website_tester.open_website()
-    time.sleep(2)
-    lichess_website_tester.click_forum()
-    time.sleep(2)
-    lichess_website_tester.click_blog()
-    time.sleep(2)
-    lichess_website_tester.click_home()
-    time.sleep(2)
-    lichess_website_tester.click_swag()
-    time.sleep(4)
-    """
\ No newline at end of file
+    lichess_website_tester = LichessTester(driver=shared_browser.open_window("puzzle") if shared_browser else driver_pool.acquire(),
+                                           page_load=page_load)
+    tracer = lichess_website_tester.enable_tracing(name="puzzle")
+    lichess_website_tester.set_window_position(0, 0)
+    if replay_server is not None:
+        lichess_website_tester.url = replay_server.url
+        lichess_website_tester.open_puzzle(replay_server.bundle.puzzle_ids()[0])
+    else:
+        lichess_website_tester.open_website()
+        lichess_website_tester.wait_for(lichess_website_tester.xpath.get("puzzles"))
+        if recorder is not None:
+            recorder.record_page(lichess_website_tester.driver, origin=lichess_website_tester.url)
+        lichess_website_tester.click_puzzles()
+
+    #initiate engine
+    if ENGINE_BACKEND == "uci":
+        engine = UciEngine()
+    else:
+        lichess_engine = LichessEngine(driver=shared_browser.open_window("engine") if shared_browser else driver_pool.acquire(),
+                                       page_load=page_load)
+        if replay_server is not None:
+            lichess_engine.url = replay_server.url + "/analysis"
+        lichess_engine.enable_tracing(tracer, "engine")
+        if shared_browser is not None:
+            lichess_engine.set_window_size(lichess_website_tester.window_size['width'], lichess_website_tester.window_size['height'])
+        lichess_engine.set_window_position(lichess_website_tester.window_size['width'], 0)
+        engine = BrowserEngine(lichess_engine)
+    engine.open()
+    position_cache = PositionCache()
+    result_writer = ResultWriter(RESULTS_PATH).start()
+
+    orchestrator = Orchestrator(lichess_website_tester, engine, position_cache) if CONCURRENT else None
+    monitor = None
+    if SOAK:
+        monitor = SoakMonitor()
+        monitor.attach("puzzle", lichess_website_tester.driver)
+        if ENGINE_BACKEND != "uci":
+            monitor.attach("engine", engine.lichess_engine.driver)
+        if shared_browser is not None:
+            monitor.attach_browser("browser", shared_browser)
+
+    # a failed puzzle is retried after the cheapest fix, a dead browser is replaced instead of ending the run
+    supervisor = Supervisor(lichess_website_tester, engine, driver_pool, tracer)
+
+    def replaced(name, tester, reason):
+        if name == "puzzle" and orchestrator is not None:
+            orchestrator.replace_tester(tester)
+        if monitor is not None:
+            monitor.attach(name, tester.driver, reason)
+    supervisor.on_replace(replaced)
+
+    def solve(tester, engine, writer):
+        # a recorded puzzle needs its moves table, which is gone once continue is clicked
+        if orchestrator is not None:
+            return orchestrator.play(click_continue=recorder is None, result_writer=writer)
+        return play(tester, engine, click_continue=recorder is None, position_cache=position_cache,
+                    result_writer=writer)
+
+    for _ in range(0, SOAK_PUZZLES if SOAK else 1000):
+        record = supervisor.play(solve, result_writer)
+        lichess_website_tester = supervisor.tester
+        if recorder is not None and record is not None:
+            recorder.record_puzzle(lichess_website_tester, record)
+            lichess_website_tester.click_puzzle_continue()
+        if monitor is None:
+            continue
+        monitor.puzzle_done(record.seconds if record is not None else None)
+        if not monitor.due():
+            continue
+        # between two puzzles a browser can be swapped: the new one opens the next puzzle where the old one was
+        for name, reason in monitor.sample().items():
+            if name == "browser":
+                supervisor.replace_browser(shared_browser, reason)
+                monitor.attach_browser(name, shared_browser, reason)
+            else:
+                supervisor.replace_session(name, reason)
+    if orchestrator is not None:
+        orchestrator.close()
+        print("Speculation: ", orchestrator.get_speculation_stats())
+
+    result_writer.stop()
+    if recorder is not None:
+        recorder.close()
+        print("Recorded: ", recorder.puzzles, "puzzles and", recorder.pages, "pages into", RECORD_BUNDLE_PATH)
+    if replay_server is not None:
+        replay_server.stop()
+    print_summary(summarize([RESULTS_PATH], result_writer.run))
+
+    print("Engine latency: ", engine.get_latency_stats())
+    print("Position cache: ", position_cache.get_stats())
+    tracer.print_summary()
+    tracer.export_json(TRACE_SUMMARY_PATH)
+    tracer.export_chrome_trace(TRACE_EVENTS_PATH)
+    print("Input latency: ", lichess_website_tester.gestures.get_latency_stats())
+    print("Recovery: ", supervisor.get_stats())
+    if shared_browser is not None:
+        print("Shared browser: ", shared_browser.get_stats())
+    if monitor is not None:
+        monitor.close()
+        print("Soak: ", monitor.get_stats())
+
+    # quit what the run started instead of leaving it to WebTester.__del__, which only closes a window. The
+    # pool is closed first, so the sessions coming back to it are quit rather than relaunched
+    engine.close()
+    position_cache.close()
+    driver_pool.close()
+    if shared_browser is not None:
+        shared_browser.close()
+    else:
+        driver_pool.release(lichess_website_tester.driver, retire=True)
+        if ENGINE_BACKEND != "uci":
+            driver_pool.release(engine.lichess_engine.driver, retire=True)
@@ -0,0 +1,74 @@
+# Lichess.org Testing with Selenium
+# Reads a moves table in one WebDriver round-trip, optionally only the plies added since the last read
+
+# arguments: moves table xpath, first ply wanted, reader token.
+# The token is stored on the table element; a table without it was re-rendered and is read from ply 0
+MOVES_SCRIPT = """
+var table = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+if (!table) return null;
+var nodes = [];
+for (var i = 0; i < table.children.length; i++) {
+    if (table.children[i].localName === 'move') nodes.push(table.children[i]);
+}
+var fromPly = arguments[1];
+if (table.__moveHistory !== arguments[2] || fromPly > nodes.length) fromPly = 0;
+table.__moveHistory = arguments[2];
+var moves = [];
+for (var i = fromPly; i < nodes.length; i++) moves.push([nodes[i].innerText.trim(), nodes[i].className]);
+return {from: fromPly, moves: moves};
+"""
+
+
+class Move:
+    """ One half-move of a moves table """
+    __slots__ = ("ply", "san", "side", "hist", "classes")
+
+    def __init__(self, ply, san, classes):
+        self.ply = ply              # 1 for white's first move, 2 for black's reply, ...
+        self.san = san
+        self.side = "white" if ply % 2 == 1 else "black"
+        self.hist = "hist" in classes.split()
+        self.classes = classes
+
+    def __repr__(self):
+        return "Move({}, {!r}, {}{})".format(self.ply, self.san, self.side, ", hist" if self.hist else "")
+
+
+class MoveHistory:
+    """ Structured copy of a moves table, kept up to date with one script call per read """
+    xpath = None
+    moves = None
+
+    def __init__(self, xpath):
+        self.xpath = xpath
+        self.moves = []
+        self.token = "history-{}".format(id(self))
+
+    def read(self, driver, incremental=True):
+        """ Sync with the page and return the moves that are new since the previous read.
+        A full read (or a table that was replaced, e.g. by a new puzzle) starts over from the first ply """
+        from_ply = len(self.moves) if incremental else 0
+        result = driver.execute_script(MOVES_SCRIPT, self.xpath, from_ply, self.token)
+        if result is None:
+            self.moves = []
+            return []
+        from_ply = result["from"]
+        new_moves = [Move(from_ply + index + 1, san, classes) for index, (san, classes) in enumerate(result["moves"])]
+        self.moves = self.moves[:from_ply] + new_moves
+        return new_moves
+
+    def get_moves(self):
+        """ Return every move read so far """
+        return self.moves
+
+    def to_pgn(self):
+        """ Return the moves as a pgn string ("1. e4 e5 2. Nf3 ..."), stopping after the first white move
+        that is not plain history, the way LichessTester.get_puzzle_pgn always has """
+        pgn = ""
+        for index in range(0, len(self.moves), 2):
+            white_move = self.moves[index]
+            pgn += str(index//2 + 1) + ". " + white_move.san + " "
+            if white_move.classes != "hist" or index + 1 >= len(self.moves):
+                break
+            pgn += self.moves[index + 1].san + " "
+        return pgn
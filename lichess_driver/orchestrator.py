@@ -0,0 +1,202 @@
+# Lichess.org Testing with Selenium
+# Drives the puzzle and the engine sessions as concurrent asyncio tasks, speculating on the puzzle's replies
+
+from engines import CachedEngine
+from results import PuzzleRecord
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import asyncio
+
+
+class Session:
+    """ Runs the blocking calls of one WebDriver session (or engine) on a thread of its own. The calls of a
+    session run one at a time and in order, the calls of two sessions run in parallel """
+    executor = None
+
+    def __init__(self, name):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    async def call(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(function, *args))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class Speculation:
+    """ Engine work started on the reply the engine expects, before the puzzle has played it """
+    predicted = None    # the expected reply, once the engine has named it
+    applied = False     # the expected reply was (or is being) played on the engine
+    cancelled = False
+    task = None
+
+
+class Orchestrator:
+    """ Solves puzzles like main.play(), with the puzzle session and the engine as two concurrent sides.
+
+    While the puzzle board takes the player's move and animates its reply, the engine predicts that reply,
+    plays it and searches the position after it. When the actual reply matches, the next move is ready or
+    nearly so. When it does not, the speculation is interrupted and the engine is synced again from the
+    puzzle's pgn. Per move, the wall time tends to the slower of the two sides instead of their sum.
+
+    orchestrator = Orchestrator(lichess_website_tester, engine)
+    for _ in range(1000):
+        orchestrator.play(result_writer=result_writer)
+    orchestrator.close()
+
+    Engines whose EngineBackend.predict_reply returns None are never speculated on """
+    tester = None
+    engine = None
+    speculative = True
+
+    def __init__(self, lichess_website_tester, engine, position_cache=None, speculative=True):
+        self.tester = lichess_website_tester
+        self.engine = engine
+        if position_cache is not None:
+            self.engine = CachedEngine(engine, position_cache, lichess_website_tester.get_known_pgn)
+        self.speculative = speculative
+        self.puzzle_side = Session("puzzle")
+        self.engine_side = Session("engine")
+        self.speculations = 0
+        self.hits = 0
+        self.misses = 0
+
+    def play(self, click_continue=True, result_writer=None, puzzle_id=None):
+        """ Solve the puzzle on the page and return its results.PuzzleRecord, see main.play """
+        return asyncio.run(self.solve(click_continue, result_writer, puzzle_id))
+
+    def replace_tester(self, lichess_website_tester):
+        """ Solve on another puzzle tester from the next puzzle on, e.g. after recovery.recycle_session """
+        self.tester = lichess_website_tester
+        if isinstance(self.engine, CachedEngine):
+            self.engine.pgn_source = lichess_website_tester.get_known_pgn
+
+    def close(self):
+        self.puzzle_side.close()
+        self.engine_side.close()
+
+    async def solve(self, click_continue=True, result_writer=None, puzzle_id=None):
+        tester = self.tester
+        puzzle_board = tester.get_board()
+        record = PuzzleRecord(puzzle_id)
+        retries_before = puzzle_board.retries
+        mismatches_before = puzzle_board.mismatches
+        speculation = None
+        success = False
+        error = None
+
+        try:
+            with record.stage("wait"):
+                await self.puzzle_side.call(tester.wait_for_puzzle_ready)
+            with record.stage("read"):
+                if result_writer is not None and puzzle_id is None:
+                    record.puzzle_id = await self.puzzle_side.call(tester.get_puzzle_id)
+                record.pgn = pgn = await self.puzzle_side.call(tester.get_puzzle_pgn)
+                await self.puzzle_side.call(puzzle_board.update_board_state)
+                record.snapshot = puzzle_board.get_snapshot()
+                puzzle_board.sync_model(pgn)
+                puzzle_board.check_model()
+
+            with record.stage("engine"):
+                await self.engine_side.call(self.engine.new_puzzle, pgn, record.snapshot)
+                engine_move = await self.engine_side.call(self.engine.best_move)
+
+            while True:
+                # the engine works on the expected reply while the puzzle board plays the move and answers
+                speculation = self.speculate() if self.speculative else None
+                with record.stage("read"):
+                    plies_before = await self.puzzle_side.call(tester.get_ply_count)
+                with record.stage("input"):
+                    await self.puzzle_side.call(puzzle_board.make_move, engine_move[1], engine_move[2])
+                with record.stage("wait"):
+                    await self.puzzle_side.call(tester.wait_for_puzzle_reply, plies_before)
+                record.mark_move(engine_move)
+                with record.stage("read"):
+                    if await self.puzzle_side.call(tester.puzzle_success):
+                        break
+                    await self.puzzle_side.call(puzzle_board.update_board_state)
+                    puzzle_last_move = puzzle_board.get_last_move()
+                    record.mark_reply(puzzle_last_move)
+                    puzzle_board.update_model([engine_move, puzzle_last_move])
+                    puzzle_board.check_model()
+
+                with record.stage("engine"):
+                    engine_move = await self.answer(speculation, puzzle_last_move, puzzle_board.get_snapshot())
+                speculation = None
+            success = True
+
+            if click_continue:
+                await self.puzzle_side.call(tester.click_puzzle_continue)
+        except Exception as exception:
+            error = repr(exception)
+            raise
+        finally:
+            if speculation is not None:
+                await self.cancel(speculation)
+            record.retries = puzzle_board.retries - retries_before
+            record.mismatches = puzzle_board.mismatches - mismatches_before
+            record.finish(success, error)
+            if result_writer is not None:
+                result_writer.write(record.as_dict())
+        return record
+
+    def speculate(self):
+        """ Start predicting the puzzle's reply and searching the position after it """
+        speculation = Speculation()
+        speculation.task = asyncio.ensure_future(self.run_speculation(speculation))
+        self.speculations += 1
+        return speculation
+
+    async def run_speculation(self, speculation):
+        """ Return the engine's move after the predicted reply, or None when there is no prediction or the
+        speculation was cancelled or failed. A speculation never fails the puzzle """
+        try:
+            predicted = await self.engine_side.call(self.engine.predict_reply)
+            if predicted is None or speculation.cancelled:
+                return None
+            speculation.predicted = predicted
+            speculation.applied = True
+            await self.engine_side.call(self.engine.speculate, predicted)
+            if speculation.cancelled:
+                return None
+            return await self.engine_side.call(self.engine.best_move)
+        except Exception:
+            return None
+
+    async def cancel(self, speculation):
+        """ Stop a speculation and wait until the engine is free again """
+        speculation.cancelled = True
+        if not speculation.task.done():
+            self.engine.interrupt()
+            await asyncio.wait([speculation.task])
+            await self.engine_side.call(self.engine.resume)
+
+    async def answer(self, speculation, reply, snapshot):
+        """ Return the engine's move after the puzzle's reply, taken from the speculation when it guessed right """
+        if speculation is not None:
+            predicted = speculation.predicted
+            if predicted is not None and tuple(predicted[1:]) == tuple(reply[1:]):
+                engine_move = await speculation.task
+                if engine_move is not None:
+                    self.hits += 1
+                    return engine_move
+            await self.cancel(speculation)
+            if speculation.applied:
+                # the engine played a reply that did not happen, sync it to the puzzle again
+                self.misses += 1
+                pgn = await self.puzzle_side.call(self.tester.get_known_pgn)
+                await self.engine_side.call(self.engine.new_puzzle, pgn, snapshot)
+                return await self.engine_side.call(self.engine.best_move)
+
+        await self.engine_side.call(self.engine.push, reply, snapshot)
+        return await self.engine_side.call(self.engine.best_move)
+
+    def get_speculation_stats(self):
+        """ Return how often the predicted reply was the puzzle's actual reply """
+        decided = self.hits + self.misses
+        return {
+            "speculations": self.speculations,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits/decided if decided else 0.0
+        }
@@ -0,0 +1,223 @@
+# Lichess.org Testing with Selenium
+# Page-load profiles: load strategy, DevTools URL blocking of heavy resources, and what each navigation cost
+
+from driver_pool import launch_driver, chrome_options
+from urllib.parse import urlsplit
+import argparse
+import json
+import time
+
+
+PAGE_LOAD_STRATEGIES = ("normal", "eager", "none")     # WebDriver pageLoadStrategy: load event, DOMContentLoaded, none
+SETTLE_SECONDS = 1.0        # compare_profiles lets late resources arrive this long after a page is ready
+
+# Heavy resources a profile can block, by category. Patterns use the DevTools Network.setBlockedURLs syntax,
+# where * matches any run of characters
+RESOURCE_PATTERNS = {
+    "images": ("*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.avif", "*.ico"),
+    "fonts": ("*.woff", "*.woff2", "*.ttf", "*.otf"),
+    "media": ("*.mp4", "*.webm", "*.ogg", "*.mp3"),
+    "video_embeds": ("*youtube.com/embed/*", "*youtube-nocookie.com/*", "*ytimg.com/*", "*googlevideo.com/*"),
+    "third_party": ("*google-analytics.com/*", "*googletagmanager.com/*", "*doubleclick.net/*",
+                    "*spreadshirt.*"),
+}
+
+# What a page has fetched so far, from the Resource Timing entries. transferSize is 0 for cached resources
+# and for cross-origin ones that do not allow timing, so bytes is a lower bound on other origins
+PAGE_STATS_SCRIPT = """
+var navigation = performance.getEntriesByType('navigation')[0];
+var resources = performance.getEntriesByType('resource');
+var bytes = navigation ? navigation.transferSize : 0;
+for (var i = 0; i < resources.length; i++) bytes += resources[i].transferSize || 0;
+return {
+    url: location.href,
+    requests: resources.length + (navigation ? 1 : 0),
+    bytes: bytes,
+    dom_ready_ms: navigation ? navigation.domContentLoadedEventEnd : null,
+    load_ms: navigation && navigation.loadEventEnd ? navigation.loadEventEnd : null
+};
+"""
+
+
+class PageLoadProfile:
+    """ How a tester loads pages: the WebDriver load strategy and the resources DevTools refuses to fetch.
+
+    block lists categories of RESOURCE_PATTERNS or raw patterns, allow takes categories or patterns back out,
+    which is how a scenario keeps what it actually looks at. With the eager or none strategy a page is
+    handed over before it finished loading, and WebTester waits for each element it needs instead.
+
+    The strategy is a session capability: it applies to sessions launched with chrome_options(), a session
+    started another way keeps its own. Blocking can be installed on any Chrome session """
+    name = None
+    strategy = "normal"
+    block = ()
+    allow = ()
+
+    def __init__(self, name, strategy="eager", block=tuple(RESOURCE_PATTERNS), allow=()):
+        if strategy not in PAGE_LOAD_STRATEGIES:
+            raise ValueError("Unknown page load strategy {!r}, expected one of {}".format(strategy,
+                                                                                       PAGE_LOAD_STRATEGIES))
+        self.name = name
+        self.strategy = strategy
+        self.block = tuple(block)
+        self.allow = tuple(allow)
+
+    def blocked_patterns(self):
+        """ Return the URL patterns this profile blocks, allowlist applied """
+        allowed = set()
+        for entry in self.allow:
+            allowed.update(RESOURCE_PATTERNS.get(entry, (entry,)))
+        patterns = []
+        for entry in self.block:
+            for pattern in RESOURCE_PATTERNS.get(entry, (entry,)):
+                if pattern not in allowed and pattern not in patterns:
+                    patterns.append(pattern)
+        return patterns
+
+    def chrome_options(self, headless=False, **kwargs):
+        """ Build ChromeOptions whose sessions load pages with this profile's strategy """
+        return chrome_options(headless=headless, page_load_strategy=self.strategy, **kwargs)
+
+    def install(self, driver):
+        """ Apply the profile's URL blocking to a Chrome session, replacing any blocking installed before """
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.blocked_patterns()})
+
+    def is_lazy(self):
+        """ Whether navigations return before the page finished loading """
+        return self.strategy != "normal"
+
+    def __repr__(self):
+        return "PageLoadProfile({!r}, strategy={!r}, blocked={})".format(self.name, self.strategy,
+                                                                        len(self.blocked_patterns()))
+
+
+NORMAL = PageLoadProfile("normal", "normal", block=())
+LIGHT = PageLoadProfile("light", "eager")
+
+# Per scenario: what it needs of its pages decides what stays allowed
+SCENARIO_PROFILES = {
+    "puzzles": PageLoadProfile("puzzles", "eager", allow=("images",)),     # the board and pieces are images
+    "watch": PageLoadProfile("watch", "eager", allow=("video_embeds",)),   # the scenario clicks the video player
+    "spotlight": LIGHT,
+    "signin": LIGHT,
+    "community": PageLoadProfile("community", "eager", allow=("*spreadshirt.*",)),   # the scenario opens the swag shop
+}
+
+
+def read_page_stats(driver):
+    """ Return the requests and bytes the current page has fetched so far, in one execute_script call """
+    return driver.execute_script(PAGE_STATS_SCRIPT)
+
+
+class PageLoadReport:
+    """ What every navigation of a tester cost, and what a profile saved compared with a baseline run:
+
+    report.add(read_page_stats(driver))
+    report.saved_against(baseline_report)   # per url path: requests, bytes and milliseconds saved """
+
+    def __init__(self, profile_name=None):
+        self.profile_name = profile_name
+        self.navigations = []
+
+    def add(self, stats, seconds=None):
+        entry = dict(stats)
+        entry["path"] = urlsplit(entry["url"]).path.rstrip("/") or "/"
+        if seconds is not None:
+            entry["seconds"] = seconds
+        self.navigations.append(entry)
+        return entry
+
+    def by_path(self):
+        """ The last navigation to every url path """
+        return {entry["path"]: entry for entry in self.navigations}
+
+    def saved_against(self, baseline):
+        """ Return, per url path both reports visited, the requests, bytes and seconds this report saved """
+        baseline_paths = baseline.by_path()
+        saved = dict()
+        for path, entry in self.by_path().items():
+            before = baseline_paths.get(path)
+            if before is None:
+                continue
+            saved[path] = {
+                "requests": before["requests"] - entry["requests"],
+                "bytes": before["bytes"] - entry["bytes"],
+                "seconds": before.get("seconds", 0.0) - entry.get("seconds", 0.0)
+            }
+        return saved
+
+    def totals(self):
+        return {
+            "navigations": len(self.navigations),
+            "requests": sum(entry["requests"] for entry in self.navigations),
+            "bytes": sum(entry["bytes"] for entry in self.navigations)
+        }
+
+    def as_dict(self):
+        return {"profile": self.profile_name, "totals": self.totals(), "navigations": self.navigations}
+
+
+def measure_navigation(driver, url, ready=None, settle=SETTLE_SECONDS):
+    """ Load url, wait until ready(driver) holds (when given), let late resources arrive and return the page's
+    stats with the seconds driver.get() and ready took """
+    start = time.perf_counter()
+    driver.get(url)
+    if ready is not None:
+        deadline = time.perf_counter() + 10
+        while not ready(driver) and time.perf_counter() < deadline:
+            time.sleep(0.05)
+    seconds = time.perf_counter() - start
+    time.sleep(settle)
+    return read_page_stats(driver), seconds
+
+
+def compare_profiles(urls, profile, baseline=NORMAL, executable_path=None, headless=True):
+    """ Load every url in a fresh session per profile, the http cache disabled, and return both reports and
+    what profile saved per navigation """
+    reports = []
+    for current in (baseline, profile):
+        driver = launch_driver(executable_path, current.chrome_options(headless=headless))
+        try:
+            current.install(driver)
+            driver.execute_cdp_cmd("Network.setCacheDisabled", {"cacheDisabled": True})
+            report = PageLoadReport(current.name)
+            for url in urls:
+                stats, seconds = measure_navigation(driver, url,
+                                                    lambda driver: driver.execute_script("return document.body !== null"))
+                report.add(stats, seconds)
+            reports.append(report)
+        finally:
+            driver.quit()
+    return reports[0], reports[1], reports[1].saved_against(reports[0])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare what pages cost under a page-load profile and without one")
+    parser.add_argument("urls", nargs="*", help="pages to load (defaults to the fixture's heavy pages)")
+    parser.add_argument("--profile", choices=sorted(SCENARIO_PROFILES) + ["light"], default="light")
+    parser.add_argument("--chromedriver", default=None)
+    parser.add_argument("--headed", action="store_true")
+    parser.add_argument("--json", action="store_true")
+    arguments = parser.parse_args()
+
+    fixture = None
+    urls = arguments.urls
+    if not urls:
+        from fixture_server import FixtureServer, HEAVY_PAGES
+        fixture = FixtureServer().start()
+        urls = [fixture.url + path for path in HEAVY_PAGES]
+    profile = LIGHT if arguments.profile == "light" else SCENARIO_PROFILES[arguments.profile]
+    baseline_report, profile_report, saved = compare_profiles(urls, profile, executable_path=arguments.chromedriver,
+                                                              headless=not arguments.headed)
+    if fixture is not None:
+        fixture.stop()
+
+    if arguments.json:
+        print(json.dumps({"baseline": baseline_report.as_dict(), "profile": profile_report.as_dict(), "saved": saved},
+                         indent=2))
+    else:
+        print("{:<30}{:>12}{:>14}{:>12}".format("path (" + profile.name + ")", "requests", "KiB saved", "ms saved"))
+        for path, entry in saved.items():
+            print("{:<30}{:>12}{:>14.1f}{:>12.1f}".format(path, entry["requests"], entry["bytes"]/1024,
+                                                          1000*entry["seconds"]))
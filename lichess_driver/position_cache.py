@@ -0,0 +1,132 @@
+# Lichess.org Testing with Selenium
+# Position -> best move cache, in memory with LRU eviction and in a sqlite file shared by worker processes
+
+from snapshot import snapshot_to_fen
+from collections import OrderedDict
+import sqlite3
+import time
+
+
+POSITION_CACHE_PATH = "position_cache.sqlite"   # in the working directory, like every run artifact
+MEMORY_ENTRIES = 10000          # positions kept in memory per process, least recently used are dropped first
+SQLITE_TIMEOUT_SECONDS = 10     # how long a writer waits for another process holding the database lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    key TEXT PRIMARY KEY,
+    move TEXT NOT NULL,
+    pv TEXT,
+    depth INTEGER,
+    engine TEXT,
+    updated REAL
+)
+"""
+
+# A deeper search replaces a shallower one, never the other way round
+UPSERT = """
+INSERT INTO positions (key, move, pv, depth, engine, updated) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(key) DO UPDATE SET move = excluded.move, pv = excluded.pv, depth = excluded.depth,
+    engine = excluded.engine, updated = excluded.updated
+WHERE COALESCE(excluded.depth, 0) >= COALESCE(positions.depth, 0)
+"""
+
+
+def position_key(snapshot, white_to_move):
+    """ Return the cache key of a position: the FEN without its move counters, which the board does not show """
+    return " ".join(snapshot_to_fen(snapshot, white_to_move).split()[:4])
+
+
+class CacheEntry:
+    """ Best move of a position in UCI notation (e.g. 'h5f7'), with the line and depth it came from """
+    __slots__ = ("move", "pv", "depth", "engine")
+
+    def __init__(self, move, pv=None, depth=None, engine=None):
+        self.move = move
+        self.pv = pv
+        self.depth = depth
+        self.engine = engine
+
+    def __repr__(self):
+        return "CacheEntry({!r}, pv={!r}, depth={!r}, engine={!r})".format(self.move, self.pv, self.depth, self.engine)
+
+
+class PositionCache:
+    """ Best moves by position. Lookups try the in-memory LRU first, then the sqlite file, which every
+    process opening the same path shares. path=None keeps the cache in memory only.
+
+    The database is opened lazily, so a cache can be created before a worker process starts and used inside it """
+    path = None
+    capacity = None
+    entries = None
+    connection = None
+
+    def __init__(self, path=POSITION_CACHE_PATH, capacity=MEMORY_ENTRIES):
+        self.path = path
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def open(self):
+        if self.connection is not None or self.path is None:
+            return
+        self.connection = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT_SECONDS, isolation_level=None)
+        # write-ahead logging lets readers in other workers go on while one worker writes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(SCHEMA)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def remember(self, key, entry):
+        """ Put an entry in the in-memory LRU, evicting the least recently used one when full """
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def get(self, key):
+        """ Return the CacheEntry of a position, or None """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.memory_hits += 1
+            return entry
+        self.open()
+        if self.connection is not None:
+            row = self.connection.execute("SELECT move, pv, depth, engine FROM positions WHERE key = ?",
+                                          (key,)).fetchone()
+            if row is not None:
+                entry = CacheEntry(*row)
+                self.remember(key, entry)
+                self.disk_hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        """ Store the best move of a position, unless a deeper search of it is already stored """
+        known = self.entries.get(key)
+        if known is not None and (known.depth or 0) > (entry.depth or 0):
+            return
+        self.remember(key, entry)
+        self.open()
+        if self.connection is not None:
+            self.connection.execute(UPSERT, (key, entry.move, entry.pv, entry.depth, entry.engine, time.time()))
+
+    def get_stats(self):
+        """ Return hit/miss counts and the hit rate of this process's lookups """
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits/lookups if lookups else 0.0,
+            "entries": len(self.entries)
+        }
@@ -0,0 +1,136 @@
+# Lichess.org Testing with Selenium
+# Engine readiness: the analysis page's depth, eval and line are followed until a ReadinessPolicy is met
+
+from snapshot import key_to_position
+from selenium.common.exceptions import TimeoutException
+import waits
+import time
+
+
+READY_MIN_DEPTH = 18        # a line searched this deep is taken at once
+READY_STABLE_UPDATES = 4    # or once its first move survived this many deeper searches
+READY_MAX_SECONDS = 5       # or the deepest line so far, once this much time went by
+READY_POLL_SECONDS = 0.05   # the ceval is read at least this often, so stable_updates counts most depth changes
+
+# One round-trip for everything the ceval shows: depth, evaluation and the first line
+CEVAL_SCRIPT = """
+var pv = document.querySelector(arguments[0]);
+if (!pv || pv.childNodes.length < 3) return null;
+var info = document.querySelector(arguments[1]);
+var depth = info ? /Depth (\\d+)/.exec(info.textContent) : null;
+var evaluation = pv.querySelector('strong');
+return {
+    depth: depth ? parseInt(depth[1], 10) : null,
+    eval: evaluation ? evaluation.textContent.trim() : null,
+    pv: pv.innerText.trim(),
+    san: pv.childNodes[2].innerText,
+    uci: pv.getAttribute('data-uci')
+};
+"""
+
+
+class EngineLine:
+    """ One reading of the analysis engine: depth, evaluation (e.g. '+0.3' or '#-2'), the line's text, its first
+    move in SAN and UCI, and the seconds since the wait started """
+    __slots__ = ("depth", "eval", "pv", "san", "uci", "seconds")
+
+    def __init__(self, depth, evaluation, pv, san, uci, seconds):
+        self.depth = depth
+        self.eval = evaluation
+        self.pv = pv
+        self.san = san
+        self.uci = uci.split()[0] if uci else None
+        self.seconds = seconds
+
+    def first_move(self):
+        """ The move the line starts with, which is what readiness is judged on """
+        return self.uci if self.uci is not None else self.san
+
+    def is_mate(self):
+        return self.eval is not None and self.eval.startswith("#")
+
+    def move(self):
+        """ Return the first move in the get_last_move() layout, or None without a plain UCI move """
+        if self.uci is None or len(self.uci) != 4:
+            return None
+        return ["", key_to_position(self.uci[0:2]), key_to_position(self.uci[2:4])]
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "EngineLine(depth={!r}, eval={!r}, san={!r}, {:.3f}s)".format(self.depth, self.eval, self.san,
+                                                                             self.seconds)
+
+
+class ReadinessPolicy:
+    """ When the engine's current line is good enough to play. Any criterion that is set makes it ready:
+    a depth of min_depth, the same first move for stable_updates deeper lines in a row, or a forced mate.
+    After max_seconds the deepest line so far is taken. With no criterion set, the first line is ready """
+    min_depth = None
+    stable_updates = None
+    max_seconds = None
+    stop_on_mate = True
+
+    def __init__(self, min_depth=READY_MIN_DEPTH, stable_updates=READY_STABLE_UPDATES,
+                 max_seconds=READY_MAX_SECONDS, stop_on_mate=True):
+        self.min_depth = min_depth
+        self.stable_updates = stable_updates
+        self.max_seconds = max_seconds
+        self.stop_on_mate = stop_on_mate
+
+    def is_ready(self, lines):
+        """ Judge the latest of the lines seen so far """
+        line = lines[-1]
+        if self.min_depth is None and self.stable_updates is None:
+            return True
+        if self.stop_on_mate and line.is_mate():
+            return True
+        if self.min_depth is not None and line.depth is not None and line.depth >= self.min_depth:
+            return True
+        if self.stable_updates is not None and len(lines) > self.stable_updates:
+            first_move = line.first_move()
+            return all(earlier.first_move() == first_move for earlier in lines[-self.stable_updates - 1:-1])
+        return False
+
+    def __repr__(self):
+        return "ReadinessPolicy(min_depth={!r}, stable_updates={!r}, max_seconds={!r})".format(
+            self.min_depth, self.stable_updates, self.max_seconds)
+
+
+FIRST_LINE = ReadinessPolicy(None, None)
+
+
+def read_line(driver, pv_css, info_css):
+    """ Return the ceval's current reading as a dictionary, or None while it shows no line """
+    return waits.run_script(driver, CEVAL_SCRIPT, pv_css, info_css)
+
+
+def wait_until_ready(waiter, pv_css, info_css, policy, previous_pv=None, lines=None, on_line=None):
+    """ Poll the ceval until policy is met and return the line it accepted.
+    Lines showing previous_pv (the line of an earlier position) are skipped. Every new reading, a deeper
+    depth or another line, is appended to lines and passed to on_line(line) as it arrives.
+    Raises TimeoutException only when no line at all came within the policy's max_seconds """
+    lines = lines if lines is not None else []
+    start = time.perf_counter()
+
+    def predicate(driver):
+        values = read_line(driver, pv_css, info_css)
+        if values is None or values["pv"] == previous_pv:
+            return False
+        if not lines or (values["depth"], values["pv"]) != (lines[-1].depth, lines[-1].pv):
+            line = EngineLine(values["depth"], values["eval"], values["pv"], values["san"], values["uci"],
+                              time.perf_counter() - start)
+            lines.append(line)
+            if on_line is not None:
+                on_line(line)
+        return policy.is_ready(lines) and lines[-1]
+
+    try:
+        return waiter.until(waits.Condition("engine ready ({})".format(policy), predicate), step="engine_ready",
+                            timeout=policy.max_seconds, max_interval=READY_POLL_SECONDS)
+    except TimeoutException:
+        if not lines:
+            raise
+        # a hard position: its budget is spent, play the deepest line found
+        return max(reversed(lines), key=lambda line: line.depth or 0)
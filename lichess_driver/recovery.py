@@ -0,0 +1,274 @@
+# Lichess.org Testing with Selenium
+# Failures classified and fixed with the cheapest remedy first, the failed puzzle retried a bounded number of times
+
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException, \
+    InvalidSessionIdException, NoSuchWindowException, WebDriverException
+from urllib3.exceptions import HTTPError as TransportError
+from shared_browser import WindowDriver
+import collections
+import time
+
+
+MAX_ATTEMPTS = 3    # tries of one puzzle, the first one included, before it is given up
+
+# Remedies, cheapest first. Each new attempt of a puzzle climbs at least one rung
+RECOVERY_ACTIONS = ("requery", "reload", "resync", "replace")
+
+# The rung each kind of failure starts on
+FIRST_ACTION = {
+    "stale": "requery",         # the page re-rendered under a cached element
+    "missing": "requery",       # an element was looked for too early or under a cached, outdated parent
+    "timeout": "reload",        # the page or the analysis engine stopped answering
+    "dead_session": "replace",  # the browser or chromedriver is gone
+    "other": "reload",
+}
+
+# What chromedriver answers once its browser crashed or was closed
+DEAD_SESSION_MESSAGES = ("invalid session id", "session deleted", "chrome not reachable", "disconnected",
+                         "target window already closed")
+
+
+def classify(error):
+    """ Return the kind of a failure: "stale", "missing", "timeout", "dead_session" or "other" """
+    if isinstance(error, StaleElementReferenceException):
+        return "stale"
+    if isinstance(error, NoSuchElementException):
+        return "missing"
+    if isinstance(error, (InvalidSessionIdException, NoSuchWindowException, TransportError, ConnectionError)):
+        return "dead_session"
+    if isinstance(error, WebDriverException) and any(message in str(error).lower()
+                                                     for message in DEAD_SESSION_MESSAGES):
+        return "dead_session"
+    if isinstance(error, (TimeoutException, TimeoutError)):
+        return "timeout"
+    return "other"
+
+
+def is_alive(driver):
+    """ Whether a session still answers, at the cost of one round-trip """
+    try:
+        driver.current_url
+        return True
+    except (WebDriverException, TransportError, ConnectionError):
+        return False
+
+
+def recycle_session(tester, driver_pool=None, tracer=None, url=None, headless=False, fallback_url=None):
+    """ Swap a tester's browser for a fresh one, e.g. once it died or soak.SoakMonitor found it bloated.
+    The new tester (same class, url and page load profile) is traced under the same name, placed where the
+    old window was and opened on url, by default the page the old one showed, so a run carries on at the
+    same puzzle. A dead session cannot tell its page, fallback_url (or the tester's url) is opened then.
+    With a driver_pool.DriverPool the old session is retired to it and the new one leased from it, without
+    one a new Chrome is started. A window of a shared_browser.SharedBrowser is replaced by a new window of
+    the same browser, the browser itself only once it died """
+    old_driver = tester.driver
+    try:
+        current_url = old_driver.current_url
+        position = old_driver.get_window_position()
+    except (WebDriverException, TransportError, ConnectionError):
+        current_url = None
+        position = None
+    name = tracer.sessions.get(id(old_driver), (None, None))[1] if tracer is not None else None
+    if tracer is not None:
+        tracer.detach(old_driver)
+
+    if isinstance(old_driver, WindowDriver):
+        replacement = type(tester)(driver=old_driver.browser.replace_window(old_driver), page_load=tester.page_load)
+    elif driver_pool is not None:
+        driver_pool.release(old_driver, retire=True)
+        replacement = type(tester)(driver=driver_pool.acquire(), page_load=tester.page_load)
+    else:
+        try:
+            old_driver.quit()
+        except (WebDriverException, TransportError, ConnectionError):
+            pass
+        tester.driver = None    # already quit, keeps WebTester.__del__ from closing it again
+        replacement = type(tester)(headless=headless, page_load=tester.page_load)
+    replacement.url = tester.url
+    if tracer is not None:
+        replacement.enable_tracing(tracer, name)
+    if position is not None:
+        replacement.set_window_position(position["x"], position["y"])
+    replacement.navigate(url or current_url or fallback_url or tester.url)
+    return replacement
+
+
+class RecordCollector:
+    """ Stands in for a ResultWriter: keeps the last record play() writes """
+    record = None
+
+    def write(self, record):
+        self.record = record
+
+
+class Supervisor:
+    """ Keeps a run going through failures. A puzzle is solved by solve(tester, engine, result_writer), e.g.
+
+    supervisor = Supervisor(lichess_website_tester, engine, driver_pool, tracer)
+    record = supervisor.play(lambda tester, engine, writer: play(tester, engine, result_writer=writer), result_writer)
+
+    When solve raises, the failure is classified and fixed with its kind's cheapest remedy:
+    requery    forget the cached elements and board geometry of both testers
+    reload     load the puzzle's page again
+    resync     reload, and restart the engine (engines.EngineBackend.restart) so it is synced from scratch
+    replace    swap dead sessions for new ones (see recycle_session), both when neither is dead
+    then the puzzle is tried again, every new attempt one rung higher, up to max_attempts. A remedy that fails
+    itself gives way to the next one. Only the last attempt's record is written, with its attempts and the
+    remedies used. A puzzle still failing is given up: play returns None, and with skip the tester moves on
+    to /training, where lichess.org hands out another puzzle.
+
+    Sessions replaced are passed to every on_replace listener, listener(name, tester, reason) with name
+    "puzzle" or "engine", so whatever holds the old tester (orchestrator, soak monitor) can follow """
+    tester = None
+    engine = None
+    driver_pool = None
+    tracer = None
+    max_attempts = None
+
+    def __init__(self, lichess_website_tester, engine, driver_pool=None, tracer=None, max_attempts=MAX_ATTEMPTS,
+                 headless=False):
+        self.tester = lichess_website_tester
+        self.engine = engine
+        self.driver_pool = driver_pool
+        self.tracer = tracer
+        self.max_attempts = max_attempts
+        self.headless = headless
+        self.listeners = []
+        self.failures = collections.Counter()
+        self.actions = {action: {"count": 0, "failed": 0, "seconds": 0.0} for action in RECOVERY_ACTIONS + ("skip",)}
+        self.puzzles = {"retried": 0, "recovered": 0, "given_up": 0}
+
+    def on_replace(self, listener):
+        self.listeners.append(listener)
+
+    def engine_tester(self):
+        """ The LichessEngine of a browser engine, None for other backends """
+        return getattr(self.engine, "lichess_engine", None)
+
+    def play(self, solve, result_writer=None, skip=True):
+        """ Solve the puzzle on the page with retries and return solve's record, or None once given up """
+        collector = RecordCollector()
+        remedies = []
+        record = None
+        failure = None
+        rung = -1
+        attempt = 0
+        while attempt < self.max_attempts:
+            attempt += 1
+            try:
+                record = solve(self.tester, self.engine, collector)
+                break
+            except Exception as error:
+                failure = error
+                kind = classify(error)
+                self.failures[kind] += 1
+                if attempt == self.max_attempts:
+                    break
+                rung = min(max(rung + 1, RECOVERY_ACTIONS.index(FIRST_ACTION[kind])), len(RECOVERY_ACTIONS) - 1)
+                rung = self.recover(rung, kind, self.puzzle_url(collector.record))
+                remedies.append(RECOVERY_ACTIONS[rung])
+
+        if attempt > 1:
+            self.puzzles["retried"] += 1
+            self.puzzles["recovered" if record is not None else "given_up"] += 1
+        elif record is None:
+            self.puzzles["given_up"] += 1
+        if record is None and skip:
+            self.run_action("skip", lambda: self.tester.navigate(self.tester.url + "/training"))
+        if result_writer is not None:
+            # a puzzle failing before solve got to write its record still shows up in the results
+            entry = dict(collector.record) if collector.record is not None \
+                else {"puzzle_id": None, "success": False, "error": repr(failure)}
+            entry["attempts"] = attempt
+            entry["recoveries"] = remedies
+            result_writer.write(entry)
+        return record
+
+    def puzzle_url(self, record):
+        """ Where the failed puzzle is played, from its record when it got that far """
+        puzzle_id = record.get("puzzle_id") if record is not None else None
+        return self.tester.url + "/training/" + puzzle_id if puzzle_id else None
+
+    def recover(self, rung, kind, puzzle_url):
+        """ Apply the remedy of a rung, climbing while remedies fail. Returns the rung that worked.
+        A failing replace is raised, nothing is left to try """
+        remedies = (self.requery, self.reload, self.resync, self.replace)
+        while True:
+            action = RECOVERY_ACTIONS[rung]
+            try:
+                self.run_action(action, remedies[rung], puzzle_url, kind)
+                return rung
+            except Exception:
+                if rung == len(RECOVERY_ACTIONS) - 1:
+                    raise
+                rung += 1
+
+    def run_action(self, action, remedy, *args):
+        start = time.perf_counter()
+        try:
+            remedy(*args)
+        except Exception:
+            self.actions[action]["failed"] += 1
+            raise
+        finally:
+            self.actions[action]["count"] += 1
+            self.actions[action]["seconds"] += time.perf_counter() - start
+
+    def requery(self, puzzle_url=None, kind=None):
+        self.tester.on_navigation()
+        if self.engine_tester() is not None:
+            self.engine_tester().on_navigation()
+
+    def reload(self, puzzle_url=None, kind=None):
+        self.tester.navigate(puzzle_url or self.tester.driver.current_url)
+
+    def resync(self, puzzle_url=None, kind=None):
+        self.reload(puzzle_url)
+        self.engine.restart()
+
+    def replace(self, puzzle_url=None, kind=None):
+        """ Replace the dead sessions, or both when neither is dead (the failure went on after a resync) """
+        engine_tester = self.engine_tester()
+        dead = [name for name, tester in (("puzzle", self.tester), ("engine", engine_tester))
+                if tester is not None and not is_alive(tester.driver)]
+        for name in dead or ["puzzle", "engine"]:
+            self.replace_session(name, kind, puzzle_url)
+
+    def replace_session(self, name, reason=None, url=None):
+        """ Swap the "puzzle" or "engine" session for a new one and tell the listeners """
+        if name == "puzzle":
+            self.tester = replacement = recycle_session(self.tester, self.driver_pool, self.tracer, url, self.headless,
+                                                        self.tester.url + "/training")
+        elif self.engine_tester() is not None:
+            self.engine.lichess_engine = replacement = recycle_session(self.engine_tester(), self.driver_pool,
+                                                                       self.tracer, headless=self.headless)
+            replacement.enable_engine()
+        else:
+            self.engine.restart()
+            return
+        for listener in self.listeners:
+            listener(name, replacement, reason)
+
+    def replace_browser(self, browser, reason=None):
+        """ Relaunch a shared_browser.SharedBrowser, e.g. once soak.SoakMonitor found it bloated, and move the
+        testers that were windows of it to windows of the new one. The puzzle tester reopens its page """
+        testers = [(name, tester) for name, tester in (("puzzle", self.tester), ("engine", self.engine_tester()))
+                   if isinstance(getattr(tester, "driver", None), WindowDriver) and tester.driver.browser is browser]
+        urls = dict()
+        for name, tester in testers:
+            try:
+                urls[name] = tester.driver.current_url
+            except (WebDriverException, TransportError, ConnectionError):
+                urls[name] = None
+        browser.relaunch()
+        for name, tester in testers:
+            self.replace_session(name, reason, urls[name])
+
+    def get_stats(self):
+        """ Failures by kind, remedies with their count, failures and cost, and the puzzles retried """
+        return {
+            "failures": dict(self.failures),
+            "actions": {action: dict(values, seconds=round(values["seconds"], 3))
+                        for action, values in self.actions.items() if values["count"]},
+            "puzzles": dict(self.puzzles)
+        }
@@ -0,0 +1,239 @@
+# Lichess.org Testing with Selenium
+# Records the puzzles and pages a run touches into a compact bundle, and serves them back offline
+
+from fixture_server import FixtureServer, FixtureHandler, get_puzzle
+from urllib.parse import urlsplit
+import argparse
+import threading
+import gzip
+import json
+import re
+import os
+
+
+BUNDLE_PATH = "puzzles.replay.jsonl.gz"
+BUNDLE_FORMAT = "lichess-replay"
+BUNDLE_VERSION = 1
+SCRIPT_PATTERN = re.compile(r"<script\b.*?</script>", re.IGNORECASE | re.DOTALL)
+
+
+def strip_scripts(html):
+    """ Drop a page's scripts: the recorded DOM is what the testers need, and without lichess.org's bundles
+    the replayed page neither fetches anything nor changes under them """
+    return SCRIPT_PATTERN.sub("", html)
+
+
+def puzzle_from_record(record, sans):
+    """ Build a fixture puzzle (see fixture_server.PUZZLES) from a solved results.PuzzleRecord and the SAN of
+    every ply in the moves table. The plies before the puzzle start keep only their SAN, the board the
+    puzzle started from becomes its setup """
+    start = len(sans) - len(record.moves) - len(record.replies)
+    snapshot = record.snapshot
+    if not record.success or start < 1 or snapshot is None or len(snapshot.last_move) != 2:
+        return None
+    # chessground lists the destination highlight first
+    last_move = [snapshot.last_move[1], snapshot.last_move[0]]
+    plies = [[san, None, None] for san in sans[:start - 1]]
+    plies.append([sans[start - 1]] + last_move)
+    for index, san in enumerate(sans[start:]):
+        uci = record.moves[index//2] if index % 2 == 0 else record.replies[index//2]
+        plies.append([san, uci[0:2], uci[2:4]])
+    return {
+        "id": record.puzzle_id,
+        "orientation": snapshot.orientation.replace("orientation-", ""),
+        "start": start,
+        "plies": plies,
+        "setup": {"squares": snapshot.squares, "last_move": last_move}
+    }
+
+
+class Bundle:
+    """ The contents of a bundle: fixture puzzles in recording order and page html by url path """
+    header = None
+    puzzles = None
+    pages = None
+
+    def __init__(self, header=None, puzzles=None, pages=None):
+        self.header = header if header is not None else {"format": BUNDLE_FORMAT, "version": BUNDLE_VERSION}
+        self.puzzles = puzzles if puzzles is not None else []
+        self.pages = pages if pages is not None else dict()
+
+    def puzzle_ids(self):
+        return [puzzle["id"] for puzzle in self.puzzles]
+
+
+def load_bundle(path):
+    """ Read a bundle. A puzzle or page recorded twice keeps its latest version """
+    bundle = Bundle()
+    puzzles = dict()
+    with gzip.open(path, "rt", encoding="utf-8") as bundle_file:
+        lines = iter(bundle_file)
+        while True:
+            try:
+                entry = json.loads(next(lines))
+            except StopIteration:
+                break
+            except EOFError:
+                break       # a recording that was killed leaves its last gzip member unfinished
+            except ValueError:
+                continue    # and possibly a cut-off line
+            kind = entry.pop("kind", None)
+            if kind == "header":
+                if entry.get("format") != BUNDLE_FORMAT or entry.get("version", 0) > BUNDLE_VERSION:
+                    raise ValueError("{} is not a version {} replay bundle".format(path, BUNDLE_VERSION))
+                bundle.header = entry
+            elif kind == "puzzle":
+                puzzles[entry["id"]] = entry
+            elif kind == "page":
+                bundle.pages[entry["path"]] = entry["html"]
+    bundle.puzzles = list(puzzles.values())
+    return bundle
+
+
+class BundleRecorder:
+    """ Appends what a run touches to a gzip-compressed JSONL bundle: one line per solved puzzle (its
+    plies, the squares of the moves seen and the board it started from) and one per recorded page.
+    A puzzle costs a few hundred bytes once compressed, so a bundle holds thousands of them.
+
+    with BundleRecorder("puzzles.replay.jsonl.gz") as recorder:
+        record = play(lichess_website_tester, engine, click_continue=False)
+        recorder.record_puzzle(lichess_website_tester, record)
+        lichess_website_tester.click_puzzle_continue()
+
+    scenarios.ScenarioRunner(pool, recorder=recorder) records the page every step of its scenarios ends on.
+    Recording into an existing bundle adds to it, puzzles and pages already in it are not written again """
+    path = None
+    bundle_file = None
+
+    def __init__(self, path=BUNDLE_PATH):
+        self.path = path
+        self.recorded = set()
+        self.puzzles = 0
+        self.pages = 0
+        self.lock = threading.Lock()     # concurrent scenarios record into the same bundle
+
+    def open(self):
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        if exists:
+            bundle = load_bundle(self.path)
+            self.recorded.update(("puzzle", puzzle_id) for puzzle_id in bundle.puzzle_ids())
+            self.recorded.update(("page", path) for path in bundle.pages)
+        # every session appends a gzip member of its own, gzip readers see one stream
+        self.bundle_file = gzip.open(self.path, "at", encoding="utf-8")
+        if not exists:
+            self.write({"kind": "header", "format": BUNDLE_FORMAT, "version": BUNDLE_VERSION})
+        return self
+
+    def write(self, entry):
+        self.bundle_file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def add_puzzle(self, puzzle):
+        """ Write a fixture puzzle. Returns False when it is already in the bundle """
+        with self.lock:
+            if puzzle is None or ("puzzle", puzzle["id"]) in self.recorded:
+                return False
+            self.recorded.add(("puzzle", puzzle["id"]))
+            self.write(dict(puzzle, kind="puzzle"))
+            self.puzzles += 1
+            return True
+
+    def record_puzzle(self, lichess_website_tester, record):
+        """ Record a puzzle play() just solved, before its continue button is clicked. Returns whether it was
+        written: failed puzzles and puzzles without a start position are not """
+        if not record.success:
+            return False
+        if record.puzzle_id is None:
+            record.puzzle_id = lichess_website_tester.get_puzzle_id()
+        if ("puzzle", record.puzzle_id) in self.recorded:
+            return False
+        sans = [move.san for move in lichess_website_tester.get_puzzle_moves(incremental=False)]
+        return self.add_puzzle(puzzle_from_record(record, sans))
+
+    def record_page(self, driver, path=None, origin=None):
+        """ Record the page the driver shows, under its url path unless another path is given, e.g. the
+        target of a navigation a scenario takes. With an origin (e.g. "https://lichess.org") a page of another
+        site, which the replay server could not stand in for, is not recorded """
+        url = driver.current_url
+        if origin is not None and not url.startswith(origin):
+            return False
+        path = path if path is not None else urlsplit(url).path.rstrip("/")
+        with self.lock:
+            if ("page", path) in self.recorded:
+                return False
+            self.recorded.add(("page", path))
+        html = strip_scripts(driver.page_source)
+        with self.lock:
+            self.write({"kind": "page", "path": path, "html": html})
+            self.pages += 1
+        return True
+
+    def close(self):
+        if self.bundle_file is not None:
+            self.bundle_file.close()
+            self.bundle_file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ReplayHandler(FixtureHandler):
+    """ Serves recorded pages as they were captured and everything else like the fixture. The puzzles of the
+    bundle and /analysis are always the fixture's, which plays them and answers their positions """
+
+    def is_fixture_path(self, path):
+        if path in ("/training", "/analysis"):
+            return True
+        return path.startswith("/training/") and get_puzzle(path[len("/training/"):], self.server.puzzles) is not None
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        html = self.server.pages.get(path)
+        if html is None or self.is_fixture_path(path):
+            super().do_GET()
+            return
+        body = html.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ReplayServer(FixtureServer):
+    """ A fixture server for a recorded bundle. Point LichessTester.url and LichessEngine.url at url and
+    the same puzzles replay run after run, with no network:
+
+    with ReplayServer("puzzles.replay.jsonl.gz") as server:
+        lichess_website_tester.url = server.url
+        lichess_engine.url = server.url + "/analysis" """
+    bundle = None
+
+    def __init__(self, bundle, host="127.0.0.1", port=0):
+        self.bundle = load_bundle(bundle) if isinstance(bundle, str) else bundle
+        if not self.bundle.puzzles:
+            raise ValueError("the replay bundle has no puzzles")
+        super().__init__(host, port, self.bundle.puzzles, ReplayHandler)
+        self.server.pages = self.bundle.pages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a recorded replay bundle, or describe it")
+    parser.add_argument("bundle", nargs="?", default=BUNDLE_PATH)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--info", action="store_true", help="print what the bundle holds and exit")
+    arguments = parser.parse_args()
+
+    if arguments.info:
+        bundle = load_bundle(arguments.bundle)
+        size = os.path.getsize(arguments.bundle)
+        print("{:<22}{}".format("puzzles", len(bundle.puzzles)))
+        print("{:<22}{}".format("pages", len(bundle.pages)))
+        print("{:<22}{}".format("bytes", size))
+        print("{:<22}{:.0f}".format("bytes_per_puzzle", size/max(1, len(bundle.puzzles))))
+    else:
+        replay = ReplayServer(arguments.bundle, port=arguments.port)
+        print("Replaying", len(replay.bundle.puzzles), "puzzles on", replay.url)
+        replay.server.serve_forever()
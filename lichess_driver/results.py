@@ -0,0 +1,306 @@
+# Lichess.org Testing with Selenium
+# Per-puzzle result records, an append-only JSONL log written off the solve loop, and a streaming summary of it
+
+from snapshot import position_to_key
+import threading
+import argparse
+import queue
+import json
+import math
+import time
+import uuid
+
+
+RESULTS_PATH = "puzzle_results.jsonl"           # in the working directory, written by main.py and read by default
+STAGES = ("engine", "input", "wait", "read")    # where a puzzle's time goes, see PuzzleRecord.stage
+FLUSH_EVERY = 100                               # records buffered by ResultWriter before it flushes regardless
+QUANTILE_PRECISION = 0.01                       # relative error of the percentiles computed by summarize
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+def move_to_uci(move):
+    """ Convert a move in the get_last_move() layout, [piece, source, destination], to e.g. 'e2e4' """
+    return position_to_key(move[1]) + position_to_key(move[2])
+
+
+class PuzzleRecord:
+    """ What happened while play() solved one puzzle. Time is split into stages:
+    engine (the engine backend), input (clicks on the puzzle board), wait (the puzzle page answering) and
+    read (board, pgn and moves table reads). Every player move also gets its own breakdown """
+    puzzle_id = None
+    pgn = None
+    snapshot = None     # the board the puzzle started from, kept for replay.puzzle_from_record but not logged
+    moves = None
+    replies = None
+    per_move = None
+    success = False
+    error = None
+    retries = 0
+    mismatches = 0      # times the board model disagreed with the DOM, see LichessBoard.check_model
+
+    def __init__(self, puzzle_id=None):
+        self.puzzle_id = puzzle_id
+        self.moves = []
+        self.replies = []
+        self.per_move = []
+        self.totals = dict.fromkeys(STAGES, 0.0)
+        self.marked = dict.fromkeys(STAGES, 0.0)
+        self.started = time.time()
+        self.finished = None
+        self.clock = time.perf_counter()
+        self.seconds = None
+
+    def stage(self, name):
+        """ Time a block of play() against a stage:  with record.stage("engine"): ... """
+        return StageTimer(self.totals, name)
+
+    def mark_move(self, move):
+        """ Close the breakdown of a player move: the stage time spent since the previous move """
+        breakdown = {"move": move_to_uci(move)}
+        for name in STAGES:
+            breakdown[name] = self.totals[name] - self.marked[name]
+        self.marked = dict(self.totals)
+        self.moves.append(breakdown["move"])
+        self.per_move.append(breakdown)
+
+    def mark_reply(self, move):
+        """ Note the puzzle's answer to the last player move """
+        self.replies.append(move_to_uci(move))
+
+    def finish(self, success, error=None):
+        self.success = success
+        self.error = error
+        self.finished = time.time()
+        self.seconds = time.perf_counter() - self.clock
+
+    def as_dict(self):
+        record = {
+            "puzzle_id": self.puzzle_id,
+            "pgn": self.pgn,
+            "moves": self.moves,
+            "replies": self.replies,
+            "success": self.success,
+            "error": self.error,
+            "retries": self.retries,
+            "mismatches": self.mismatches,
+            "started": self.started,
+            "finished": self.finished,
+            "seconds": self.seconds
+        }
+        for name in STAGES:
+            record[name + "_seconds"] = self.totals[name]
+        record["per_move"] = self.per_move
+        return record
+
+
+class StageTimer:
+    """ Context manager adding the time spent in its block to one stage of a PuzzleRecord """
+    __slots__ = ("totals", "name", "start")
+
+    def __init__(self, totals, name):
+        self.totals = totals
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.totals[self.name] += time.perf_counter() - self.start
+        return False
+
+
+class ResultWriter:
+    """ Appends result dictionaries to a JSONL file from a background thread. write() only puts the record
+    on a queue, so the solve loop never waits for the disk. Records are flushed whenever the queue runs
+    empty, so a crashed run loses at most what was still queued.
+
+    writer = ResultWriter("puzzle_results.jsonl").start()
+    writer.write(record.as_dict())
+    writer.stop()
+
+    Every record is stamped with the writer's run id, which lets summarize tell appended runs apart """
+    path = None
+    run = None
+    thread = None
+
+    def __init__(self, path=RESULTS_PATH, run=None):
+        self.path = path
+        self.run = run if run is not None else uuid.uuid4().hex[:12]
+        self.records = queue.SimpleQueue()
+        self.written = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.drain, name="result-writer", daemon=True)
+        self.thread.start()
+        return self
+
+    def write(self, record):
+        record["run"] = self.run
+        self.records.put(record)
+
+    def drain(self):
+        with open(self.path, "a") as results_file:
+            unflushed = 0
+            while True:
+                record = self.records.get()
+                if record is None:
+                    break
+                results_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+                self.written += 1
+                unflushed += 1
+                if unflushed >= FLUSH_EVERY or self.records.empty():
+                    results_file.flush()
+                    unflushed = 0
+
+    def stop(self):
+        """ Write whatever is still queued and close the file """
+        if self.thread is None:
+            return
+        self.records.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class StreamingQuantiles:
+    """ Percentiles of a stream of non-negative values in bounded memory. Values are counted in logarithmic
+    buckets (1 + precision) wide, so a percentile is within precision of the true value whatever the
+    number of samples """
+    __slots__ = ("precision", "log_base", "buckets", "zeros", "count", "total", "min", "max")
+
+    def __init__(self, precision=QUANTILE_PRECISION):
+        self.precision = precision
+        self.log_base = math.log1p(precision)
+        self.buckets = dict()
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if value <= 0:
+            self.zeros += 1
+            return
+        index = math.floor(math.log(value)/self.log_base)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def percentile(self, fraction):
+        if self.count == 0:
+            return 0.0
+        wanted = max(1, math.ceil(fraction*self.count))
+        seen = self.zeros
+        if seen >= wanted:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= wanted:
+                # middle of the bucket, kept inside the range actually seen
+                value = math.exp((index + 0.5)*self.log_base)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def as_dict(self):
+        summary = {"count": self.count, "mean": self.total/self.count if self.count else 0.0}
+        for fraction in PERCENTILES:
+            summary["p{}".format(int(round(fraction*100)))] = self.percentile(fraction)
+        summary["max"] = self.max or 0.0
+        return summary
+
+
+def summarize(paths, run=None):
+    """ Read result files line by line and return the throughput and the percentiles of every stage, per
+    puzzle and per player move. Only counters and quantile buckets are kept, so files of any size fit.
+    run restricts the summary to the records of one ResultWriter run """
+    puzzle_stages = {name: StreamingQuantiles() for name in ("seconds",) + STAGES}
+    move_stages = {name: StreamingQuantiles() for name in STAGES}
+    spans = dict()      # run -> [first start, last finish]
+    puzzles = 0
+    solved = 0
+    retries = 0
+    mismatches = 0
+    skipped = 0
+
+    for path in paths:
+        with open(path) as results_file:
+            for line in results_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    skipped += 1    # e.g. the half-written last line of a run that was killed
+                    continue
+                if run is not None and record.get("run") != run:
+                    continue
+                puzzles += 1
+                solved += 1 if record.get("success") else 0
+                retries += record.get("retries") or 0
+                mismatches += record.get("mismatches") or 0
+                if record.get("seconds") is not None:
+                    puzzle_stages["seconds"].add(record["seconds"])
+                for name in STAGES:
+                    if record.get(name + "_seconds") is not None:
+                        puzzle_stages[name].add(record[name + "_seconds"])
+                for breakdown in record.get("per_move") or ():
+                    for name in STAGES:
+                        move_stages[name].add(breakdown.get(name, 0.0))
+                if record.get("started") is not None and record.get("finished") is not None:
+                    span = spans.get(record.get("run"))
+                    if span is None:
+                        spans[record.get("run")] = [record["started"], record["finished"]]
+                    else:
+                        span[0] = min(span[0], record["started"])
+                        span[1] = max(span[1], record["finished"])
+
+    wall_seconds = sum(span[1] - span[0] for span in spans.values())
+    return {
+        "puzzles": puzzles,
+        "solved": solved,
+        "success_rate": solved/puzzles if puzzles else 0.0,
+        "retries": retries,
+        "mismatches": mismatches,
+        "runs": len(spans),
+        "wall_seconds": wall_seconds,
+        "puzzles_per_minute": 60.0*puzzles/wall_seconds if wall_seconds > 0 else 0.0,
+        "skipped_lines": skipped,
+        "per_puzzle": {name: quantiles.as_dict() for name, quantiles in puzzle_stages.items()},
+        "per_move": {name: quantiles.as_dict() for name, quantiles in move_stages.items()}
+    }
+
+
+def print_summary(summary):
+    for key in ("puzzles", "solved", "success_rate", "retries", "mismatches", "runs", "wall_seconds",
+                "puzzles_per_minute", "skipped_lines"):
+        print("{:<22}{}".format(key, summary[key]))
+    for scope in ("per_puzzle", "per_move"):
+        print()
+        print("{:<22}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}".format(scope + " (ms)", "count", "mean", "p50", "p95",
+                                                                 "p99", "max"))
+        for name, stats in summary[scope].items():
+            print("{:<22}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                name, stats["count"], 1000*stats["mean"], 1000*stats["p50"], 1000*stats["p95"], 1000*stats["p99"],
+                1000*stats["max"]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize puzzle result logs without loading them into memory")
+    parser.add_argument("paths", nargs="*", default=[RESULTS_PATH], help="JSONL files written by ResultWriter")
+    parser.add_argument("--run", default=None, help="only summarize the records of this run id")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    arguments = parser.parse_args()
+
+    summary = summarize(arguments.paths, arguments.run)
+    if arguments.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
@@ -0,0 +1,433 @@
+# Lichess.org Testing with Selenium
+# Runs puzzles on several LichessTester/engine worker pairs in parallel
+
+from main import LichessTester, LichessEngine, play, CHROMEDRIVER_PATH
+from engines import BrowserEngine, UciEngine
+from fixture_server import FixtureServer, PUZZLES
+from position_cache import PositionCache
+from results import ResultWriter
+from replay import BundleRecorder, ReplayServer, puzzle_from_record
+from soak import process_tree_rss
+from recovery import RecordCollector, Supervisor
+from shared_browser import SharedBrowser, ISOLATION_MODES
+import multiprocessing
+import argparse
+import queue
+import time
+import sys
+import os
+
+
+LICHESS_URL = "https://lichess.org"
+DEFAULT_WORKERS = 2
+PUZZLE_TIMEOUT_SECONDS = 120    # a worker stuck on one puzzle for longer is killed and replaced
+MAX_ATTEMPTS = 2                # a puzzle whose worker crashed is handed out again this many times in total
+MAX_CONSECUTIVE_ERRORS = 3      # a worker whose puzzles keep failing assumes its browser is broken and exits
+MAX_CRASHES_WITHOUT_RESULT = 3  # per worker slot; past this the run gives up instead of respawning forever
+POLL_SECONDS = 0.5
+
+
+class WorkerLimits:
+    """ Per-worker resource caps """
+    cpus = None
+    nice = None
+    max_puzzles = None
+    max_memory_mb = None
+
+    def __init__(self, cpus=None, nice=None, max_puzzles=None, max_memory_mb=None):
+        """
+        :param cpus: list of cpu indices the worker (and the browsers it starts) may run on
+        :param nice: niceness added to the worker process
+        :param max_puzzles: the worker exits after this many puzzles and is replaced by a fresh one
+        :param max_memory_mb: the worker exits once it and its browsers use more resident memory than this
+        """
+        self.cpus = cpus
+        self.nice = nice
+        self.max_puzzles = max_puzzles
+        self.max_memory_mb = max_memory_mb
+
+    def apply(self):
+        """ Apply the caps to the current process. Browsers started afterwards inherit them """
+        if self.cpus and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.cpus)
+        if self.nice and hasattr(os, "nice"):
+            os.nice(self.nice)
+
+    def exhausted(self, puzzles_done):
+        """ Return True when the worker should hand its slot to a fresh process """
+        if self.max_puzzles is not None and puzzles_done >= self.max_puzzles:
+            return True
+        if self.max_memory_mb is not None:
+            rss = process_tree_rss(os.getpid())
+            if rss is not None and rss > self.max_memory_mb*1024*1024:
+                return True
+        return False
+
+
+def make_engine(engine_backend, base_url, headless=False, shared_browser=None):
+    """ Build the engine backend a worker solves puzzles with, in a window of shared_browser if given """
+    if engine_backend == "uci":
+        return UciEngine()
+    if shared_browser is not None:
+        lichess_engine = LichessEngine(driver=shared_browser.open_window("engine"))
+    else:
+        lichess_engine = LichessEngine(headless=headless)
+    lichess_engine.url = base_url + "/analysis"
+    return BrowserEngine(lichess_engine)
+
+
+def worker_main(worker_id, base_url, engine_backend, headless, limits, task_queue, result_queue,
+                position_cache_path=None, trace_directory=None, record_replay=False, shared_browser=None):
+    """ Worker process: solve the puzzles the parent hands out until it sends None.
+    Workers given the same position_cache_path share one sqlite position cache. With a trace_directory
+    each worker writes its WebDriver command trace there when it exits. With record_replay every solved
+    puzzle's replay entry (see replay.puzzle_from_record) goes back with its result. With shared_browser
+    ("window" or "context") the worker's puzzle and engine testers are two windows of one Chrome """
+    limits.apply()
+    position_cache = PositionCache(position_cache_path) if position_cache_path else None
+    browser = SharedBrowser(isolation=shared_browser, headless=headless, executable_path=CHROMEDRIVER_PATH) \
+        if shared_browser else None
+    if browser is not None:
+        lichess_website_tester = LichessTester(driver=browser.open_window("puzzle"))
+    else:
+        lichess_website_tester = LichessTester(headless=headless)
+    lichess_website_tester.url = base_url
+    engine = make_engine(engine_backend, base_url, headless, browser)
+    tracer = None
+    if trace_directory:
+        tracer = lichess_website_tester.enable_tracing(name="puzzle")
+        if isinstance(engine, BrowserEngine):
+            engine.lichess_engine.enable_tracing(tracer, "engine")
+    engine.open()
+
+    # a glitch is retried on the same browsers, a dead one is replaced without restarting the worker
+    supervisor = Supervisor(lichess_website_tester, engine, tracer=tracer, headless=headless)
+
+    def solve(tester, engine, writer):
+        tester.open_puzzle(puzzle_id)
+        return play(tester, engine, click_continue=False, position_cache=position_cache, result_writer=writer,
+                    puzzle_id=puzzle_id)
+
+    puzzles_done = 0
+    consecutive_errors = 0
+    exit_code = 0
+    result_queue.put(("ready", worker_id, None))
+    while True:
+        puzzle_id = task_queue.get()
+        if puzzle_id is None:
+            break
+
+        start = time.perf_counter()
+        error = None
+        cache_before = position_cache.get_stats() if position_cache else None
+        collector = RecordCollector()
+        replay_entry = None
+        try:
+            record = supervisor.play(solve, collector, skip=False)
+            lichess_website_tester = supervisor.tester
+            success = record is not None and lichess_website_tester.puzzle_success()
+            if record is None:
+                error = collector.record.get("error") if collector.record is not None else "given up"
+            elif record_replay and record.success:
+                sans = [move.san for move in lichess_website_tester.get_puzzle_moves(incremental=False)]
+                replay_entry = puzzle_from_record(record, sans)
+        except Exception as exception:
+            success = False
+            error = repr(exception)
+        seconds = time.perf_counter() - start
+        cache_after = position_cache.get_stats() if position_cache else None
+        result = collector.record if collector.record is not None else dict()
+        result.update({
+            "puzzle_id": puzzle_id,
+            "worker": worker_id,
+            "success": success,
+            "seconds": seconds,
+            "error": error,
+            "cache_hits": cache_after["hits"] - cache_before["hits"] if position_cache else 0,
+            "cache_misses": cache_after["misses"] - cache_before["misses"] if position_cache else 0
+        })
+        if replay_entry is not None:
+            result["replay"] = replay_entry
+        result_queue.put(("result", worker_id, result))
+
+        puzzles_done += 1
+        consecutive_errors = consecutive_errors + 1 if error else 0
+        if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+            exit_code = 1
+            break
+        if limits.exhausted(puzzles_done):
+            break
+        result_queue.put(("ready", worker_id, None))
+
+    if tracer is not None:
+        tracer.export_json(os.path.join(trace_directory, "trace-summary-worker{}.json".format(worker_id)))
+        tracer.export_chrome_trace(os.path.join(trace_directory, "trace-worker{}.json".format(worker_id)))
+    try:
+        engine.close()
+        if position_cache is not None:
+            position_cache.close()
+        supervisor.tester.driver.quit()
+        if browser is not None:
+            browser.close()
+    except Exception:
+        pass
+    sys.exit(exit_code)
+
+
+class RunSummary:
+    """ Aggregated results of a PuzzleRunner run """
+    results = None
+    crashes = None
+    retries = None
+    seconds = None
+
+    def __init__(self, results, crashes, retries, seconds):
+        self.results = results
+        self.crashes = crashes
+        self.retries = retries
+        self.seconds = seconds
+
+    def solved(self):
+        return sum(1 for result in self.results if result["success"])
+
+    def failed(self):
+        return len(self.results) - self.solved()
+
+    def throughput(self):
+        """ Puzzles finished per minute of wall time """
+        return 60.0*len(self.results)/self.seconds if self.seconds > 0 else 0.0
+
+    def as_dict(self):
+        solve_times = [result["seconds"] for result in self.results]
+        cache_hits = sum(result.get("cache_hits", 0) for result in self.results)
+        cache_lookups = cache_hits + sum(result.get("cache_misses", 0) for result in self.results)
+        return {
+            "puzzles": len(self.results),
+            "solved": self.solved(),
+            "failed": self.failed(),
+            "worker_crashes": self.crashes,
+            "retries": self.retries,
+            "wall_seconds": self.seconds,
+            "puzzles_per_minute": self.throughput(),
+            "mean_puzzle_seconds": sum(solve_times)/len(solve_times) if solve_times else 0.0,
+            "position_cache_hit_rate": cache_hits/cache_lookups if cache_lookups else 0.0
+        }
+
+
+class PuzzleRunner:
+    """ Feeds puzzles from one shared queue to N worker processes, each with its own LichessTester and
+    engine. A worker that crashes or hangs is replaced and its puzzle handed out again """
+    workers = None
+    base_url = None
+    engine_backend = None
+    headless = None
+    limits = None
+    puzzle_timeout = None
+    max_attempts = None
+    position_cache_path = None
+    trace_directory = None
+    results_path = None
+    record_path = None
+    shared_browser = None
+
+    def __init__(self, workers=DEFAULT_WORKERS, base_url=LICHESS_URL, engine_backend="browser", limits=None,
+                 puzzle_timeout=PUZZLE_TIMEOUT_SECONDS, max_attempts=MAX_ATTEMPTS, headless=False,
+                 position_cache_path=None, trace_directory=None, results_path=None, record_path=None,
+                 shared_browser=None):
+        """ With a results_path, every puzzle's record is appended to that JSONL file as soon as it
+        arrives (see results.summarize). With a record_path, the solved puzzles are recorded into that
+        replay bundle (see replay.BundleRecorder). With shared_browser ("window" or "context") each worker
+        runs its pair in one Chrome instead of two, see shared_browser.SharedBrowser """
+        self.workers = workers
+        self.base_url = base_url
+        self.engine_backend = engine_backend
+        self.headless = headless
+        self.limits = limits if limits is not None else WorkerLimits()
+        self.puzzle_timeout = puzzle_timeout
+        self.max_attempts = max_attempts
+        self.position_cache_path = position_cache_path
+        self.trace_directory = trace_directory
+        self.results_path = results_path
+        self.record_path = record_path
+        self.shared_browser = shared_browser
+        self.context = multiprocessing.get_context("spawn")
+
+    def worker_limits(self, worker_id):
+        """ Give each worker its own slice of the cpus when the caps list some """
+        if not self.limits.cpus:
+            return self.limits
+        cpus_per_worker = max(1, len(self.limits.cpus)//self.workers)
+        first = (worker_id*cpus_per_worker) % len(self.limits.cpus)
+        return WorkerLimits(self.limits.cpus[first:first + cpus_per_worker], self.limits.nice,
+                            self.limits.max_puzzles, self.limits.max_memory_mb)
+
+    def start_worker(self, worker_id, result_queue):
+        task_queue = self.context.Queue()
+        process = self.context.Process(target=worker_main, daemon=True, args=(
+            worker_id, self.base_url, self.engine_backend, self.headless, self.worker_limits(worker_id), task_queue,
+            result_queue, self.position_cache_path, self.trace_directory, self.record_path is not None,
+            self.shared_browser))
+        process.start()
+        return {"process": process, "tasks": task_queue, "puzzle": None, "started": None, "idle": False}
+
+    def run(self, puzzle_ids):
+        """ Solve every puzzle id and return a RunSummary """
+        start = time.perf_counter()
+        pending = list(puzzle_ids)
+        pending.reverse()       # pop() from the end hands puzzles out in their original order
+        attempts = dict()
+        results = []
+        result_writer = ResultWriter(self.results_path).start() if self.results_path else None
+        recorder = BundleRecorder(self.record_path).open() if self.record_path else None
+
+        def finish(result):
+            replay_entry = result.pop("replay", None)
+            if recorder is not None and replay_entry is not None:
+                recorder.add_puzzle(replay_entry)
+            results.append(result)
+            if result_writer is not None:
+                result_writer.write(result)
+
+        crashes = 0
+        crashes_since_result = 0
+        retries = 0
+        remaining = len(pending)
+
+        result_queue = self.context.Queue()
+        workers = dict()
+        next_worker_id = 0
+        for _ in range(min(self.workers, remaining)):
+            workers[next_worker_id] = self.start_worker(next_worker_id, result_queue)
+            next_worker_id += 1
+
+        while remaining > 0:
+            try:
+                kind, worker_id, payload = result_queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                kind = None
+
+            if kind == "ready" and worker_id in workers:
+                workers[worker_id]["idle"] = True
+            elif kind == "result" and worker_id in workers:
+                workers[worker_id]["puzzle"] = None
+                finish(payload)
+                remaining -= 1
+                crashes_since_result = 0
+
+            # replace workers that died, hung or retired, handing their puzzle out again
+            for dead_id in list(workers):
+                worker = workers[dead_id]
+                hung = worker["puzzle"] is not None and \
+                    time.perf_counter() - worker["started"] > self.puzzle_timeout
+                if worker["process"].is_alive() and not hung:
+                    continue
+                if hung:
+                    worker["process"].terminate()
+                worker["process"].join()
+                del workers[dead_id]
+
+                if worker["puzzle"] is not None or worker["process"].exitcode != 0:
+                    crashes += 1
+                    crashes_since_result += 1
+                puzzle_id = worker["puzzle"]
+                if puzzle_id is not None:
+                    if attempts[puzzle_id] < self.max_attempts:
+                        pending.append(puzzle_id)
+                        retries += 1
+                    else:
+                        finish({"puzzle_id": puzzle_id, "worker": dead_id, "success": False,
+                                "seconds": time.perf_counter() - worker["started"],
+                                "error": "worker crashed"})
+                        remaining -= 1
+                if pending and len(workers) < self.workers:
+                    workers[next_worker_id] = self.start_worker(next_worker_id, result_queue)
+                    next_worker_id += 1
+
+            # hand the shared queue's next puzzles to idle workers
+            for worker in workers.values():
+                if worker["idle"] and pending:
+                    worker["idle"] = False
+                    worker["puzzle"] = pending.pop()
+                    worker["started"] = time.perf_counter()
+                    attempts[worker["puzzle"]] = attempts.get(worker["puzzle"], 0) + 1
+                    worker["tasks"].put(worker["puzzle"])
+
+            if crashes_since_result > self.workers*MAX_CRASHES_WITHOUT_RESULT:
+                # browsers cannot even start, fail what is left rather than respawning forever
+                for puzzle_id in reversed(pending):
+                    finish({"puzzle_id": puzzle_id, "worker": None, "success": False,
+                            "seconds": 0.0, "error": "no worker could start"})
+                remaining -= len(pending)
+                pending = []
+                if not workers:
+                    break
+
+        for worker in workers.values():
+            worker["tasks"].put(None)
+        for worker in workers.values():
+            worker["process"].join(timeout=10)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+
+        if result_writer is not None:
+            result_writer.stop()
+        if recorder is not None:
+            recorder.close()
+        return RunSummary(results, crashes, retries, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Solve puzzles on several browser workers in parallel")
+    parser.add_argument("ids", nargs="*", help="puzzle ids to solve (defaults to the fixture puzzles)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--count", type=int, default=None, help="cycle through the ids until this many puzzles ran")
+    parser.add_argument("--fixture", action="store_true", help="run against the local fixture server")
+    parser.add_argument("--url", default=LICHESS_URL)
+    parser.add_argument("--engine", choices=("browser", "uci"), default="browser")
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--cpus", type=int, nargs="*", default=None, help="cpu indices shared out between workers")
+    parser.add_argument("--nice", type=int, default=None)
+    parser.add_argument("--max-puzzles", type=int, default=None, help="recycle a worker after this many puzzles")
+    parser.add_argument("--max-memory-mb", type=int, default=None, help="recycle a worker above this resident memory")
+    parser.add_argument("--timeout", type=float, default=PUZZLE_TIMEOUT_SECONDS)
+    parser.add_argument("--shared-browser", choices=ISOLATION_MODES, default=None,
+                        help="run each worker's puzzle and engine testers as windows of one browser")
+    parser.add_argument("--position-cache", default=None, metavar="PATH",
+                        help="sqlite file of best moves shared by the workers (e.g. position_cache.sqlite)")
+    parser.add_argument("--trace", default=None, metavar="DIRECTORY",
+                        help="write each worker's WebDriver command trace and latency histograms here")
+    parser.add_argument("--results", default=None, metavar="PATH",
+                        help="append one JSONL record per puzzle here (summarize with results.py)")
+    parser.add_argument("--record", default=None, metavar="BUNDLE",
+                        help="record the solved puzzles into this replay bundle (e.g. puzzles.replay.jsonl.gz)")
+    parser.add_argument("--replay", default=None, metavar="BUNDLE",
+                        help="solve the puzzles of a recorded bundle offline (defaults the ids to all of them)")
+    arguments = parser.parse_args()
+
+    fixture = None
+    base_url = arguments.url
+    default_ids = [puzzle["id"] for puzzle in PUZZLES]
+    if arguments.replay:
+        fixture = ReplayServer(arguments.replay).start()
+        base_url = fixture.url
+        default_ids = fixture.bundle.puzzle_ids()
+    elif arguments.fixture:
+        fixture = FixtureServer().start()
+        base_url = fixture.url
+
+    puzzle_ids = arguments.ids or default_ids
+    if arguments.count:
+        puzzle_ids = [puzzle_ids[index % len(puzzle_ids)] for index in range(arguments.count)]
+
+    runner = PuzzleRunner(arguments.workers, base_url, arguments.engine,
+                          WorkerLimits(arguments.cpus, arguments.nice, arguments.max_puzzles, arguments.max_memory_mb),
+                          arguments.timeout, headless=arguments.headless,
+                          position_cache_path=arguments.position_cache, trace_directory=arguments.trace,
+                          results_path=arguments.results, record_path=arguments.record,
+                          shared_browser=arguments.shared_browser)
+    summary = runner.run(puzzle_ids)
+    for key, value in summary.as_dict().items():
+        print("{:<22}{}".format(key, value))
+
+    if fixture is not None:
+        fixture.stop()
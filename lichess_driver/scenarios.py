@@ -0,0 +1,364 @@
+# Lichess.org Testing with Selenium
+# Named scenarios of LichessTester/LichessEngine steps, run concurrently over a DriverPool and sharded across machines
+
+from main import LichessTester, LichessEngine, play, CHROMEDRIVER_PATH
+from engines import BrowserEngine, UciEngine
+from driver_pool import DriverPool
+from fixture_server import FixtureServer
+from page_load import SCENARIO_PROFILES
+from results import ResultWriter
+from replay import BundleRecorder
+from auth_sessions import SessionStore
+from selenium.webdriver.common.by import By
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import threading
+import time
+import os
+import waits
+
+
+LICHESS_URL = "https://lichess.org"
+SCENARIO_RESULTS_PATH = "scenario_results.jsonl"   # one record per scenario run, its steps' timings included
+SUPER_PUZZLES_COUNT = 3     # puzzles the super_puzzles scenario solves
+SIGNIN_USERNAME = os.environ.get("LICHESS_USERNAME", "Throwawayy123")
+SIGNIN_PASSWORD = os.environ.get("LICHESS_PASSWORD", "123456")
+SESSION_STORE = SessionStore()  # signed-in sessions shared by the scenarios, their threads and other runs
+
+XPATH = LichessTester.xpath
+
+# The swag shop is on another site. A navigation Chrome refused (e.g. blocked by a page load profile) shows its
+# error page under the url that was asked for, so the url alone does not tell the shop loaded
+SHOP_LOADED = waits.url_contains("spreadshirt") & ~waits.element_located(By.CSS_SELECTOR, "body.neterror")
+
+
+class ScenarioFailed(Exception):
+    """ A step ran but its outcome is wrong, e.g. a puzzle that was not solved """
+    pass
+
+
+class Step:
+    """ One action of a scenario and the condition telling it is done, in place of a fixed sleep.
+    action(session) drives the session's testers; ready, a waits.Condition, is then polled on the tester's
+    page under the budget of the named waits.STEP_TIMEOUTS step """
+    name = None
+    action = None
+    ready = None
+    step = None
+
+    def __init__(self, name, action, ready=None, step="page_ready"):
+        self.name = name
+        self.action = action
+        self.ready = ready
+        self.step = step
+
+
+class Scenario:
+    """ A named sequence of steps. With engine set, the session also gets an engine to solve puzzles with,
+    which costs a second browser session with the browser backend """
+    name = None
+    steps = None
+    engine = False
+    page_load = None
+    description = None
+
+    def __init__(self, name, steps, engine=False, page_load=None, description=None):
+        self.name = name
+        self.steps = steps
+        self.engine = engine
+        self.page_load = page_load
+        self.description = description
+
+    def sessions(self, engine_backend):
+        """ Number of browser sessions the scenario leases """
+        return 2 if self.engine and engine_backend == "browser" else 1
+
+
+class ScenarioSession:
+    """ What a scenario's steps act on: its LichessTester, the engine when the scenario asked for one, and a
+    dictionary the steps can pass values through """
+    tester = None
+    engine = None
+    state = None
+
+    def __init__(self, tester, engine=None):
+        self.tester = tester
+        self.engine = engine
+        self.state = dict()
+
+
+SCENARIOS = dict()
+
+
+def register(scenario):
+    """ Add a scenario to the registry under its name. Registration order is the order of a full pass """
+    SCENARIOS[scenario.name] = scenario
+    return scenario
+
+
+def select_scenarios(names=None, shard_index=0, shard_count=1):
+    """ Return the scenarios named (every registered one by default) that belong to one shard: the
+    scenario at position i of the selection runs on shard i % shard_count """
+    names = list(names) if names else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise KeyError("Unknown scenarios: {}".format(", ".join(unknown)))
+    if not 0 <= shard_index < shard_count:
+        raise ValueError("Shard index {} is not in 0..{}".format(shard_index, shard_count - 1))
+    return [SCENARIOS[name] for position, name in enumerate(names) if position % shard_count == shard_index]
+
+
+# The steps of the scenarios main.py used to run one at a time
+def solve_puzzle(session):
+    record = play(session.tester, session.engine, click_continue=True)
+    if not record.success:
+        raise ScenarioFailed("puzzle {} was not solved: {}".format(record.puzzle_id, record.error))
+
+
+register(Scenario("super_puzzles", [
+    Step("open home", lambda session: session.tester.open_website(), waits.element_present(XPATH["puzzles"])),
+    Step("open puzzles", lambda session: session.tester.click_puzzles(), waits.url_contains("/training")),
+    Step("open engine", lambda session: session.engine.open()),
+] + [Step("solve puzzle {}".format(index + 1), solve_puzzle) for index in range(SUPER_PUZZLES_COUNT)],
+    engine=True, page_load=SCENARIO_PROFILES["puzzles"],
+    description="solve puzzles with the engine, continuing from one to the next"))
+
+register(Scenario("spotlight", [
+    Step("open home", lambda session: session.tester.open_website(), waits.element_present(XPATH["spotlight1"])),
+    Step("open tournament", lambda session: session.tester.click(XPATH["spotlight1"]),
+         waits.url_contains("/tournament/")),
+    Step("open description", lambda session: session.tester.click_spotlight_info()),
+    Step("back home", lambda session: session.tester.click_home(), waits.element_present(XPATH["spotlight1"])),
+], page_load=SCENARIO_PROFILES["spotlight"], description="open a spotlighted tournament and its description"))
+
+register(Scenario("watch_library", [
+    Step("open home", lambda session: session.tester.open_website(), waits.element_present(XPATH["watch"])),
+    Step("open video library", lambda session: session.tester.click_watch_video_library(),
+         waits.element_present(XPATH["beginner"])),
+    Step("open beginner", lambda session: session.tester.click_beginner(),
+         waits.element_present(XPATH["beginner_video1"])),
+    Step("open video", lambda session: session.tester.click_beginner_video(1),
+         waits.element_present(XPATH["video_player"])),
+    Step("play video", lambda session: session.tester.click_video_player()),
+    Step("pause video", lambda session: session.tester.click_video_player()),
+    Step("back home", lambda session: session.tester.click_home(), waits.element_present(XPATH["watch"])),
+], page_load=SCENARIO_PROFILES["watch"], description="browse the video library and play a video"))
+
+register(Scenario("puzzles", [
+    Step("open home", lambda session: session.tester.open_website(), waits.element_present(XPATH["puzzles"])),
+    Step("open puzzles", lambda session: session.tester.click_puzzles(), waits.url_contains("/training")),
+    Step("open dashboard", lambda session: session.tester.click_puzzles_dashboard(),
+         waits.url_contains("/training/dashboard")),
+    Step("open streak", lambda session: session.tester.click_puzzles_streak(), waits.url_contains("/streak")),
+    Step("open storm", lambda session: session.tester.click_puzzles_storm(), waits.url_contains("/storm")),
+    Step("open racer", lambda session: session.tester.click_puzzles_racer(), waits.url_contains("/racer")),
+    Step("search", lambda session: session.tester.search("Hello, world!")),
+], page_load=SCENARIO_PROFILES["puzzles"], description="visit every puzzle mode, then search"))
+
+register(Scenario("signin_signout", [
+    Step("open home", lambda session: session.tester.open_website(), waits.element_present(XPATH["signin"])),
+    Step("open sign in", lambda session: session.tester.click_signin_button(),
+         waits.element_present(XPATH["username_email_form"])),
+    Step("sign in", lambda session: session.tester.fill_signin_form(SIGNIN_USERNAME, SIGNIN_PASSWORD),
+         waits.element_present(XPATH["signedin"]), step="sign_in"),
+    Step("sign out", lambda session: session.tester.click_signout(), waits.element_present(XPATH["signin"])),
+], page_load=SCENARIO_PROFILES["signin"], description="sign in through the form and sign out"))
+
+# Signing out ends the session on the site, so scenarios that only need an account start from the stored one
+register(Scenario("preferences", [
+    Step("sign in", lambda session: session.tester.sign_in(SIGNIN_USERNAME, SIGNIN_PASSWORD, SESSION_STORE),
+         waits.element_present(XPATH["signedin"])),
+    Step("open preferences", lambda session: session.tester.click_preferences(),
+         waits.element_present(XPATH["kid_mode"])),
+    Step("open kid mode", lambda session: session.tester.click_kid_mode(),
+         waits.element_present(XPATH["kid_mode_pwform"])),
+    Step("switch kid mode", lambda session: session.tester.switch_kid_mode(SIGNIN_PASSWORD)),
+], page_load=SCENARIO_PROFILES["signin"], description="start signed in from the session store and switch kid mode"))
+
+register(Scenario("community", [
+    Step("open home", lambda session: session.tester.open_website(), waits.element_present(XPATH["community"])),
+    Step("open forum", lambda session: session.tester.click_forum(), waits.url_contains("/forum")),
+    Step("open blog", lambda session: session.tester.click_blog(), waits.url_contains("/blog")),
+    Step("back home", lambda session: session.tester.click_home(), waits.element_present(XPATH["swag"])),
+    Step("open swag", lambda session: session.tester.click_swag(), SHOP_LOADED),
+], page_load=SCENARIO_PROFILES["community"], description="visit the forum, the blog and the swag shop"))
+
+
+class ScenarioRunner:
+    """ Runs scenarios concurrently, each on sessions leased from one DriverPool, so a full pass takes about as
+    long as its slowest scenario. Every step is timed; one record per scenario goes to results_path.
+
+    with DriverPool(size=4, executable_path=CHROMEDRIVER_PATH).start() as pool:
+        results = ScenarioRunner(pool).run(select_scenarios(shard_index=0, shard_count=2))
+
+    A scenario leases all of its sessions at once, so scenarios needing two never hold one each while
+    waiting for the other; the pool only has to be as large as the largest scenario. With a recorder
+    (replay.BundleRecorder) the page each step ends on is recorded, once per url path, for replays """
+    pool = None
+    base_url = None
+    engine_backend = None
+    workers = None
+    results_path = None
+    recorder = None
+
+    def __init__(self, pool, base_url=LICHESS_URL, engine_backend="browser", workers=None, results_path=None,
+                 recorder=None):
+        self.pool = pool
+        self.base_url = base_url
+        self.engine_backend = engine_backend
+        self.workers = workers
+        self.results_path = results_path
+        self.recorder = recorder
+        self.lease_lock = threading.Lock()
+
+    def lease(self, count):
+        drivers = []
+        with self.lease_lock:
+            try:
+                while len(drivers) < count:
+                    drivers.append(self.pool.acquire())
+            except Exception:
+                for driver in drivers:
+                    self.pool.release(driver)
+                raise
+        return drivers
+
+    def open_session(self, scenario, drivers):
+        tester = LichessTester(driver=drivers[0], page_load=scenario.page_load)
+        tester.url = self.base_url
+        engine = None
+        if scenario.engine:
+            if self.engine_backend == "uci":
+                engine = UciEngine()
+            else:
+                lichess_engine = LichessEngine(driver=drivers[1], page_load=scenario.page_load)
+                lichess_engine.url = self.base_url + "/analysis"
+                engine = BrowserEngine(lichess_engine)
+        return ScenarioSession(tester, engine)
+
+    def run_scenario(self, scenario, shard=None):
+        """ Run one scenario's steps in order, stopping at the first that fails. Returns its result record """
+        result = {"scenario": scenario.name, "shard": shard, "success": False, "seconds": 0.0, "error": None,
+                  "steps": []}
+        start = time.perf_counter()
+        drivers = self.lease(scenario.sessions(self.engine_backend))
+        session = None
+        try:
+            session = self.open_session(scenario, drivers)
+            for step in scenario.steps:
+                step_start = time.perf_counter()
+                error = None
+                try:
+                    step.action(session)
+                    if step.ready is not None:
+                        session.tester.wait_until(step.ready, step=step.step)
+                    if self.recorder is not None:
+                        self.recorder.record_page(session.tester.driver, origin=self.base_url)
+                except Exception as exception:
+                    error = "{}: {}".format(type(exception).__name__, str(exception).replace("Message: ", "").strip())
+                result["steps"].append({"step": step.name, "seconds": time.perf_counter() - step_start,
+                                        "success": error is None, "error": error})
+                if error is not None:
+                    result["error"] = "{}: {}".format(step.name, error)
+                    break
+            else:
+                result["success"] = True
+        except Exception as exception:
+            result["error"] = repr(exception)
+        finally:
+            if session is not None and session.engine is not None:
+                try:
+                    session.engine.close()
+                except Exception:
+                    pass
+            for driver in drivers:
+                self.pool.release(driver)
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+    def run(self, scenarios, shard=None):
+        """ Run the scenarios, as many at once as there are workers (all of them by default), and return
+        their result records in the order given """
+        if not scenarios:
+            return []
+        result_writer = ResultWriter(self.results_path).start() if self.results_path else None
+
+        def run_one(scenario):
+            result = self.run_scenario(scenario, shard)
+            if result_writer is not None:
+                result_writer.write(dict(result))
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.workers or len(scenarios), thread_name_prefix="scenario") as executor:
+            results = list(executor.map(run_one, scenarios))
+        if result_writer is not None:
+            result_writer.stop()
+        return results
+
+
+def print_results(results, seconds=None):
+    """ Print every scenario's steps with their timings, then the pass as a whole """
+    for result in results:
+        print("{:<18}{:>10.2f}s  {}".format(result["scenario"], result["seconds"],
+                                           "ok" if result["success"] else "FAILED " + str(result["error"])))
+        for step in result["steps"]:
+            print("    {:<24}{:>10.1f} ms{}".format(step["step"], 1000*step["seconds"],
+                                                  "" if step["success"] else "  failed"))
+    passed = sum(1 for result in results if result["success"])
+    line = "{} of {} scenarios passed".format(passed, len(results))
+    if seconds is not None:
+        slowest = max([result["seconds"] for result in results] + [0.0])
+        total = sum(result["seconds"] for result in results)
+        line += " in {:.2f}s (slowest scenario {:.2f}s, sum of scenarios {:.2f}s)".format(seconds, slowest, total)
+    print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run registered scenarios concurrently over a pool of browser sessions")
+    parser.add_argument("names", nargs="*", help="scenarios to run (defaults to every registered one)")
+    parser.add_argument("--list", action="store_true", help="list the registered scenarios and exit")
+    parser.add_argument("--shard", default="0/1", metavar="INDEX/COUNT",
+                        help="run only this machine's share of the scenarios, e.g. 1/3")
+    parser.add_argument("--workers", type=int, default=None, help="scenarios run at once (defaults to all)")
+    parser.add_argument("--engine", choices=("browser", "uci"), default="browser")
+    parser.add_argument("--fixture", action="store_true", help="run against the local fixture server")
+    parser.add_argument("--url", default=LICHESS_URL)
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--chromedriver", default=CHROMEDRIVER_PATH)
+    parser.add_argument("--results", default=SCENARIO_RESULTS_PATH, metavar="PATH",
+                        help="append one JSONL record per scenario here")
+    parser.add_argument("--record", default=None, metavar="PATH",
+                        help="record the pages the steps end on into this replay bundle")
+    arguments = parser.parse_args()
+
+    if arguments.list:
+        for scenario in SCENARIOS.values():
+            print("{:<18}{:>3} steps  {}".format(scenario.name, len(scenario.steps), scenario.description or ""))
+        raise SystemExit(0)
+
+    shard_index, shard_count = (int(part) for part in arguments.shard.split("/"))
+    selected = select_scenarios(arguments.names, shard_index, shard_count)
+    workers = arguments.workers or len(selected)
+
+    fixture = FixtureServer().start() if arguments.fixture else None
+    base_url = fixture.url if fixture is not None else arguments.url
+
+    # enough sessions for the scenarios that run at once; their profiles agree on the load strategy
+    sessions = sorted((scenario.sessions(arguments.engine) for scenario in selected), reverse=True)
+    strategies = {scenario.page_load.strategy for scenario in selected if scenario.page_load is not None}
+    pool = DriverPool(size=max(1, sum(sessions[:workers])), headless=arguments.headless,
+                      executable_path=arguments.chromedriver,
+                      page_load_strategy=strategies.pop() if len(strategies) == 1 else None)
+    recorder = BundleRecorder(arguments.record).open() if arguments.record else None
+    start = time.perf_counter()
+    with pool.start():
+        results = ScenarioRunner(pool, base_url, arguments.engine, workers, arguments.results, recorder).run(
+            selected, shard=arguments.shard)
+    print_results(results, time.perf_counter() - start)
+    if recorder is not None:
+        recorder.close()
+        print("Recorded:", recorder.pages, "pages into", arguments.record)
+
+    if fixture is not None:
+        fixture.stop()
+    raise SystemExit(0 if all(result["success"] for result in results) else 1)
@@ -0,0 +1,273 @@
+# Lichess.org Testing with Selenium
+# Several testers as windows, or isolated browser contexts, of one Chrome instead of a Chrome each
+
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.switch_to import SwitchTo
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from urllib3.exceptions import HTTPError as TransportError
+from driver_pool import chrome_options, launch_driver
+from soak import process_tree_rss, driver_pid, megabytes
+import inspect
+import threading
+import time
+
+
+ISOLATION_MODES = ("window", "context")
+LONG_POLL_MS = 25           # board event drains of a shared window wait this long at most, they hold up every window
+CONTEXT_WAIT_SECONDS = 5    # how long chromedriver may take to list the window of a new browser context
+
+# Keep the windows behind the front one running at full speed: their pages animate and answer like the front one's
+SHARED_BROWSER_ARGUMENTS = [
+    "--disable-background-timer-throttling",
+    "--disable-backgrounding-occluded-windows",
+    "--disable-renderer-backgrounding",
+]
+
+
+def adopt(value, window):
+    """ Hand the elements of a response to the window they were found in, so their own commands switch to it """
+    if isinstance(value, WebElement):
+        value._parent = window
+    elif isinstance(value, list):
+        for item in value:
+            adopt(item, window)
+    elif isinstance(value, dict):
+        for item in value.values():
+            adopt(item, window)
+    return value
+
+
+class WindowDriver:
+    """ One window of a SharedBrowser, usable wherever a WebDriver is: LichessTester(driver=window).
+    Its commands go to its own window, switching the browser to it first when needed. window_handles only
+    lists this window and the tabs it opened, close() and quit() close it and leave the browser running """
+    browser = None
+    handle = None
+    name = None
+    context = None
+
+    def __init__(self, browser, handle, name=None, context=None):
+        self.browser = browser
+        self.handle = handle
+        self.name = name
+        self.context = context
+        self.handles = [handle]
+
+    def __getattr__(self, name):
+        # the shared session's WebDriver API, bound to this window so every command comes through execute below
+        if self.browser is None:
+            raise AttributeError(name)
+        attribute = inspect.getattr_static(type(self.browser.driver), name, None)
+        if hasattr(attribute, "__get__"):
+            return attribute.__get__(self, type(self))
+        return getattr(self.browser.driver, name)
+
+    def execute(self, driver_command, params=None):
+        if driver_command in (Command.CLOSE, Command.QUIT):
+            self.browser.close_window(self)
+            return {"value": None}
+        return self.browser.run(self, driver_command, params)
+
+    @property
+    def switch_to(self):
+        return SwitchTo(self)
+
+    @property
+    def window_handles(self):
+        """ This window and the tabs it opened, not the other testers' windows """
+        handles = self.execute(Command.W3C_GET_WINDOW_HANDLES)["value"]
+        others = set(self.browser.windows) - set(self.handles)
+        self.handles = [handle for handle in handles if handle not in others]
+        return list(self.handles)
+
+
+class SharedBrowser:
+    """ One Chrome session whose windows are handed out to testers, so a puzzle/engine pair, or several,
+    costs one browser process tree instead of one per tester.
+
+    browser = SharedBrowser(isolation="context", driver_pool=driver_pool)
+    lichess_website_tester = LichessTester(driver=browser.open_window("puzzle"))
+    lichess_engine = LichessEngine(driver=browser.open_window("engine"))
+
+    Each tester keeps its own board, locator cache and waits. The session has one current window though, so
+    the windows take turns: one command at a time goes through, and the browser switches window whenever a
+    command comes from another window than the previous one. That switch is the cost of sharing, one extra
+    round-trip per change of window, counted in get_stats with the commands it was paid on: about two per
+    move for testers driven in turn (main.play), up to one per command for concurrent sides
+    (orchestrator.Orchestrator). A wait inside the page holds up every window, so board events are drained
+    in LONG_POLL_MS slices.
+
+    isolation "window" opens plain windows, which share cookies and storage. "context" gives every window
+    but the session's first one a browser context of its own (Target.createBrowserContext), like a separate
+    profile, so sign-ins and storage stay apart. Without a driver the browser is leased from driver_pool,
+    or launched with SHARED_BROWSER_ARGUMENTS """
+    driver = None
+    isolation = None
+    driver_pool = None
+    windows = None
+    current = None
+    spare = None
+
+    def __init__(self, driver=None, isolation="window", driver_pool=None, headless=False, page_load_strategy=None,
+                 executable_path=None):
+        if isolation not in ISOLATION_MODES:
+            raise ValueError("isolation must be one of " + ", ".join(ISOLATION_MODES))
+        self.isolation = isolation
+        self.driver_pool = driver_pool
+        self.headless = headless
+        self.page_load_strategy = page_load_strategy
+        self.executable_path = executable_path
+        self.owns_driver = driver is None
+        self.driver = driver if driver is not None else self.launch()
+        self.lock = threading.RLock()
+        self.windows = dict()
+        self.current = self.spare = self.driver.current_window_handle
+        self.stats = {"opened": 0, "contexts": 0, "commands": 0, "switches": 0, "command_seconds": 0.0,
+                      "switch_seconds": 0.0, "relaunches": 0}
+
+    def launch(self):
+        if self.driver_pool is not None:
+            return self.driver_pool.acquire()
+        options = chrome_options(self.headless, page_load_strategy=self.page_load_strategy,
+                                 arguments=SHARED_BROWSER_ARGUMENTS)
+        return launch_driver(self.executable_path, options)
+
+    def open_window(self, name=None):
+        """ Return a WindowDriver of a new window, or of the session's first one while no tester has it """
+        with self.lock:
+            context = None
+            if self.spare is not None:
+                handle = self.spare
+                self.spare = None
+            elif self.isolation == "context":
+                handle, context = self.open_context_window()
+            else:
+                handle = self.driver.execute(Command.NEW_WINDOW, {"type": "window"})["value"]["handle"]
+            window = WindowDriver(self, handle, name, context)
+            self.windows[handle] = window
+            self.stats["opened"] += 1
+            return window
+
+    def open_context_window(self):
+        """ Create a browser context with a window of its own. Returns (window handle, context id) """
+        context = self.driver.execute_cdp_cmd("Target.createBrowserContext", {})["browserContextId"]
+        target = self.driver.execute_cdp_cmd("Target.createTarget", {"url": "about:blank", "browserContextId": context,
+                                                                     "newWindow": True})["targetId"]
+        # chromedriver names a window after its DevTools target, and lists it once it has attached to it
+        deadline = time.perf_counter() + CONTEXT_WAIT_SECONDS
+        while target not in self.driver.window_handles:
+            if time.perf_counter() > deadline:
+                raise TimeoutException("The window of browser context {} did not show up".format(context))
+            time.sleep(0.05)
+        self.stats["contexts"] += 1
+        return target, context
+
+    def run(self, window, driver_command, params=None):
+        """ Send a command of a window, switching to the window first if another one is current """
+        with self.lock:
+            if self.current != window.handle:
+                self.switch(window.handle)
+            start = time.perf_counter()
+            try:
+                response = self.driver.execute(driver_command, params)
+            finally:
+                self.stats["commands"] += 1
+                self.stats["command_seconds"] += time.perf_counter() - start
+            if driver_command == Command.SWITCH_TO_WINDOW:
+                # the tester moved to a tab of its own, its commands go there from now on
+                self.windows.pop(window.handle, None)
+                window.handle = self.current = params["handle"]
+                self.windows[window.handle] = window
+            return adopt(response, window)
+
+    def switch(self, handle):
+        start = time.perf_counter()
+        self.driver.execute(Command.SWITCH_TO_WINDOW, {"handle": handle})
+        self.current = handle
+        self.stats["switches"] += 1
+        self.stats["switch_seconds"] += time.perf_counter() - start
+
+    def close_window(self, window):
+        """ Close a tester's window and dispose of its browser context. The session's last window is kept,
+        blank, for the next tester: closing it would end the session """
+        with self.lock:
+            self.windows.pop(window.handle, None)
+            if not self.windows and self.spare is None:
+                self.run(window, Command.GET, {"url": "about:blank"})
+                self.spare = window.handle
+                return
+            if self.current != window.handle:
+                self.switch(window.handle)
+            self.driver.execute(Command.CLOSE)
+            self.current = None
+            self.switch(next(iter(self.windows)) if self.windows else self.spare)
+            if window.context is not None:
+                self.driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": window.context})
+
+    def replace_window(self, window):
+        """ Return a new window in place of a broken one, for recovery.recycle_session. A browser that died
+        is relaunched first; the other windows it had are then dead too and are replaced in turn """
+        with self.lock:
+            if not self.is_alive():
+                self.relaunch()
+            elif window.handle in self.windows:
+                try:
+                    self.close_window(window)
+                except WebDriverException:
+                    self.windows.pop(window.handle, None)
+            return self.open_window(window.name)
+
+    def is_alive(self):
+        try:
+            self.driver.window_handles
+            return True
+        except (WebDriverException, TransportError, ConnectionError):
+            return False
+
+    def relaunch(self):
+        """ Swap a dead or bloated session for a new one, the old one retired to the driver_pool or quit.
+        Every window is gone with it, recovery.Supervisor.replace_browser moves the testers to new ones """
+        if self.driver_pool is not None:
+            self.driver_pool.release(self.driver, retire=True)
+        else:
+            try:
+                self.driver.quit()
+            except (WebDriverException, TransportError, ConnectionError):
+                pass
+        self.driver = self.launch()
+        self.owns_driver = True
+        self.windows = dict()
+        self.current = self.spare = self.driver.current_window_handle
+        self.stats["relaunches"] += 1
+
+    def close(self):
+        """ Give the session back to its driver_pool, or quit it if this browser launched it """
+        if self.driver_pool is not None:
+            self.driver_pool.release(self.driver)
+        elif self.owns_driver:
+            self.driver.quit()
+
+    def get_stats(self):
+        """ Windows, switches and what they cost next to the commands themselves, and the resident memory of
+        the browser overall and per window (a puzzle/engine pair is two) """
+        with self.lock:
+            stats = dict(self.stats)
+            windows = len(self.windows)
+        pid = driver_pid(self.driver)
+        rss = megabytes(process_tree_rss(pid)) if pid is not None else None
+        return {
+            "isolation": self.isolation,
+            "windows": windows,
+            "opened": stats["opened"],
+            "contexts": stats["contexts"],
+            "relaunches": stats["relaunches"],
+            "commands": stats["commands"],
+            "switches": stats["switches"],
+            "switches_per_command": stats["switches"]/stats["commands"] if stats["commands"] else 0.0,
+            "mean_switch_ms": 1000*stats["switch_seconds"]/stats["switches"] if stats["switches"] else 0.0,
+            "switch_share": stats["switch_seconds"]/(stats["switch_seconds"] + stats["command_seconds"])
+            if stats["commands"] else 0.0,
+            "rss_mb": rss,
+            "rss_mb_per_window": rss/windows if rss is not None and windows else None
+        }
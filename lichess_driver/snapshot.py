@@ -0,0 +1,162 @@
+# Lichess.org Testing with Selenium
+# Compact copies of a cg-board read in a single WebDriver round-trip
+
+EMPTY = '.'
+NUM_FILES = 8
+NUM_RANKS = 8
+
+# Reads every piece and highlight of a cg-board in one execute_script call.
+# arguments[0] is the cg-board css selector, arguments[1] the cg-wrap (orientation) selector
+SNAPSHOT_SCRIPT = """
+var board = document.querySelector(arguments[0]);
+if (!board) return null;
+var wrap = document.querySelector(arguments[1]);
+var roles = {pawn: 'p', knight: 'n', bishop: 'b', rook: 'r', queen: 'q', king: 'k'};
+var squares = [];
+for (var i = 0; i < 64; i++) squares.push('.');
+var lastMove = [];
+for (var i = 0; i < board.children.length; i++) {
+    var node = board.children[i];
+    if (node.className === 'last-move') {
+        lastMove.push(node.cgKey);
+    } else if (node.localName === 'piece' && node.cgKey) {
+        if (node.classList.contains('ghost') || node.classList.contains('fading')) continue;
+        var code = null;
+        for (var role in roles) {
+            if (node.classList.contains(role)) code = roles[role];
+        }
+        if (code === null) continue;
+        var index = (node.cgKey.charCodeAt(0) - 97) + 8*(parseInt(node.cgKey.slice(1)) - 1);
+        squares[index] = node.classList.contains('white') ? code.toUpperCase() : code;
+    }
+}
+var orientation = 'fail';
+if (wrap && wrap.classList.contains('orientation-white')) orientation = 'orientation-white';
+if (wrap && wrap.classList.contains('orientation-black')) orientation = 'orientation-black';
+return {squares: squares.join(''), lastMove: lastMove, orientation: orientation};
+"""
+
+
+def square_index(key):
+    """ Convert a cgKey such as 'e4' to its index in BoardSnapshot.squares (a1 = 0, h8 = 63) """
+    return (ord(key[0]) - ord('a')) + NUM_FILES*(int(key[1:]) - 1)
+
+
+def square_key(index):
+    """ Convert an index of BoardSnapshot.squares back to its cgKey """
+    return chr(ord('a') + index % NUM_FILES) + str(index//NUM_FILES + 1)
+
+
+def key_to_position(key):
+    """ Convert a cgKey such as 'e4' to the [file, rank] tuple make_move expects, e.g. ('e', 4) """
+    return (key[0], int(key[1:]))
+
+
+def position_to_key(position):
+    """ Convert a [file, rank] position such as ('e', 4) back to its cgKey """
+    return position[0] + str(position[1])
+
+
+class BoardSnapshot:
+    """ Immutable copy of a cg-board. The 64 squares are stored as one string of FEN piece letters
+    ('P' white pawn, 'n' black knight, ...) with '.' for empty squares """
+    __slots__ = ("squares", "last_move", "orientation")
+
+    def __init__(self, squares, last_move, orientation):
+        self.squares = squares
+        self.last_move = tuple(last_move)
+        self.orientation = orientation
+
+    @classmethod
+    def read(cls, driver, board_css, orientation_css):
+        """ Read a snapshot of the board in a single execute_script call. Returns None if there is no board """
+        result = driver.execute_script(SNAPSHOT_SCRIPT, board_css, orientation_css)
+        if result is None:
+            return None
+        return cls(result["squares"], result["lastMove"], result["orientation"])
+
+    @classmethod
+    def empty(cls):
+        """ A snapshot of a board with no pieces, no highlights and no orientation """
+        return cls(EMPTY*(NUM_FILES*NUM_RANKS), (), "fail")
+
+    def piece_at(self, key):
+        """ Return the piece letter on a square, or None if it is empty """
+        code = self.squares[square_index(key)]
+        return None if code == EMPTY else code
+
+    def pieces(self):
+        """ Return a dictionary mapping cgKey to piece letter for every occupied square """
+        return {square_key(index): code for index, code in enumerate(self.squares) if code != EMPTY}
+
+    def to_state(self):
+        """ Return the snapshot in the LichessBoard.state layout: cgKeys map to piece letters and
+        'last-move0'/'last-move1' map to the highlighted cgKeys in DOM order """
+        state = dict()
+        for index, key in enumerate(self.last_move):
+            state["last-move" + str(index)] = key
+        state.update(self.pieces())
+        return state
+
+    def __eq__(self, other):
+        return isinstance(other, BoardSnapshot) and self.squares == other.squares \
+            and self.last_move == other.last_move and self.orientation == other.orientation
+
+    def __hash__(self):
+        return hash((self.squares, self.last_move, self.orientation))
+
+    def __repr__(self):
+        return "BoardSnapshot({!r}, {!r}, {!r})".format(self.squares, self.last_move, self.orientation)
+
+
+def fen_castling(squares):
+    """ Guess castling rights from kings and rooks still standing on their home squares """
+    rights = ""
+    if squares[square_index("e1")] == 'K':
+        if squares[square_index("h1")] == 'R':
+            rights += "K"
+        if squares[square_index("a1")] == 'R':
+            rights += "Q"
+    if squares[square_index("e8")] == 'k':
+        if squares[square_index("h8")] == 'r':
+            rights += "k"
+        if squares[square_index("a8")] == 'r':
+            rights += "q"
+    return rights if rights else "-"
+
+
+def fen_en_passant(squares, last_move):
+    """ Return the en passant target square if the last move was a pawn's double step """
+    if len(last_move) != 2:
+        return "-"
+    for start, end in (last_move, last_move[::-1]):
+        if start[0] != end[0] or abs(int(start[1:]) - int(end[1:])) != 2:
+            continue
+        piece = squares[square_index(end)]
+        if piece in ('P', 'p') and squares[square_index(start)] == EMPTY:
+            return start[0] + str((int(start[1:]) + int(end[1:]))//2)
+    return "-"
+
+
+def snapshot_to_fen(snapshot, white_to_move):
+    """ Build a FEN string from a snapshot. The board does not show move counters, and castling rights
+    and the en passant square are inferred from the position, which is exact for every puzzle start
+    except those where a king or rook has left and returned to its home square """
+    rows = []
+    for rank in range(NUM_RANKS - 1, -1, -1):
+        row = ""
+        empty = 0
+        for file in range(NUM_FILES):
+            code = snapshot.squares[file + NUM_FILES*rank]
+            if code == EMPTY:
+                empty += 1
+                continue
+            if empty:
+                row += str(empty)
+                empty = 0
+            row += code
+        if empty:
+            row += str(empty)
+        rows.append(row)
+    return "{} {} {} {} 0 1".format("/".join(rows), "w" if white_to_move else "b",
+                                    fen_castling(snapshot.squares), fen_en_passant(snapshot.squares, snapshot.last_move))
@@ -0,0 +1,293 @@
+# Lichess.org Testing with Selenium
+# Long soak runs: browser, page and Python memory sampled every few puzzles, sessions recycled past thresholds
+
+import gc
+import json
+import time
+import os
+
+
+SOAK_SAMPLE_EVERY = 25              # puzzles between two memory samples
+SOAK_TIMELINE_PATH = "soak_timeline.jsonl"  # one line per sample: python soak.py soak_timeline.jsonl to summarize
+MAX_BROWSER_MB = 1500               # a session's chromedriver and Chrome processes together
+MAX_JS_HEAP_MB = 256                # the page's used JS heap
+MAX_DOM_NODES = 60000               # DOM nodes alive in the page, detached ones included
+MAX_SESSION_PUZZLES = 2000          # a session is recycled after this many puzzles whatever its memory
+SLOWDOWN_RATIO = 1.5                # or when the last SPEED_WINDOW puzzles took this much longer than the first ones
+SPEED_WINDOW = 50
+
+# DevTools Performance metrics kept in a sample, and the names they are kept under
+PAGE_METRICS = {
+    "JSHeapUsedSize": "js_heap_bytes",
+    "JSHeapTotalSize": "js_heap_total_bytes",
+    "Nodes": "dom_nodes",
+    "Documents": "documents",
+    "JSEventListeners": "listeners",
+}
+
+
+def process_tree_rss(pid):
+    """ Return the resident memory in bytes of a process and all of its descendants (Linux /proc only).
+    Returns None where /proc is not available """
+    if not os.path.isdir("/proc"):
+        return None
+    children = dict()
+    rss = dict()
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry)) as stat_file:
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))     # fields[1] is the parent pid
+        rss[int(entry)] = int(fields[21])*page_size                      # fields[21] is rss in pages
+
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total
+
+
+def process_rss(pid):
+    """ Return the resident memory in bytes of one process (Linux /proc only), or None """
+    try:
+        with open("/proc/{}/statm".format(pid)) as statm_file:
+            return int(statm_file.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def driver_pid(driver):
+    """ The chromedriver process of a session, whose descendants are its Chrome processes, or None """
+    service = getattr(driver, "service", None)
+    process = getattr(service, "process", None)
+    return getattr(process, "pid", None)
+
+
+def read_page_metrics(driver):
+    """ Read the page's heap, DOM and listener counts in one DevTools round-trip (Performance.enable must
+    have been sent once on the session). Metrics the browser did not report are None """
+    response = driver.execute_cdp_cmd("Performance.getMetrics", {}) or dict()
+    values = {metric["name"]: metric["value"] for metric in response.get("metrics", ())}
+    return {name: values.get(metric) for metric, name in PAGE_METRICS.items()}
+
+
+def megabytes(value):
+    return None if value is None else value/(1024*1024)
+
+
+class SoakThresholds:
+    """ When a session is recycled. A threshold set to None is not checked """
+    max_browser_mb = None
+    max_js_heap_mb = None
+    max_dom_nodes = None
+    max_session_puzzles = None
+    slowdown_ratio = None
+
+    def __init__(self, max_browser_mb=MAX_BROWSER_MB, max_js_heap_mb=MAX_JS_HEAP_MB, max_dom_nodes=MAX_DOM_NODES,
+                 max_session_puzzles=MAX_SESSION_PUZZLES, slowdown_ratio=SLOWDOWN_RATIO):
+        self.max_browser_mb = max_browser_mb
+        self.max_js_heap_mb = max_js_heap_mb
+        self.max_dom_nodes = max_dom_nodes
+        self.max_session_puzzles = max_session_puzzles
+        self.slowdown_ratio = slowdown_ratio
+
+    def exceeded(self, session):
+        """ Return why a session's sample crosses a threshold, or None """
+        checks = (
+            ("browser_mb", self.max_browser_mb, session.get("browser_mb")),
+            ("js_heap_mb", self.max_js_heap_mb, session.get("js_heap_mb")),
+            ("dom_nodes", self.max_dom_nodes, session.get("dom_nodes")),
+            ("puzzles", self.max_session_puzzles, session.get("puzzles")),
+        )
+        for name, limit, value in checks:
+            if limit is not None and value is not None and value >= limit:
+                return "{} {:.0f} >= {}".format(name, value, limit)
+        return None
+
+
+class SoakMonitor:
+    """ Follows a long run puzzle by puzzle and samples its memory every sample_every puzzles: per session the
+    chromedriver + Chrome resident memory, the page's JS heap, DOM nodes and listeners, and for the run the
+    Python process's resident memory and live object count. Every sample is a line of the timeline.
+
+    monitor = SoakMonitor()
+    monitor.attach("puzzle", lichess_website_tester.driver)
+    ...
+    monitor.puzzle_done(record.seconds)
+    if monitor.due():
+        for name, reason in monitor.sample().items():
+            ... replace the session, then monitor.attach(name, new_driver, reason)
+
+    sample() returns the sessions to recycle with the reason. A slowdown recycles every session, at most
+    once per SPEED_WINDOW puzzles, since it cannot be pinned on one of them.
+
+    Testers sharing a browser (shared_browser.SharedBrowser) are windows of one process tree: the browser is
+    attached with attach_browser("browser", shared_browser) and its memory sampled once, against
+    max_browser_mb, while its windows only report their page's heap and nodes. A browser over its limits is
+    returned by name to be relaunched as a whole, its windows then go with it """
+    thresholds = None
+    sample_every = None
+    timeline_path = None
+
+    def __init__(self, thresholds=None, sample_every=SOAK_SAMPLE_EVERY, timeline_path=SOAK_TIMELINE_PATH):
+        self.thresholds = thresholds if thresholds is not None else SoakThresholds()
+        self.sample_every = sample_every
+        self.timeline_path = timeline_path
+        self.sessions = dict()
+        self.browsers = dict()
+        self.puzzles = 0
+        self.recycles = 0
+        self.first_window = []
+        self.last_window = []
+        self.speed_recycled_at = 0
+        self.start = time.perf_counter()
+        self.timeline_file = open(timeline_path, "a") if timeline_path else None
+
+    def attach(self, name, driver, reason=None):
+        """ Follow a session, a new one or the replacement of a recycled one """
+        if name in self.sessions:
+            self.recycles += 1
+            self.write({"event": "recycled", "session": name, "puzzle": self.puzzles, "reason": reason,
+                        "after_puzzles": self.sessions[name]["puzzles"]})
+        try:
+            driver.execute_cdp_cmd("Performance.enable", {})
+        except Exception:
+            pass    # a session without DevTools still gets its process memory sampled
+        self.sessions[name] = {"driver": driver, "puzzles": 0}
+
+    def attach_browser(self, name, browser, reason=None):
+        """ Follow a shared browser, a new one or one relaunched after a recycle """
+        if name in self.browsers:
+            self.recycles += 1
+            self.write({"event": "recycled", "session": name, "puzzle": self.puzzles, "reason": reason,
+                        "after_puzzles": self.browsers[name]["puzzles"]})
+        self.browsers[name] = {"browser": browser, "puzzles": 0}
+
+    def puzzle_done(self, seconds=None):
+        self.puzzles += 1
+        for session in list(self.sessions.values()) + list(self.browsers.values()):
+            session["puzzles"] += 1
+        if seconds is None:
+            return
+        if len(self.first_window) < SPEED_WINDOW:
+            self.first_window.append(seconds)
+        self.last_window.append(seconds)
+        if len(self.last_window) > SPEED_WINDOW:
+            del self.last_window[0]
+
+    def due(self):
+        return self.sample_every and self.puzzles % self.sample_every == 0
+
+    def slowdown(self):
+        """ The last window's mean puzzle time over the first window's, or None before both are full """
+        if len(self.first_window) < SPEED_WINDOW or len(self.last_window) < SPEED_WINDOW:
+            return None
+        first = sum(self.first_window)/len(self.first_window)
+        return sum(self.last_window)/len(self.last_window)/first if first > 0 else None
+
+    def sample_session(self, session, shared_pids=()):
+        """ A window of a shared browser (its pid in shared_pids) leaves browser_mb to the browser's sample """
+        driver = session["driver"]
+        pid = driver_pid(driver)
+        values = {"browser_mb": megabytes(process_tree_rss(pid)) if pid is not None and pid not in shared_pids
+                  else None,
+                  "puzzles": session["puzzles"]}
+        try:
+            metrics = read_page_metrics(driver)
+        except Exception:
+            metrics = {name: None for name in PAGE_METRICS.values()}
+        values.update(metrics)
+        values["js_heap_mb"] = megabytes(metrics["js_heap_bytes"])
+        return values
+
+    def sample_browser(self, entry):
+        pid = driver_pid(entry["browser"].driver)
+        return {"browser_mb": megabytes(process_tree_rss(pid)) if pid is not None else None,
+                "puzzles": entry["puzzles"], "windows": len(entry["browser"].windows)}
+
+    def sample(self):
+        """ Take a sample, write it to the timeline and return {session or browser name: reason} for what
+        has to be recycled """
+        browser_pids = {name: driver_pid(entry["browser"].driver) for name, entry in self.browsers.items()}
+        shared_pids = {pid for pid in browser_pids.values() if pid is not None}
+        sample = {
+            "event": "sample",
+            "puzzle": self.puzzles,
+            "seconds": time.perf_counter() - self.start,
+            "python_mb": megabytes(process_rss(os.getpid())),
+            "python_objects": len(gc.get_objects()),
+            "slowdown": self.slowdown(),
+            "sessions": {name: self.sample_session(session, shared_pids)
+                         for name, session in self.sessions.items()},
+            "browsers": {name: self.sample_browser(entry) for name, entry in self.browsers.items()}
+        }
+        self.write(sample)
+
+        recycle = dict()
+        for name, values in list(sample["sessions"].items()) + list(sample["browsers"].items()):
+            reason = self.thresholds.exceeded(values)
+            if reason is not None:
+                recycle[name] = reason
+        slowdown = sample["slowdown"]
+        if self.thresholds.slowdown_ratio is not None and slowdown is not None \
+                and slowdown >= self.thresholds.slowdown_ratio and self.puzzles - self.speed_recycled_at >= SPEED_WINDOW:
+            self.speed_recycled_at = self.puzzles
+            self.last_window = []
+            for name in list(self.sessions) + list(self.browsers):
+                recycle.setdefault(name, "slowdown {:.2f}x".format(slowdown))
+
+        # the windows of a browser about to be relaunched are replaced along with it
+        relaunched = {browser_pids[name] for name in recycle if name in self.browsers} - {None}
+        for name, session in self.sessions.items():
+            if name in recycle and driver_pid(session["driver"]) in relaunched:
+                del recycle[name]
+        return recycle
+
+    def write(self, entry):
+        if self.timeline_file is not None:
+            self.timeline_file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self.timeline_file.flush()
+
+    def close(self):
+        if self.timeline_file is not None:
+            self.timeline_file.close()
+            self.timeline_file = None
+
+    def get_stats(self):
+        return {"puzzles": self.puzzles, "recycles": self.recycles, "slowdown": self.slowdown()}
+
+
+def summarize_timeline(path):
+    """ Print a timeline's samples as a table, recycles in between """
+    print("{:>8}{:>10}{:>12}{:>12}  {}".format("puzzle", "minutes", "python MB", "objects", "sessions: browser MB / "
+                                                                                         "heap MB / nodes"))
+    with open(path) as timeline_file:
+        for line in timeline_file:
+            entry = json.loads(line)
+            if entry["event"] == "recycled":
+                print("{:>8}  recycled {} after {} puzzles: {}".format(entry["puzzle"], entry["session"],
+                                                                       entry["after_puzzles"], entry["reason"]))
+                continue
+            sessions = "  ".join("{} {} / {} / {}".format(
+                name, *("-" if values[key] is None else "{:.0f}".format(values[key])
+                        for key in ("browser_mb", "js_heap_mb", "dom_nodes")))
+                for name, values in entry["sessions"].items())
+            for name, values in entry.get("browsers", dict()).items():
+                sessions += "  {} {}".format(name, "-" if values["browser_mb"] is None
+                                             else "{:.0f}".format(values["browser_mb"]))
+            print("{:>8}{:>10.1f}{:>12}{:>12}  {}".format(
+                entry["puzzle"], entry["seconds"]/60,
+                "-" if entry["python_mb"] is None else "{:.0f}".format(entry["python_mb"]),
+                entry["python_objects"], sessions))
+
+
+if __name__ == '__main__':
+    import sys
+    summarize_timeline(sys.argv[1] if len(sys.argv) > 1 else SOAK_TIMELINE_PATH)
@@ -0,0 +1,269 @@
+# Lichess.org Testing with Selenium
+# Records every WebDriver command with its caller, duration and payload size, and exports the aggregates
+
+from collections import deque
+import threading
+import json
+import time
+import sys
+import os
+
+
+TESTER_FILES = ("main.py", "engines.py")    # callers are looked for in these modules
+MAX_EVENTS = 100000                         # raw events kept for the trace file, older ones are dropped
+RECENT_LATENCIES = 1000                     # latest samples a Latencies keeps for its percentiles
+# Upper bounds (ms) of the latency histogram buckets, the last bucket holds everything slower
+BUCKET_BOUNDS_MS = (0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+# Generic WebTester plumbing. A command issued through one of these is attributed to the method that called it
+GENERIC_CALLERS = {
+    "use", "use_css", "find", "wait_until", "wait_for", "hover", "hover_element", "hover_offset", "click",
+    "click_element", "click_element_offset", "click_offset", "press_key", "check_exists_by_xpath",
+    "get_cg_board", "get_cached_cg_board", "get_geometry", "click_squares", "gesture", "<lambda>", "best_move"
+}
+
+
+def element_reference(value):
+    """ JSON stand-in for objects the wire protocol sends as references, e.g. WebElements """
+    return {"element-6066-11e4-a52e-4f735466cecf": getattr(value, "id", "")}
+
+
+def payload_size(value):
+    """ Return the size in bytes of a command's parameters or response as they would travel as JSON """
+    if value is None:
+        return 0
+    try:
+        return len(json.dumps(value, default=element_reference))
+    except (TypeError, ValueError):
+        return 0
+
+
+class Histogram:
+    """ Latency distribution of one command or caller in BUCKET_BOUNDS_MS buckets """
+    __slots__ = ("count", "total", "max", "buckets", "request_bytes", "response_bytes", "errors")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0]*(len(BUCKET_BOUNDS_MS) + 1)
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.errors = 0
+
+    def add(self, milliseconds, request_bytes, response_bytes, error):
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+        index = 0
+        while index < len(BUCKET_BOUNDS_MS) and milliseconds > BUCKET_BOUNDS_MS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+        if error:
+            self.errors += 1
+
+    def percentile(self, fraction):
+        """ Return the upper bound of the bucket holding the given fraction of the samples """
+        if self.count == 0:
+            return 0.0
+        wanted = fraction*self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted:
+                return BUCKET_BOUNDS_MS[index] if index < len(BUCKET_BOUNDS_MS) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total,
+            "mean_ms": self.total/self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": self.max,
+            "buckets": {("<=" + str(bound)): count for bound, count in zip(BUCKET_BOUNDS_MS, self.buckets)},
+            "slower": self.buckets[-1],
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "errors": self.errors
+        }
+
+
+class Latencies:
+    """ Latencies in seconds of something done over and over, e.g. board moves: a running count, sum and maximum,
+    the first `window` samples, and the latest RECENT_LATENCIES for the percentiles. A session of any length
+    keeps the same number of samples """
+    __slots__ = ("count", "total", "max", "window", "first", "recent")
+
+    def __init__(self, window=50):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.window = window
+        self.first = []
+        self.recent = deque(maxlen=max(window, RECENT_LATENCIES))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.first) < self.window:
+            self.first.append(seconds)
+        self.recent.append(seconds)
+
+    def mean(self):
+        return self.total/self.count if self.count else 0.0
+
+    def first_mean(self):
+        """ Mean of the first `window` samples """
+        return sum(self.first)/len(self.first) if self.first else 0.0
+
+    def last_mean(self):
+        """ Mean of the latest `window` samples """
+        last = list(self.recent)[-self.window:]
+        return sum(last)/len(last) if last else 0.0
+
+    def percentile(self, fraction):
+        """ Return the recent sample below which the given fraction of the recent samples lie """
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(fraction*len(ordered)))]
+
+
+class CommandTracer:
+    """ Wraps the execute method of one or more sessions. Everything WebTester, LichessBoard, LichessTester
+    and LichessEngine do goes through execute, so every command is seen, with the tester method that issued it.
+
+    tracer = CommandTracer()
+    tracer.attach(lichess_website_tester.driver, "puzzle")
+    ...
+    tracer.export_json("trace_summary.json")
+    tracer.export_chrome_trace("trace.json")     # chrome://tracing or https://ui.perfetto.dev
+
+    Aggregates are always kept. Raw events are kept up to max_events (0 disables them), which bounds the
+    memory of long soak runs """
+    by_command = None
+    by_caller = None
+    events = None
+
+    def __init__(self, max_events=MAX_EVENTS):
+        self.by_command = dict()
+        self.by_caller = dict()
+        self.events = deque(maxlen=max_events) if max_events else None
+        self.sessions = dict()
+        self.caller_names = dict()
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def attach(self, driver, name=None):
+        """ Start tracing a session. name labels its commands (e.g. "puzzle" or "engine") """
+        if id(driver) in self.sessions:
+            return
+        original_execute = driver.execute
+        session = name if name is not None else "session{}".format(len(self.sessions) + 1)
+        tracer = self
+
+        def execute(driver_command, params=None):
+            caller = tracer.find_caller(sys._getframe(1))
+            start = time.perf_counter()
+            error = None
+            response = None
+            try:
+                response = original_execute(driver_command, params)
+                return response
+            except Exception as exception:
+                error = type(exception).__name__
+                raise
+            finally:
+                tracer.record(session, driver_command, caller, start, time.perf_counter(), params,
+                              response.get("value") if isinstance(response, dict) else None, error)
+
+        driver.execute = execute
+        self.sessions[id(driver)] = (driver, session)
+
+    def detach(self, driver):
+        """ Stop tracing a session """
+        if self.sessions.pop(id(driver), None) is not None:
+            del driver.execute
+
+    def find_caller(self, frame):
+        """ Return the name of the tester method a command comes from, e.g. 'update_board_state' """
+        fallback = None
+        while frame is not None:
+            code = frame.f_code
+            name = self.caller_names.get(code)
+            if name is None:
+                name = code.co_name if os.path.basename(code.co_filename) in TESTER_FILES else ""
+                self.caller_names[code] = name
+            if name:
+                if name not in GENERIC_CALLERS:
+                    return name
+                if fallback is None:
+                    fallback = name
+            frame = frame.f_back
+        return fallback or "unknown"
+
+    def record(self, session, driver_command, caller, start, end, params, value, error):
+        milliseconds = 1000*(end - start)
+        request_bytes = payload_size(params)
+        response_bytes = payload_size(value)
+        with self.lock:
+            for table, key in ((self.by_command, driver_command), (self.by_caller, caller)):
+                histogram = table.get(key)
+                if histogram is None:
+                    histogram = table[key] = Histogram()
+                histogram.add(milliseconds, request_bytes, response_bytes, error)
+            if self.events is not None:
+                self.events.append((session, driver_command, caller, start, end, request_bytes, response_bytes, error))
+
+    def get_summary(self):
+        """ Return the per-command and per-caller histograms as a dictionary """
+        with self.lock:
+            return {
+                "commands": {name: histogram.as_dict() for name, histogram in sorted(self.by_command.items())},
+                "callers": {name: histogram.as_dict() for name, histogram in sorted(self.by_caller.items())},
+                "bucket_bounds_ms": list(BUCKET_BOUNDS_MS)
+            }
+
+    def export_json(self, path):
+        with open(path, "w") as summary_file:
+            json.dump(self.get_summary(), summary_file, indent=2)
+
+    def export_chrome_trace(self, path):
+        """ Write the raw events in the Chrome trace-event format, one track per session """
+        with self.lock:
+            events = list(self.events or ())
+        pid = os.getpid()
+        sessions = sorted({event[0] for event in events})
+        trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": index, "args": {"name": session}}
+                 for index, session in enumerate(sessions)]
+        for session, driver_command, caller, start, end, request_bytes, response_bytes, error in events:
+            trace.append({
+                "name": driver_command,
+                "cat": caller,
+                "ph": "X",
+                "ts": 1e6*(start - self.origin),
+                "dur": 1e6*(end - start),
+                "pid": pid,
+                "tid": sessions.index(session),
+                "args": {"caller": caller, "request_bytes": request_bytes, "response_bytes": response_bytes,
+                         "error": error}
+            })
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, trace_file)
+
+    def print_summary(self, limit=15):
+        """ Print the callers that spent the most time in WebDriver commands """
+        summary = self.get_summary()["callers"]
+        print("{:<28}{:>8}{:>12}{:>10}{:>10}{:>10}".format("caller", "calls", "total ms", "mean ms", "p95 ms",
+                                                          "max ms"))
+        for name, stats in sorted(summary.items(), key=lambda item: -item[1]["total_ms"])[:limit]:
+            print("{:<28}{:>8}{:>12.1f}{:>10.2f}{:>10.1f}{:>10.1f}".format(
+                name, stats["count"], stats["total_ms"], stats["mean_ms"], stats["p95_ms"], stats["max_ms"]))
@@ -0,0 +1,298 @@
+# Lichess.org Testing with Selenium
+# Condition-driven waits used in place of fixed time.sleep delays
+
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, \
+    JavascriptException, TimeoutException
+from selenium.webdriver.common.by import By
+import threading
+import time
+
+
+MIN_POLL_SECONDS = 0.01     # first poll happens almost immediately, most steps are ready within a few frames
+MAX_POLL_SECONDS = 0.25     # never sleep longer than this between two polls
+POLL_BACKOFF = 1.5          # poll interval grows geometrically while a condition stays false
+LATENCY_SMOOTHING = 0.2     # weight of the newest sample in the per-step latency average
+
+# Timeout budget (seconds) for each named step of play(). Unknown steps fall back to the waiter's default timeout
+STEP_TIMEOUTS = {
+    "page_ready": 10,
+    "sign_in": 15,
+    "puzzle_ready": 10,
+    "puzzle_reply": 5,
+    "engine_import": 10,
+    "engine_pv": 10,
+    "engine_ready": 10,
+    "engine_move": 5,
+}
+
+
+# Each script makes exactly one WebDriver round-trip and returns None when its element is not on the page
+BOARD_SIGNATURE_SCRIPT = """
+var board = document.querySelector(arguments[0]);
+if (!board) return null;
+var keys = [];
+for (var i = 0; i < board.children.length; i++) {
+    var node = board.children[i];
+    keys.push(node.className + ':' + (node.cgKey || ''));
+}
+return keys.join(',');
+"""
+
+LAST_MOVE_SCRIPT = """
+var board = document.querySelector(arguments[0]);
+if (!board) return null;
+var keys = [];
+for (var i = 0; i < board.children.length; i++) {
+    var node = board.children[i];
+    if (node.className === 'last-move') keys.push(node.cgKey);
+}
+return keys;
+"""
+
+PV_TEXT_SCRIPT = """
+var pv = document.querySelector(arguments[0]);
+if (!pv || pv.childNodes.length < 3) return null;
+var text = pv.innerText.trim();
+return text.length > 0 ? text : null;
+"""
+
+# lichess.org puts the first move of a principal variation, in UCI notation, in the line's data-uci attribute
+PV_UCI_SCRIPT = """
+var pv = document.querySelector(arguments[0]);
+if (!pv) return null;
+var uci = pv.getAttribute('data-uci');
+return uci ? uci.split(' ')[0] : null;
+"""
+
+VISIBLE_SCRIPT = """
+var element = document.querySelector(arguments[0]);
+return !!element && element.getClientRects().length > 0;
+"""
+
+PLY_COUNT_SCRIPT = """
+var table = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+if (!table) return null;
+var plies = 0;
+for (var i = 0; i < table.children.length; i++) {
+    if (table.children[i].localName === 'move') plies++;
+}
+return plies;
+"""
+
+PLAYERS_TURN_SCRIPT = """
+var table = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+var wrap = document.querySelector(arguments[1]);
+if (!table || !wrap) return false;
+var plies = 0;
+for (var i = 0; i < table.children.length; i++) {
+    if (table.children[i].localName === 'move') plies++;
+}
+if (plies === 0) return false;
+return (plies % 2 === 0) === wrap.classList.contains('orientation-white');
+"""
+
+
+class WaitCancelled(Exception):
+    """ Raised by Waiter.until when its cancel event is set while it polls """
+    pass
+
+
+def run_script(driver, script, *args):
+    """ Run a probe script, treating a page that is mid-render as 'not ready yet' """
+    try:
+        return driver.execute_script(script, *args)
+    except (JavascriptException, StaleElementReferenceException, NoSuchElementException):
+        return None
+
+
+def board_signature(driver, board_css):
+    """ Return a string that changes whenever a piece or highlight on the cg-board changes """
+    return run_script(driver, BOARD_SIGNATURE_SCRIPT, board_css)
+
+
+def last_move_squares(driver, board_css):
+    """ Return the cgKeys of the last-move highlight squares, e.g. ['e4', 'e2'] """
+    return run_script(driver, LAST_MOVE_SCRIPT, board_css)
+
+
+def pv_text(driver, pv_css):
+    """ Return the text of the engine's principal variation line, or None while it is empty """
+    return run_script(driver, PV_TEXT_SCRIPT, pv_css)
+
+
+def pv_uci(driver, pv_css):
+    """ Return the first move of the engine's principal variation in UCI notation (e.g. 'h5f7'), or None """
+    return run_script(driver, PV_UCI_SCRIPT, pv_css)
+
+
+def ply_count(driver, moves_xpath):
+    """ Return the number of half-moves listed in a moves table """
+    return run_script(driver, PLY_COUNT_SCRIPT, moves_xpath)
+
+
+class Condition:
+    """ A named predicate over the driver. Conditions compose with &, | and ~ """
+
+    def __init__(self, name, predicate):
+        self.name = name
+        self.predicate = predicate
+
+    def __call__(self, driver):
+        """ Evaluate the predicate. A falsy result means 'keep waiting', a truthy one is returned to the caller """
+        try:
+            return self.predicate(driver)
+        except (NoSuchElementException, StaleElementReferenceException):
+            return False
+
+    def __and__(self, other):
+        return Condition("({} and {})".format(self.name, other.name),
+                         lambda driver: self(driver) and other(driver))
+
+    def __or__(self, other):
+        return Condition("({} or {})".format(self.name, other.name),
+                         lambda driver: self(driver) or other(driver))
+
+    def __invert__(self):
+        return Condition("not {}".format(self.name), lambda driver: not self(driver))
+
+    def __repr__(self):
+        return "Condition({})".format(self.name)
+
+
+def element_present(xpath):
+    """ The element given by its xpath is in the DOM """
+    return Condition("present {}".format(xpath),
+                     lambda driver: len(driver.find_elements(By.XPATH, xpath)) > 0)
+
+
+def element_located(by, selector):
+    """ The element of a (By, selector) locator is in the DOM. Its value is the element """
+    def predicate(driver):
+        elements = driver.find_elements(by, selector)
+        return elements[0] if elements else False
+    return Condition("located {}".format(selector), predicate)
+
+
+def element_visible(css):
+    """ The element given by its css selector is in the DOM and rendered """
+    return Condition("visible {}".format(css), lambda driver: run_script(driver, VISIBLE_SCRIPT, css))
+
+
+def url_contains(fragment):
+    """ The window shows a url containing fragment, e.g. after a click that navigates """
+    return Condition("url contains {}".format(fragment), lambda driver: fragment in driver.current_url)
+
+
+def window_count(count):
+    """ The browser has at least count windows, e.g. after a link opened a new tab """
+    return Condition("{} windows".format(count), lambda driver: len(driver.window_handles) >= count)
+
+
+def board_changed(board_css, previous_signature):
+    """ The cg-board no longer matches a signature taken earlier with board_signature() """
+    def predicate(driver):
+        signature = board_signature(driver, board_css)
+        return signature is not None and signature != previous_signature
+    return Condition("cg-board changed", predicate)
+
+
+def last_move_present(board_css, *excluded):
+    """ Two last-move squares are highlighted and they differ from every excluded pair of cgKeys.
+    Evaluates to the list of highlighted cgKeys """
+    excluded_pairs = [frozenset(pair) for pair in excluded if pair]
+
+    def predicate(driver):
+        keys = last_move_squares(driver, board_css)
+        if not keys or len(keys) != 2 or frozenset(keys) in excluded_pairs:
+            return False
+        return keys
+    return Condition("new last-move squares", predicate)
+
+
+def engine_pv_populated(pv_css, previous_text=None):
+    """ The engine shows a principal variation that differs from previous_text. Evaluates to the PV text """
+    def predicate(driver):
+        text = pv_text(driver, pv_css)
+        if text is None or text == previous_text:
+            return False
+        return text
+    return Condition("engine PV populated", predicate)
+
+
+def plies_at_least(moves_xpath, count):
+    """ The moves table lists at least `count` half-moves """
+    def predicate(driver):
+        plies = ply_count(driver, moves_xpath)
+        return plies is not None and plies >= count
+    return Condition("{} plies in moves table".format(count), predicate)
+
+
+def players_turn(moves_xpath, orientation_css):
+    """ The moves table parity says it is the turn of the side the board is oriented towards """
+    def predicate(driver):
+        turn = run_script(driver, PLAYERS_TURN_SCRIPT, moves_xpath, orientation_css)
+        return bool(turn)
+    return Condition("player's turn", predicate)
+
+
+class Waiter:
+    """ Polls conditions with an adaptive interval and a timeout budget per step.
+    Setting cancel, a threading.Event, makes a wait running on another thread give up at its next poll """
+    driver = None
+    default_timeout = None
+    step_timeouts = None
+    step_latency = None
+    cancel = None
+
+    def __init__(self, driver, default_timeout, step_timeouts=None):
+        self.driver = driver
+        self.default_timeout = default_timeout
+        self.step_timeouts = dict(STEP_TIMEOUTS)
+        if step_timeouts:
+            self.step_timeouts.update(step_timeouts)
+        self.step_latency = dict()
+        self.total_wait = 0.0
+        self.cancel = threading.Event()
+
+    def first_poll_interval(self, step):
+        """ Start polling at a quarter of the step's usual latency so fast steps are caught early
+        without hammering the driver on slow ones """
+        expected = self.step_latency.get(step)
+        if expected is None:
+            return MIN_POLL_SECONDS
+        return min(max(expected/4, MIN_POLL_SECONDS), MAX_POLL_SECONDS)
+
+    def record_latency(self, step, elapsed):
+        """ Keep an exponential moving average of how long each step takes """
+        if step is None:
+            return
+        previous = self.step_latency.get(step)
+        if previous is None:
+            self.step_latency[step] = elapsed
+        else:
+            self.step_latency[step] = previous + LATENCY_SMOOTHING*(elapsed - previous)
+
+    def until(self, condition, step=None, timeout=None, max_interval=MAX_POLL_SECONDS):
+        """ Poll the condition until it is truthy and return its value. The poll interval never grows past
+        max_interval. Raises TimeoutException when the step's budget runs out """
+        if timeout is None:
+            timeout = self.step_timeouts.get(step, self.default_timeout)
+        start = time.perf_counter()
+        deadline = start + timeout
+        interval = min(self.first_poll_interval(step), max_interval)
+
+        while True:
+            if self.cancel.is_set():
+                raise WaitCancelled("Cancelled while waiting for {} (step: {})".format(condition.name, step))
+            value = condition(self.driver)
+            now = time.perf_counter()
+            if value:
+                self.record_latency(step, now - start)
+                self.total_wait += now - start
+                return value
+            if now >= deadline:
+                self.total_wait += now - start
+                raise TimeoutException("Timed out after {:.2f}s waiting for {} (step: {})".format(
+                    now - start, condition.name, step))
+            self.cancel.wait(min(interval, deadline - now))
+            interval = min(interval*POLL_BACKOFF, max_interval)